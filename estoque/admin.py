@@ -1,19 +1,38 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
-from .models import Produto, Fornecedor, Movimentacao, LogAtividade
+from .auditoria import operacao_em_lote
+from .models import (
+    Produto, Fornecedor, Movimentacao, LogAtividade, TarefaImportacao,
+    SaldoDiario, SugestaoReposicao
+)
+
+
+class ExclusaoEmLoteMixin:
+    """Exclusão pela ação do admin com um único log de resumo"""
+
+    def delete_queryset(self, request, queryset):
+        with operacao_em_lote(
+            usuario=request.user,
+            descricao=f'Exclusão em lote pelo admin '
+                      f'({self.model._meta.verbose_name_plural})'
+        ):
+            super().delete_queryset(request, queryset)
 
 
 @admin.register(Produto)
-class ProdutoAdmin(admin.ModelAdmin):
+class ProdutoAdmin(ExclusaoEmLoteMixin, admin.ModelAdmin):
     list_display = (
         'nome', 'categoria', 'quantidade',
         'valor_unitario', 'status_estoque', 'atualizado_em'
     )
-    list_filter = ('categoria', 'quantidade_minima')
+    list_filter = ('categoria', 'estoque_baixo', 'quantidade_minima')
     search_fields = ('nome', 'nome_normalizado')
     list_editable = ('quantidade', 'valor_unitario')
-    readonly_fields = ('valor_total_estoque', 'atualizado_em')
+    readonly_fields = (
+        'valor_total_estoque', 'custo_medio', 'quantidade_comprada',
+        'valor_comprado', 'criado_em', 'atualizado_em'
+    )
     fieldsets = (
         (None, {
             'fields': ('nome', 'categoria', 'imagem')
@@ -26,6 +45,9 @@ class ProdutoAdmin(admin.ModelAdmin):
                 'valor_total_estoque'
             )
         }),
+        (_('Custo'), {
+            'fields': ('custo_medio', 'quantidade_comprada', 'valor_comprado')
+        }),
         (_('Datas'), {
             'fields': ('criado_em', 'atualizado_em'),
             'classes': ('collapse',)
@@ -46,7 +68,7 @@ class ProdutoAdmin(admin.ModelAdmin):
 
 
 @admin.register(Fornecedor)
-class FornecedorAdmin(admin.ModelAdmin):
+class FornecedorAdmin(ExclusaoEmLoteMixin, admin.ModelAdmin):
     list_display = (
         'nome_empresa', 'categoria', 'nome_contato',
         'email', 'telefone', 'ativo'
@@ -89,6 +111,36 @@ class MovimentacaoAdmin(admin.ModelAdmin):
     valor_total.short_description = _('Valor Total')
 
 
+@admin.register(SaldoDiario)
+class SaldoDiarioAdmin(admin.ModelAdmin):
+    list_display = ('data', 'produto', 'quantidade')
+    search_fields = ('produto__nome',)
+    date_hierarchy = 'data'
+    list_select_related = ('produto',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SugestaoReposicao)
+class SugestaoReposicaoAdmin(admin.ModelAdmin):
+    list_display = (
+        'produto', 'demanda_media_diaria', 'estoque_seguranca',
+        'ponto_reposicao', 'estoque_alvo', 'calculado_em'
+    )
+    search_fields = ('produto__nome',)
+    list_select_related = ('produto',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(LogAtividade)
 class LogAtividadeAdmin(admin.ModelAdmin):
     list_display = ('data_hora', 'usuario', 'acao',
@@ -103,3 +155,18 @@ class LogAtividadeAdmin(admin.ModelAdmin):
 
     def has_change_permission(self, request, obj=None):
         return False
+
+
+@admin.register(TarefaImportacao)
+class TarefaImportacaoAdmin(admin.ModelAdmin):
+    list_display = ('criado_em', 'usuario', 'status', 'modo',
+                    'ultima_linha', 'total_linhas', 'importados',
+                    'atualizados')
+    list_filter = ('status', 'modo')
+    readonly_fields = ('usuario', 'modo', 'ultima_linha', 'total_linhas',
+                       'importados', 'atualizados', 'erros', 'mensagem',
+                       'criado_em', 'atualizado_em')
+    date_hierarchy = 'criado_em'
+
+    def has_add_permission(self, request):
+        return False
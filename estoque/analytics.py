@@ -0,0 +1,170 @@
+"""
+Séries do painel de relatórios (AnalyticsView).
+
+Cada função devolve dados simples (listas, dicts, números), prontos para
+o template ou para guardar no cache (cache_analytics). As que dependem
+de movimentações leem só os resumos diários (ResumoMovimentacao e
+ResumoFornecedor), não Movimentacao.
+"""
+from decimal import Decimal
+from functools import partial
+from django.db.models import (
+    DecimalField, ExpressionWrapper, F, FilteredRelation, Q, Sum, Value
+)
+from django.db.models.functions import Coalesce
+from . import cache_analytics, indicadores
+from .models import Produto, ResumoMovimentacao, ResumoFornecedor
+
+# Valor em estoque de cada produto, calculado no banco
+VALOR_ESTOQUE = ExpressionWrapper(
+    F('quantidade') * F('valor_unitario'),
+    output_field=DecimalField(max_digits=16, decimal_places=2)
+)
+
+PERIODOS = {
+    'anual': lambda dia: dia.replace(month=1, day=1),
+    'mensal': lambda dia: dia.replace(day=1),
+    'quinzenal': lambda dia: dia,
+}
+
+
+def totais():
+    return {
+        'total_estoque': Produto.objects.aggregate(
+            total=Sum('quantidade'))['total'] or 0,
+        'baixo_estoque': Produto.objects.filter(estoque_baixo=True).count(),
+    }
+
+
+def valor_por_categoria():
+    """Valor em estoque por categoria e o total, numa só consulta"""
+    rotulos = dict(Produto.CategoriaProduto.choices)
+    categorias = [
+        {
+            'categoria': categoria,
+            'rotulo': str(rotulos.get(categoria, categoria)),
+            'valor': (valor or Decimal('0')).quantize(Decimal('0.01')),
+        }
+        for categoria, valor in Produto.objects.values(
+            'categoria'
+        ).annotate(
+            valor=Sum(VALOR_ESTOQUE)
+        ).order_by('-valor').values_list('categoria', 'valor')
+    ]
+    return {
+        'total': sum((c['valor'] for c in categorias), Decimal('0')),
+        'categorias': categorias,
+    }
+
+
+def baixo_estoque(limite=10):
+    """Produtos no mínimo ou abaixo, os mais distantes do mínimo primeiro"""
+    return list(Produto.objects.filter(
+        estoque_baixo=True
+    ).order_by(
+        F('quantidade') - F('quantidade_minima'), 'nome'
+    ).values('id', 'nome', 'quantidade', 'quantidade_minima')[:limite])
+
+
+def _intervalo(inicio, fim, prefixo=''):
+    filtro = Q()
+    if inicio:
+        filtro &= Q(**{f'{prefixo}data__gte': inicio})
+    if fim:
+        filtro &= Q(**{f'{prefixo}data__lte': fim})
+    return filtro
+
+
+def rotatividade(inicio=None, fim=None, limite=10, menos=False):
+    """
+    Os limite produtos mais movimentados entre inicio e fim (datas,
+    inclusivas; None = sem limite), com quantidade e valor movimentados.
+
+    Com menos=True devolve os menos movimentados, incluindo os que não
+    tiveram nenhuma movimentação no intervalo (estoque parado).
+    """
+    if not menos:
+        # Só os resumos do intervalo (índice data, tipo), já agrupados
+        return list(ResumoMovimentacao.objects.filter(
+            _intervalo(inicio, fim)
+        ).values(
+            'produto', nome=F('produto__nome')
+        ).annotate(
+            total_movimentos=Sum('movimentacoes'),
+            total_quantidade=Sum('quantidade'),
+            total_valor=Sum('valor'),
+        ).order_by('-total_movimentos', 'nome')[:limite])
+
+    # LEFT JOIN com os resumos do intervalo: sem movimentação conta 0
+    return list(Produto.objects.annotate(periodo=FilteredRelation(
+        'resumos', condition=_intervalo(inicio, fim, 'resumos__')
+    )).values(
+        'nome', produto=F('pk')
+    ).annotate(
+        total_movimentos=Coalesce(Sum('periodo__movimentacoes'), 0),
+        total_quantidade=Coalesce(Sum('periodo__quantidade'), 0),
+        total_valor=Coalesce(
+            Sum('periodo__valor'), Value(Decimal('0')),
+            output_field=DecimalField()),
+    ).order_by('total_movimentos', 'nome')[:limite])
+
+
+def historico(periodo='mensal'):
+    """
+    Quantidade movimentada por período. O banco agrupa por dia e os dias
+    são juntados por período aqui (evita truncar data a data no SQL).
+    """
+    inicio_periodo = PERIODOS.get(periodo, PERIODOS['mensal'])
+    totais = {}
+    for dia, total in ResumoMovimentacao.objects.values(
+        'data'
+    ).annotate(total=Sum('quantidade')).values_list('data', 'total'):
+        chave = inicio_periodo(dia)
+        totais[chave] = totais.get(chave, 0) + total
+    return [
+        {'periodo': dia, 'total': totais[dia]} for dia in sorted(totais)
+    ]
+
+
+def compras_por_fornecedor():
+    return list(ResumoFornecedor.objects.values(
+        'fornecedor__nome_empresa'
+    ).annotate(
+        total_compras=Sum('valor')
+    ).order_by('-total_compras'))
+
+
+def tabela_indicadores(inicio=None, fim=None):
+    """
+    DataFrame de indicadores.indicadores() para o período, em cache: a
+    curva ABC, a menor cobertura e o CSV partem da mesma tabela
+    """
+    inicio, fim = indicadores.periodo(inicio, fim)
+    return cache_analytics.obter(
+        'indicadores', (inicio, fim),
+        lambda: indicadores.indicadores(inicio, fim))
+
+
+def curva_abc(inicio=None, fim=None):
+    return indicadores.curva_abc(tabela_indicadores(inicio, fim))
+
+
+def menor_cobertura(inicio=None, fim=None, limite=10):
+    return indicadores.menor_cobertura(
+        tabela_indicadores(inicio, fim), limite)
+
+
+# Séries servidas pelo painel e pela API (AnalyticsSerieView): função e
+# os filtros de FiltroAnalyticsForm que ela usa, na ordem dos argumentos
+SERIES = {
+    'totais': (totais, ()),
+    'valor_estoque': (valor_por_categoria, ()),
+    'baixo_estoque': (baixo_estoque, ('n',)),
+    'rotatividade': (rotatividade, ('inicio', 'fim', 'n')),
+    'estoque_parado': (
+        partial(rotatividade, menos=True), ('inicio', 'fim', 'n')),
+    'historico': (historico, ('periodo',)),
+    'fornecedores': (compras_por_fornecedor, ()),
+    'abc': (curva_abc, ('inicio', 'fim')),
+    'cobertura': (menor_cobertura, ('inicio', 'fim', 'n')),
+}
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EstoqueConfig(AppConfig):
@@ -7,3 +8,8 @@ class EstoqueConfig(AppConfig):
 
     def ready(self):
         import estoque.signals
+
+        if getattr(settings, 'AUDITORIA_GRAVADOR_EM_SEGUNDO_PLANO', False):
+            from estoque.auditoria import iniciar_gravador
+            iniciar_gravador(
+                getattr(settings, 'AUDITORIA_GRAVADOR_INTERVALO', 2.0))
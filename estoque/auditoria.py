@@ -0,0 +1,213 @@
+"""
+Gravação dos logs de auditoria (LogAtividade) em lote.
+
+registrar() não escreve no banco na hora: a entrada só é confirmada
+quando a transação corrente faz commit (transaction.on_commit), então
+entradas de transações desfeitas (inclusive savepoints) são descartadas
+pelo próprio Django. As entradas confirmadas são acumuladas e gravadas
+com um único bulk_create:
+
+- ao fim da requisição, pelo AuditoriaMiddleware;
+- ao fim de um bloco agrupar(), em comandos e tarefas;
+- pelo gravador em segundo plano, se estiver ativo
+  (AUDITORIA_GRAVADOR_EM_SEGUNDO_PLANO = True);
+- ou logo após o commit, uma a uma, se nada disso estiver ativo.
+"""
+import atexit
+import logging
+import queue
+import threading
+from contextlib import ContextDecorator, contextmanager
+from functools import partial
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from . import cache_analytics
+from .models import LogAtividade
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_gravador = None
+
+TAMANHO_LOTE = 500
+
+
+def registrar(usuario, acao, modelo_afetado, objeto_id='', detalhes=None):
+    """Agenda uma entrada de log para quando a transação confirmar"""
+    entrada = LogAtividade(
+        usuario=usuario,
+        acao=acao,
+        modelo_afetado=modelo_afetado,
+        objeto_id='' if objeto_id is None else str(objeto_id),
+        detalhes=detalhes or {},
+        data_hora=timezone.now(),
+    )
+    transaction.on_commit(partial(_confirmar, entrada))
+
+
+def _confirmar(entrada):
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        buffer.append(entrada)
+    elif _gravador is not None:
+        _gravador.enfileirar(entrada)
+    else:
+        gravar([entrada])
+
+
+def gravar(entradas):
+    """Grava as entradas confirmadas de uma vez"""
+    if not entradas:
+        return
+    for entrada in entradas:
+        if not entrada.descricao:
+            entrada.descricao = entrada._gerar_descricao()
+    LogAtividade.objects.bulk_create(entradas, batch_size=TAMANHO_LOTE)
+
+
+@contextmanager
+def agrupar():
+    """Acumula os logs confirmados no bloco e grava todos ao final"""
+    if getattr(_local, 'buffer', None) is not None:
+        yield
+        return
+
+    _local.buffer = []
+    try:
+        yield
+    finally:
+        entradas, _local.buffer = _local.buffer, None
+        try:
+            gravar(entradas)
+        except Exception as e:
+            logger.error(f"Erro ao gravar logs: {str(e)}", exc_info=True)
+
+
+class GravadorAuditoria(threading.Thread):
+    """Thread que grava periodicamente os logs de contextos sem requisição"""
+
+    def __init__(self, intervalo=2.0):
+        super().__init__(name='gravador-auditoria', daemon=True)
+        self.intervalo = intervalo
+        self.fila = queue.Queue()
+        self._parar = threading.Event()
+
+    def enfileirar(self, entrada):
+        self.fila.put(entrada)
+
+    def run(self):
+        while not self._parar.is_set():
+            self._parar.wait(self.intervalo)
+            self.descarregar()
+
+    def descarregar(self):
+        entradas = []
+        while True:
+            try:
+                entradas.append(self.fila.get_nowait())
+            except queue.Empty:
+                break
+        if not entradas:
+            return
+        close_old_connections()
+        try:
+            gravar(entradas)
+        except Exception as e:
+            logger.error(f"Erro ao gravar logs: {str(e)}", exc_info=True)
+
+    def parar(self):
+        self._parar.set()
+        self.descarregar()
+
+
+def iniciar_gravador(intervalo=2.0):
+    """Inicia (uma vez por processo) o gravador em segundo plano"""
+    global _gravador
+    if _gravador is None:
+        _gravador = GravadorAuditoria(intervalo)
+        _gravador.start()
+        atexit.register(_gravador.parar)
+    return _gravador
+
+
+class operacao_em_lote(ContextDecorator):
+    """
+    Silencia os receivers por instância durante operações em massa.
+
+    Enquanto o bloco (ou a função decorada) roda, atualizar_estoque,
+    log_post_save e log_post_delete apenas contam os objetos afetados; ao
+    final é registrado um único LogAtividade com o total e a faixa de ids
+    por modelo e ação, e o cache dos relatórios é invalidado uma vez. O
+    estado fica na thread atual, então silenciar uma requisição não afeta
+    as outras.
+
+    Como atualizar_estoque também é silenciado, quem criar Movimentacao
+    dentro do bloco é responsável por atualizar o estoque.
+
+        with operacao_em_lote(usuario=request.user,
+                              descricao='Exclusão de todos os produtos'):
+            Produto.objects.all().delete()
+    """
+
+    def __init__(self, usuario=None, descricao='', acao=None):
+        self.usuario = usuario
+        self.descricao = descricao
+        self.acao = acao
+
+    def __enter__(self):
+        pilha = getattr(_local, 'operacoes', None)
+        if pilha is None:
+            pilha = _local.operacoes = []
+        lote = ResumoLote()
+        pilha.append(lote)
+        return lote
+
+    def __exit__(self, exc_type, exc, tb):
+        lote = _local.operacoes.pop()
+        if lote.modelos:
+            self._registrar_resumo(lote)
+            cache_analytics.invalidar()
+        return False
+
+    def _registrar_resumo(self, lote):
+        acoes = {acao for contagem in lote.modelos.values()
+                 for acao in contagem}
+        acao = self.acao or (
+            acoes.pop() if len(acoes) == 1 else LogAtividade.Acao.EDICAO)
+        faixa = ''
+        if len(lote.modelos) == 1:
+            (contagem,) = lote.modelos.values()
+            inicio = min(c['id_min'] for c in contagem.values())
+            fim = max(c['id_max'] for c in contagem.values())
+            faixa = str(inicio) if inicio == fim else f'{inicio}-{fim}'
+        registrar(
+            usuario=self.usuario,
+            acao=acao,
+            modelo_afetado=', '.join(lote.modelos)[:50],
+            objeto_id=faixa[:36],
+            detalhes={
+                'operacao_em_lote': True,
+                'descricao': self.descricao,
+                'modelos': lote.modelos,
+            }
+        )
+
+
+class ResumoLote:
+    """Contagem por modelo e ação dos objetos afetados numa operação"""
+
+    def __init__(self):
+        self.modelos = {}
+
+    def contabilizar(self, modelo, acao, pk):
+        contagem = self.modelos.setdefault(modelo.__name__, {}).setdefault(
+            acao, {'total': 0, 'id_min': pk, 'id_max': pk})
+        contagem['total'] += 1
+        contagem['id_min'] = min(contagem['id_min'], pk)
+        contagem['id_max'] = max(contagem['id_max'], pk)
+
+
+def operacao_ativa():
+    """ResumoLote da operação em lote corrente nesta thread, se houver"""
+    pilha = getattr(_local, 'operacoes', None)
+    return pilha[-1] if pilha else None
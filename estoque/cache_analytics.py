@@ -0,0 +1,125 @@
+"""
+Cache versionado dos relatórios.
+
+Toda chave inclui a versão atual; invalidar() só troca a versão (depois
+do commit), e as entradas antigas expiram sozinhas.
+
+Os valores ficam em ANALYTICS_CACHE, por padrão o locmem de cada
+processo, e a versão em ANALYTICS_VERSAO_CACHE, que precisa ser
+compartilhado entre os workers e os comandos de manutenção
+(recalcular_custo_medio, reconstruir_resumos) para que um invalidar()
+chegue a todos. As settings usam um cache em arquivo, que serve a uma
+máquina; com mais de uma, aponte os dois para o redis ou o memcached.
+
+Ler nunca grava: uma consulta custa um get da versão e um do valor, e
+os contadores de acerto e falha ficam na memória do processo. Cada
+escrita custa um set da versão.
+
+Quando uma entrada não existe, só um cálculo por vez (trava com
+cache.add); os demais devolvem o último valor conhecido, mesmo de uma
+versão anterior, ou esperam o cálculo terminar.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+PREFIXO = 'estoque:analytics'
+TEMPO_TRAVA = 30
+ESPERA_MAXIMA = 5.0
+_AUSENTE = object()
+
+# Acertos e falhas deste processo
+_contadores = Counter()
+_trava_contadores = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE', 'default')]
+
+
+def _cache_versao():
+    return caches[getattr(settings, 'ANALYTICS_VERSAO_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 3600)
+
+
+def _contar(nome):
+    with _trava_contadores:
+        _contadores[nome] += 1
+
+
+def versao():
+    # 0 até o primeiro invalidar(); ler a versão não a grava
+    return _cache_versao().get(f'{PREFIXO}:versao', 0)
+
+
+def _trocar_versao():
+    # Um set, não incr: no cache em arquivo o incr lê e grava, e dois
+    # processos podiam gravar o mesmo número
+    _cache_versao().set(f'{PREFIXO}:versao', time.time_ns(), None)
+
+
+def invalidar():
+    """Troca a versão quando a transação corrente confirmar"""
+    # robust: uma falha no cache é registrada em log e não desfaz nem
+    # interrompe quem gravou
+    transaction.on_commit(_trocar_versao, robust=True)
+
+
+def estatisticas():
+    """Versão atual e acertos/falhas deste processo"""
+    with _trava_contadores:
+        acertos = _contadores['acertos']
+        falhas = _contadores['falhas']
+    total = acertos + falhas
+    return {
+        'versao': versao(),
+        'acertos': acertos,
+        'falhas': falhas,
+        'taxa_acerto': round(acertos * 100 / total, 1) if total else 0.0,
+    }
+
+
+def obter(nome, parametros, calcular):
+    """
+    Valor em cache de calcular() para (nome, parametros) na versão atual.
+    """
+    cache = _cache()
+    sufixo = hashlib.md5(repr(parametros).encode()).hexdigest()
+    chave = f'{PREFIXO}:v{versao()}:{nome}:{sufixo}'
+    ultimo = f'{PREFIXO}:ultimo:{nome}:{sufixo}'
+
+    valor = cache.get(chave, _AUSENTE)
+    if valor is not _AUSENTE:
+        _contar('acertos')
+        return valor
+    _contar('falhas')
+
+    trava = f'{chave}:trava'
+    limite = time.monotonic() + ESPERA_MAXIMA
+    while not cache.add(trava, 1, TEMPO_TRAVA):
+        # Outro processo está recalculando esta entrada
+        valor = cache.get(chave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = cache.get(ultimo, _AUSENTE)
+        if valor is not _AUSENTE:
+            return valor
+        if time.monotonic() > limite:
+            return calcular()
+        time.sleep(0.05)
+
+    try:
+        # Quem segurava a trava pode ter acabado de gravar o valor
+        valor = cache.get(chave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = calcular()
+            cache.set_many({chave: valor, ultimo: valor}, _timeout())
+    finally:
+        cache.delete(trava)
+    return valor
@@ -1,9 +1,11 @@
+from decimal import Decimal
 from django import forms
 from django.core.validators import FileExtensionValidator, MinValueValidator
 from django.contrib.auth.forms import UserChangeForm
 from django.contrib.auth.models import User
+from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
-from .models import Produto, Movimentacao, Fornecedor
+from .models import Produto, Movimentacao, Fornecedor, ModoImportacao
 
 
 class ProdutoForm(forms.ModelForm):
@@ -39,6 +41,44 @@ class ProdutoForm(forms.ModelForm):
         self.fields['quantidade_minima'].required = True
 
 
+class SelectBusca(forms.Select):
+    """
+    Select que renderiza só a opção selecionada, em vez do queryset
+    inteiro. As demais opções vêm sob demanda de url_busca (JSON
+    paginado), pelo script estoque/js/busca.js. Na validação, o
+    ModelChoiceField busca apenas o pk enviado.
+    """
+
+    def __init__(self, url_busca, attrs=None):
+        super().__init__(attrs)
+        self.url_busca = url_busca
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-busca-url'] = reverse(self.url_busca)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        campo = self.choices.field
+        opcoes = []
+        if campo.empty_label is not None:
+            opcoes.append(('', campo.empty_label))
+        selecionados = [v for v in value if v not in ('', None)]
+        if selecionados:
+            try:
+                opcoes += [
+                    (obj.pk, campo.label_from_instance(obj))
+                    for obj in campo.queryset.filter(pk__in=selecionados)
+                ]
+            except (ValueError, TypeError):
+                pass  # pk inválido enviado no POST: o campo já acusa o erro
+        return [
+            (None, [self.create_option(
+                name, valor, rotulo, str(valor) in value, indice)], indice)
+            for indice, (valor, rotulo) in enumerate(opcoes)
+        ]
+
+
 class MovimentacaoForm(forms.ModelForm):
     tipo = forms.ChoiceField(
         choices=Movimentacao.TipoMovimentacao.choices,
@@ -55,7 +95,10 @@ class MovimentacaoForm(forms.ModelForm):
             'fornecedor': _('Fornecedor (opcional)')
         }
         widgets = {
-            'produto': forms.Select(attrs={'class': 'form-select'}),
+            'produto': SelectBusca(
+                'buscar_produtos', attrs={'class': 'form-select'}),
+            'fornecedor': SelectBusca(
+                'buscar_fornecedores', attrs={'class': 'form-select'}),
             'quantidade': forms.NumberInput(
                 attrs={'min': '1', 'class': 'form-control'}),
             'preco_unitario': forms.NumberInput(
@@ -72,30 +115,150 @@ class MovimentacaoForm(forms.ModelForm):
             if not cleaned_data.get('fornecedor'):
                 self.add_error('fornecedor', _(
                     'Fornecedor obrigatório para entrada'))
+        elif cleaned_data.get('produto') and cleaned_data.get('quantidade'):
+            # Aviso antecipado; a garantia é o UPDATE condicional do
+            # lançamento, que também cobre saídas simultâneas
+            disponivel = cleaned_data['produto'].quantidade
+            if cleaned_data['quantidade'] > disponivel:
+                self.add_error('quantidade', _(
+                    'Estoque insuficiente: disponível %(disponivel)s'
+                ) % {'disponivel': disponivel})
+        return cleaned_data
+
+
+class MovimentacaoItemForm(forms.Form):
+    """
+    Valida um item do lançamento em lote sem consultar o banco: produto e
+    fornecedor chegam como ids e são carregados juntos pelo serviço.
+    """
+    produto = forms.IntegerField(min_value=1)
+    tipo = forms.ChoiceField(choices=Movimentacao.TipoMovimentacao.choices)
+    quantidade = forms.IntegerField(min_value=1)
+    preco_unitario = forms.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    fornecedor = forms.IntegerField(min_value=1, required=False)
+    chave = forms.CharField(max_length=64, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for campo, erro in self.erros_entre_campos(cleaned_data).items():
+            self.add_error(campo, erro)
+        return cleaned_data
+
+    @staticmethod
+    def erros_entre_campos(cleaned_data):
+        if cleaned_data.get('tipo') == Movimentacao.TipoMovimentacao.ENTRADA:
+            if not cleaned_data.get('fornecedor'):
+                return {'fornecedor': _('Fornecedor obrigatório para entrada')}
+        return {}
+
+    @classmethod
+    def validar(cls, dados):
+        """
+        Mesmo resultado de is_valid(), mas sem instanciar o form (que
+        copia todos os campos) a cada item. Retorna (cleaned_data, erros),
+        com cleaned_data None se houver erros.
+        """
+        cleaned_data, erros = {}, {}
+        for nome, campo in cls.base_fields.items():
+            try:
+                cleaned_data[nome] = campo.clean(dados.get(nome))
+            except forms.ValidationError as e:
+                erros[nome] = list(e.messages)
+        if not erros:
+            erros = {
+                campo: [str(erro)] for campo, erro in
+                cls.erros_entre_campos(cleaned_data).items()
+            }
+        return (None if erros else cleaned_data), erros
+
+
+class FiltroAnalyticsForm(forms.Form):
+    """Filtros do painel (GET). Campos vazios ou inválidos usam o padrão"""
+    PERIODOS = [
+        ('anual', _('Anual')),
+        ('mensal', _('Mensal')),
+        ('quinzenal', _('Quinzenal')),
+    ]
+
+    periodo = forms.ChoiceField(
+        choices=PERIODOS, required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    inicio = forms.DateField(
+        label=_("De"), required=False,
+        widget=forms.DateInput(
+            attrs={'type': 'date', 'class': 'form-control'})
+    )
+    fim = forms.DateField(
+        label=_("Até"), required=False,
+        widget=forms.DateInput(
+            attrs={'type': 'date', 'class': 'form-control'})
+    )
+    n = forms.IntegerField(
+        label=_("Itens"), required=False, min_value=1, max_value=100,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        inicio = cleaned_data.get('inicio')
+        fim = cleaned_data.get('fim')
+        if inicio and fim and inicio > fim:
+            self.add_error('fim', _("A data final deve ser após a inicial"))
         return cleaned_data
 
+    def filtros(self):
+        """Valores válidos, com os padrões no lugar dos inválidos"""
+        # Campos com erro já ficam fora de cleaned_data
+        self.is_valid()
+        dados = self.cleaned_data
+        return {
+            'periodo': dados.get('periodo') or 'mensal',
+            'inicio': dados.get('inicio'),
+            'fim': dados.get('fim'),
+            'n': dados.get('n') or 10,
+        }
+
 
 class ImportarProdutosForm(forms.Form):
     arquivo_excel = forms.FileField(
-        label=_("Arquivo Excel"),
+        label=_("Arquivo (Excel, CSV ou Parquet)"),
         validators=[
             FileExtensionValidator(
-                allowed_extensions=['xlsx'],
-                message=_("Apenas arquivos .xlsx são permitidos!")
+                allowed_extensions=['xlsx', 'csv', 'parquet'],
+                message=_(
+                    "Apenas arquivos .xlsx, .csv ou .parquet são permitidos!")
             )
         ],
         help_text=_(
             "Formato esperado: Colunas devem conter "
             "Nome, Quantidade, Valor Unitário, Categoria"
         ),
-        widget=forms.FileInput(attrs={'accept': '.xlsx'})
+        widget=forms.FileInput(attrs={'accept': '.xlsx,.csv,.parquet'})
+    )
+    modo = forms.ChoiceField(
+        label=_("Modo"),
+        choices=ModoImportacao.choices,
+        initial=ModoImportacao.CRIAR,
+        widget=forms.RadioSelect,
+        help_text=_(
+            "No modo de atualização, produtos com o mesmo nome "
+            "(sem acentos/maiúsculas) são atualizados em vez de duplicados"
+        )
     )
 
     def clean_arquivo_excel(self):
         file = self.cleaned_data['arquivo_excel']
         if file.content_type not in [
             'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            'application/octet-stream'
+            'application/octet-stream',
+            'text/csv',
+            'text/plain',
+            'application/csv',
+            'application/vnd.ms-excel',
+            'application/vnd.apache.parquet',
+            'application/x-parquet',
         ]:
             raise forms.ValidationError(_("Tipo de arquivo inválido"))
         return file
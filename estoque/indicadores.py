@@ -0,0 +1,160 @@
+"""
+Indicadores de estoque por produto: curva ABC, giro, consumo médio diário
+e dias de cobertura.
+
+extrair() traz do banco só colunas (values_list) dos produtos e das
+movimentações do período, já somadas por produto e tipo nos resumos
+diários; calcular() faz todas as contas com arrays do NumPy, sem laço por
+produto, e devolve um DataFrame com uma linha por produto do catálogo.
+curva_abc() e menor_cobertura() resumem essa tabela, calculada uma vez.
+"""
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import FloatField, Sum
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import Movimentacao, Produto, ResumoMovimentacao
+
+# Participação acumulada no valor consumido que fecha as classes A e B
+LIMITES_ABC = (0.80, 0.95)
+
+COLUNAS = [
+    'nome', 'categoria', 'estoque', 'valor_estoque', 'entradas', 'saidas',
+    'valor_consumido', 'participacao_acumulada', 'classe_abc',
+    'consumo_medio_diario', 'dias_cobertura', 'giro',
+]
+
+
+def periodo(inicio=None, fim=None):
+    """Completa o intervalo: por padrão, os últimos INDICADORES_DIAS dias"""
+    dias = getattr(settings, 'INDICADORES_DIAS', 90)
+    fim = fim or timezone.localdate()
+    inicio = inicio or fim - timedelta(days=dias - 1)
+    return inicio, fim
+
+
+def extrair(inicio, fim):
+    """
+    Extrato em colunas: (produtos, movimentos). produtos tem id, nome,
+    categoria, quantidade e valor_unitario; movimentos tem produto, tipo,
+    quantidade e valor somados no intervalo.
+    """
+    produtos = pd.DataFrame.from_records(
+        list(Produto.objects.values_list(
+            'id', 'nome', 'categoria', 'quantidade',
+            Cast('valor_unitario', FloatField()),
+        ).order_by()),
+        columns=['id', 'nome', 'categoria', 'quantidade', 'valor_unitario'],
+    )
+    movimentos = pd.DataFrame.from_records(
+        list(ResumoMovimentacao.objects.filter(
+            data__range=(inicio, fim)
+        ).values_list('produto', 'tipo').annotate(
+            total=Sum('quantidade'),
+            valor=Cast(Sum('valor'), FloatField()),
+        ).values_list('produto', 'tipo', 'total', 'valor').order_by()),
+        columns=['produto', 'tipo', 'quantidade', 'valor'],
+    )
+    return produtos, movimentos
+
+
+def calcular(produtos, movimentos, dias):
+    """
+    Indicadores de todos os produtos em uma passada.
+
+    movimentos pode ter várias linhas por produto e tipo (são somadas).
+    Giro = saídas / estoque médio do período, com o estoque inicial
+    reconstruído a partir do atual. Sem consumo no período, dias de
+    cobertura e giro ficam vazios (NaN) e o produto é classe C.
+    """
+    n = len(produtos)
+    posicoes = pd.Index(produtos['id']).get_indexer(movimentos['produto'])
+    conhecidos = posicoes >= 0
+    saida = conhecidos & (
+        movimentos['tipo'].to_numpy() == Movimentacao.TipoMovimentacao.SAIDA)
+    entrada = conhecidos & ~saida
+    quantidade = movimentos['quantidade'].to_numpy(dtype=float)
+
+    def somar(mascara, valores):
+        return np.bincount(
+            posicoes[mascara], weights=valores[mascara], minlength=n)
+
+    saidas = somar(saida, quantidade)
+    entradas = somar(entrada, quantidade)
+    valor_consumido = somar(saida, movimentos['valor'].to_numpy(dtype=float))
+
+    estoque = produtos['quantidade'].to_numpy(dtype=float)
+    estoque_medio = (2 * estoque - entradas + saidas) / 2
+    consumo_medio = saidas / dias
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_cobertura = np.where(
+            consumo_medio > 0, estoque / consumo_medio, np.nan)
+        giro = np.where(
+            (saidas > 0) & (estoque_medio > 0),
+            saidas / estoque_medio, np.nan)
+
+    # Curva ABC pelo valor consumido: ordena do maior para o menor e
+    # classifica pela participação acumulada antes de cada produto
+    ordem = np.argsort(-valor_consumido, kind='stable')
+    total = valor_consumido.sum()
+    acumulado = np.empty(n)
+    acumulado[ordem] = np.cumsum(valor_consumido[ordem]) / (total or 1)
+    anterior = acumulado - valor_consumido / (total or 1)
+    classe = np.select(
+        [anterior < LIMITES_ABC[0], anterior < LIMITES_ABC[1]],
+        ['A', 'B'], 'C')
+    classe[valor_consumido <= 0] = 'C'
+
+    return pd.DataFrame({
+        'nome': produtos['nome'].to_numpy(),
+        'categoria': produtos['categoria'].to_numpy(),
+        'estoque': estoque.astype('int64'),
+        'valor_estoque': (
+            estoque * produtos['valor_unitario'].to_numpy(dtype=float)
+        ).round(2),
+        'entradas': entradas.astype('int64'),
+        'saidas': saidas.astype('int64'),
+        'valor_consumido': valor_consumido.round(2),
+        'participacao_acumulada': acumulado.round(4),
+        'classe_abc': classe,
+        'consumo_medio_diario': consumo_medio.round(3),
+        'dias_cobertura': dias_cobertura.round(1),
+        'giro': giro.round(2),
+    }, index=pd.Index(produtos['id'].to_numpy(), name='produto'),
+        columns=COLUNAS)
+
+
+def indicadores(inicio=None, fim=None):
+    """DataFrame de calcular() para o intervalo (padrão: periodo())"""
+    inicio, fim = periodo(inicio, fim)
+    return calcular(*extrair(inicio, fim), dias=(fim - inicio).days + 1)
+
+
+def curva_abc(tabela):
+    """Quantidade de produtos e valor consumido por classe ABC"""
+    grupos = tabela.groupby('classe_abc').agg(
+        produtos=('nome', 'size'), valor=('valor_consumido', 'sum'))
+    total = float(grupos['valor'].sum()) or 1
+    return [
+        {
+            'classe': classe,
+            'produtos': int(linha.produtos),
+            'valor': round(float(linha.valor), 2),
+            'participacao': round(float(linha.valor) / total * 100, 1),
+        }
+        for classe, linha in grupos.reindex(
+            ['A', 'B', 'C'], fill_value=0).iterrows()
+    ]
+
+
+def menor_cobertura(tabela, limite=10):
+    """Os produtos com consumo no período que acabam primeiro"""
+    menores = tabela.dropna(subset=['dias_cobertura']).nsmallest(
+        limite, 'dias_cobertura'
+    )[['nome', 'classe_abc', 'estoque', 'consumo_medio_diario',
+       'dias_cobertura', 'giro']].reset_index().astype(object)
+    # Tipos do Python (serializáveis em JSON), com None no lugar de NaN
+    return menores.where(menores.notna(), None).to_dict('records')
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from estoque.models import Produto
+from estoque.services import (
+    IMPORTADORES_POR_EXTENSAO, ImportadorProdutos, pq
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a vazão de leitura (linhas/s) de cada formato de '
+        'importação num arquivo gerado, sem gravar no banco'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=100_000)
+        parser.add_argument('--batch-size', type=int,
+                            default=ImportadorProdutos.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        linhas = options['linhas']
+        df = self._gerar(linhas)
+
+        with tempfile.TemporaryDirectory() as pasta:
+            arquivos = {
+                '.csv': lambda caminho: df.to_csv(caminho, index=False),
+                '.xlsx': lambda caminho: df.to_excel(caminho, index=False),
+            }
+            if pq is not None:
+                arquivos['.parquet'] = lambda caminho: df.to_parquet(
+                    caminho, index=False)
+            else:
+                self.stdout.write(self.style.WARNING(
+                    'pyarrow não instalado: Parquet fora da comparação'))
+
+            self.stdout.write(
+                f"{'Formato':<10}{'Tamanho':>12}{'Leitura':>12}"
+                f"{'Linhas/s':>14}")
+            for extensao, gerar in arquivos.items():
+                caminho = os.path.join(pasta, f'produtos{extensao}')
+                gerar(caminho)
+                tamanho = os.path.getsize(caminho) / (1024 * 1024)
+
+                inicio = time.perf_counter()
+                lidas = self._ler(extensao, caminho, options['batch_size'])
+                duracao = time.perf_counter() - inicio
+
+                if lidas != linhas:
+                    self.stderr.write(
+                        f"{extensao}: {lidas} linhas lidas de {linhas}")
+                self.stdout.write(
+                    f"{extensao:<10}{tamanho:>10.1f}MB{duracao:>11.2f}s"
+                    f"{lidas / duracao:>14,.0f}"
+                )
+
+    def _gerar(self, linhas):
+        rng = np.random.default_rng(42)
+        return pd.DataFrame({
+            'Nome': [f'Produto de teste {i}' for i in range(linhas)],
+            'Quantidade': rng.integers(0, 500, linhas),
+            'Valor Unitário': rng.uniform(1, 300, linhas).round(2),
+            'Categoria': rng.choice(Produto.CategoriaProduto.values, linhas),
+        })
+
+    def _ler(self, extensao, caminho, batch_size):
+        with open(caminho, 'rb') as arquivo:
+            importador = IMPORTADORES_POR_EXTENSAO[extensao](
+                arquivo, batch_size=batch_size)
+            return sum(len(lote) for lote in importador._ler_lotes())
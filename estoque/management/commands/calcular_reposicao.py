@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from estoque.reposicao import atualizar_sugestoes, parametros
+
+
+class Command(BaseCommand):
+    help = (
+        'Calcula ponto de reposição e estoque alvo de todos os produtos a '
+        'partir do histórico de saídas e grava as sugestões'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int,
+            help='Dias de histórico para a média móvel da demanda')
+        parser.add_argument(
+            '--prazo', type=int, help='Prazo de entrega do fornecedor (dias)')
+        parser.add_argument(
+            '--fator-servico', type=float,
+            help='Fator z do nível de serviço (1,65 = 95%%)')
+        parser.add_argument(
+            '--ciclo', type=int,
+            help='Dias de demanda cobertos por pedido, além do ponto')
+
+    def handle(self, *args, **options):
+        opcoes = parametros(
+            dias=options['dias'],
+            prazo=options['prazo'],
+            fator_servico=options['fator_servico'],
+            ciclo=options['ciclo'],
+        )
+        inicio = time.perf_counter()
+        total = atualizar_sugestoes(**opcoes)
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} sugestões gravadas em "
+            f"{time.perf_counter() - inicio:.2f}s ({opcoes})"))
@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from estoque.services import recalcular_custos
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula o custo médio móvel de todos os produtos reaplicando '
+        'as movimentações registradas'
+    )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        total = recalcular_custos()
+        self.stdout.write(self.style.SUCCESS(
+            f"Custo médio de {total} produtos recalculado em "
+            f"{time.perf_counter() - inicio:.2f}s"))
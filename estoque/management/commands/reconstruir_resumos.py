@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from estoque.services import reconstruir_resumos
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstrói os resumos de movimentação usados nos relatórios a '
+        'partir do histórico'
+    )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        produtos, fornecedores = reconstruir_resumos()
+        self.stdout.write(self.style.SUCCESS(
+            f"{produtos} resumos por produto e {fornecedores} por fornecedor "
+            f"gravados em {time.perf_counter() - inicio:.2f}s"))
@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from estoque.services import reconstruir_saldos_diarios
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstrói os saldos diários de estoque a partir do histórico '
+        'de movimentações'
+    )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        total = reconstruir_saldos_diarios()
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} saldos diários gravados em "
+            f"{time.perf_counter() - inicio:.2f}s"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from estoque.tarefas import aguardar_conclusao, retomar_pendentes
+
+
+class Command(BaseCommand):
+    help = 'Retoma importações pendentes ou interrompidas no meio'
+
+    def handle(self, *args, **options):
+        total = retomar_pendentes()
+        aguardar_conclusao()
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} importações retomadas"))
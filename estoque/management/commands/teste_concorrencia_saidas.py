@@ -0,0 +1,102 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from estoque.models import Movimentacao, Produto
+from estoque.services import EstoqueInsuficiente
+
+
+class Command(BaseCommand):
+    help = (
+        'Dispara N saídas simultâneas contra um produto e mostra '
+        'quantas passaram, quantas foram recusadas e a latência p95'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--saidas', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--quantidade', type=int, default=1)
+        parser.add_argument(
+            '--estoque', type=int, default=50,
+            help='Estoque inicial do produto temporário')
+        parser.add_argument(
+            '--produto', type=int,
+            help='Usa um produto existente em vez de criar um temporário')
+
+    def handle(self, *args, **options):
+        if options['produto']:
+            try:
+                produto = Produto.objects.get(pk=options['produto'])
+            except Produto.DoesNotExist:
+                raise CommandError('Produto não encontrado')
+            temporario = False
+        else:
+            produto = Produto.objects.create(
+                nome=f'Teste de concorrência {time.time():.0f}',
+                quantidade=options['estoque'],
+                valor_unitario=1
+            )
+            temporario = True
+
+        inicial = produto.quantidade
+        try:
+            resultados = self._disparar(produto.pk, options)
+            final = Produto.objects.get(pk=produto.pk).quantidade
+        finally:
+            if temporario:
+                produto.delete()
+        self._relatorio(resultados, inicial, final, options['quantidade'])
+
+    def _disparar(self, produto_id, options):
+        def saida(_):
+            inicio = time.perf_counter()
+            try:
+                Movimentacao.objects.create(
+                    produto_id=produto_id,
+                    tipo=Movimentacao.TipoMovimentacao.SAIDA,
+                    quantidade=options['quantidade'],
+                    preco_unitario=1
+                )
+                status = 'ok'
+            except EstoqueInsuficiente:
+                status = 'recusada'
+            except Exception as e:
+                status = f'erro: {type(e).__name__}'
+            finally:
+                connections.close_all()
+            return status, time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            resultados = list(executor.map(saida, range(options['saidas'])))
+        self.duracao = time.perf_counter() - inicio
+        return resultados
+
+    def _relatorio(self, resultados, inicial, final, quantidade):
+        contagem = {}
+        for status, _ in resultados:
+            contagem[status] = contagem.get(status, 0) + 1
+        latencias = sorted(duracao * 1000 for _, duracao in resultados)
+        sucessos = contagem.get('ok', 0)
+
+        self.stdout.write(f"Saídas:       {len(resultados)}")
+        self.stdout.write(f"Aceitas:      {sucessos}")
+        self.stdout.write(f"Recusadas:    {contagem.get('recusada', 0)}")
+        for status, total in contagem.items():
+            if status.startswith('erro'):
+                self.stdout.write(self.style.ERROR(f"{status}: {total}"))
+        self.stdout.write(
+            f"Latência:     p50 {statistics.median(latencias):.1f}ms, "
+            f"p95 {latencias[int(len(latencias) * 0.95) - 1]:.1f}ms")
+        self.stdout.write(
+            f"Vazão:        {len(resultados) / self.duracao:.0f} saídas/s")
+
+        esperado = inicial - sucessos * quantidade
+        if final == esperado and final >= 0:
+            self.stdout.write(self.style.SUCCESS(
+                f"Estoque final {final} confere ({inicial} - "
+                f"{sucessos} x {quantidade})"))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f"Estoque final {final}, esperado {esperado}"))
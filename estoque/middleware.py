@@ -0,0 +1,12 @@
+from . import auditoria
+
+
+class AuditoriaMiddleware:
+    """Grava os logs de auditoria da requisição num único bulk_create"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with auditoria.agrupar():
+            return self.get_response(request)
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 05:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0002_alter_produto_categoria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaImportacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arquivo', models.FileField(upload_to='importacoes/', verbose_name='Arquivo')),
+                ('status', models.CharField(choices=[('P', 'Pendente'), ('A', 'Em andamento'), ('C', 'Concluída'), ('F', 'Falhou')], db_index=True, default='P', max_length=1, verbose_name='Status')),
+                ('total_linhas', models.PositiveIntegerField(blank=True, null=True, verbose_name='Total de Linhas')),
+                ('ultima_linha', models.PositiveIntegerField(default=1, help_text='Linha da planilha até onde a importação foi gravada', verbose_name='Última Linha Confirmada')),
+                ('importados', models.PositiveIntegerField(default=0, verbose_name='Produtos Importados')),
+                ('erros', models.JSONField(blank=True, default=list, verbose_name='Erros')),
+                ('mensagem', models.TextField(blank=True, verbose_name='Mensagem')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='Data de Criação')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Última Atualização')),
+                ('usuario', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Tarefa de Importação',
+                'verbose_name_plural': 'Tarefas de Importação',
+                'ordering': ['-criado_em'],
+            },
+        ),
+    ]
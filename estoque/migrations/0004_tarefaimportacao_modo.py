@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0003_tarefaimportacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarefaimportacao',
+            name='atualizados',
+            field=models.PositiveIntegerField(default=0, verbose_name='Produtos Atualizados'),
+        ),
+        migrations.AddField(
+            model_name='tarefaimportacao',
+            name='modo',
+            field=models.CharField(choices=[('C', 'Criar novos produtos'), ('A', 'Atualizar existentes ou criar (pelo nome)')], default='C', max_length=1, verbose_name='Modo de Importação'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 05:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0004_tarefaimportacao_modo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logatividade',
+            name='data_hora',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='Data/Hora'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 05:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0005_logatividade_data_hora'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimentacao',
+            name='chave_idempotencia',
+            field=models.CharField(blank=True, editable=False, help_text='Identificador enviado pelo cliente para ignorar reenvios', max_length=64, null=True, unique=True, verbose_name='Chave de Idempotência'),
+        ),
+    ]
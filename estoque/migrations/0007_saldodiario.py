@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 06:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0006_movimentacao_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('quantidade', models.IntegerField(verbose_name='Quantidade em Estoque')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_diarios', to='estoque.produto', verbose_name='Produto')),
+            ],
+            options={
+                'verbose_name': 'Saldo Diário',
+                'verbose_name_plural': 'Saldos Diários',
+                'ordering': ['-data'],
+                'constraints': [models.UniqueConstraint(fields=('produto', 'data'), name='saldo_diario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 06:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0007_saldodiario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoFornecedor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('quantidade', models.BigIntegerField(default=0, verbose_name='Quantidade')),
+                ('valor', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Valor Total')),
+                ('movimentacoes', models.PositiveIntegerField(default=0, verbose_name='Movimentações')),
+                ('fornecedor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos', to='estoque.fornecedor', verbose_name='Fornecedor')),
+            ],
+            options={
+                'verbose_name': 'Resumo de Fornecedor',
+                'verbose_name_plural': 'Resumos de Fornecedores',
+                'ordering': ['-data'],
+                'constraints': [models.UniqueConstraint(fields=('fornecedor', 'data'), name='resumo_fornecedor_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResumoMovimentacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(verbose_name='Data')),
+                ('tipo', models.CharField(choices=[('E', 'Entrada'), ('S', 'Saída')], max_length=1, verbose_name='Tipo de Movimentação')),
+                ('quantidade', models.BigIntegerField(default=0, verbose_name='Quantidade')),
+                ('valor', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Valor Total')),
+                ('movimentacoes', models.PositiveIntegerField(default=0, verbose_name='Movimentações')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumos', to='estoque.produto', verbose_name='Produto')),
+            ],
+            options={
+                'verbose_name': 'Resumo de Movimentação',
+                'verbose_name_plural': 'Resumos de Movimentação',
+                'ordering': ['-data'],
+                'indexes': [models.Index(fields=['data', 'tipo'], name='estoque_res_data_0163cf_idx')],
+                'constraints': [models.UniqueConstraint(fields=('produto', 'data', 'tipo'), name='resumo_movimentacao_unico')],
+            },
+        ),
+    ]
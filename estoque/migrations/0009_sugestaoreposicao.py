@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 06:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0008_resumos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SugestaoReposicao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('demanda_media_diaria', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='Demanda Média Diária')),
+                ('desvio_padrao_diario', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='Desvio Padrão Diário')),
+                ('estoque_seguranca', models.PositiveIntegerField(verbose_name='Estoque de Segurança')),
+                ('ponto_reposicao', models.PositiveIntegerField(verbose_name='Ponto de Reposição')),
+                ('estoque_alvo', models.PositiveIntegerField(verbose_name='Estoque Alvo')),
+                ('prazo_entrega', models.PositiveIntegerField(verbose_name='Prazo de Entrega (dias)')),
+                ('calculado_em', models.DateTimeField(verbose_name='Calculado em')),
+                ('produto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sugestao', to='estoque.produto', verbose_name='Produto')),
+            ],
+            options={
+                'verbose_name': 'Sugestão de Reposição',
+                'verbose_name_plural': 'Sugestões de Reposição',
+            },
+        ),
+    ]
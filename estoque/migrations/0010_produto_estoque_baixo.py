@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0009_sugestaoreposicao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='estoque_baixo',
+            field=models.GeneratedField(db_persist=True, expression=models.Q(('quantidade__lte', models.F('quantidade_minima'))), output_field=models.BooleanField(), verbose_name='Estoque Baixo'),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(condition=models.Q(('estoque_baixo', True)), fields=['nome'], name='produto_estoque_baixo_idx'),
+        ),
+    ]
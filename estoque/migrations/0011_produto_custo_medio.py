@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 06:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0010_produto_estoque_baixo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='custo_medio',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, help_text='Média dos preços das entradas, ponderada pela quantidade', max_digits=14, verbose_name='Custo Médio'),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='quantidade_comprada',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Quantidade Comprada'),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='valor_comprado',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=16, verbose_name='Valor Comprado'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0011_produto_custo_medio'),
+    ]
+
+    # O modelo sempre usou max_length=10 (o maior valor é 'SUBLIMAÇÃO');
+    # 0002 tinha gravado 310 por engano
+    operations = [
+        migrations.AlterField(
+            model_name='produto',
+            name='categoria',
+            field=models.CharField(choices=[('TECIDOS', 'Tecidos'), ('SUBLIMAÇÃO', 'Sublimação'), ('TRANSFER', 'Transfer'), ('OUTROS', 'Outros')], default='OUTROS', max_length=10, verbose_name='Categoria'),
+        ),
+    ]
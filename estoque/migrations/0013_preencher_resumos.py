@@ -0,0 +1,61 @@
+from django.db import migrations
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def preencher_resumos(apps, schema_editor):
+    # Mesmo INSERT ... SELECT de services.reconstruir_resumos, escrito
+    # aqui com os modelos históricos: sem ele, os relatórios (que só leem
+    # os resumos) ficariam vazios até alguém rodar o comando
+    Movimentacao = apps.get_model('estoque', 'Movimentacao')
+    ResumoMovimentacao = apps.get_model('estoque', 'ResumoMovimentacao')
+    ResumoFornecedor = apps.get_model('estoque', 'ResumoFornecedor')
+    conexao = schema_editor.connection
+    nome = conexao.ops.quote_name
+
+    valor = Sum(F('quantidade') * F('preco_unitario'))
+    movimentacoes = Movimentacao.objects.using(conexao.alias).order_by()
+    por_produto = movimentacoes.annotate(
+        dia=TruncDate('data')
+    ).values('produto_id', 'dia', 'tipo').annotate(
+        total=Sum('quantidade'), valor_total=valor, n=Count('pk'))
+    por_fornecedor = movimentacoes.filter(
+        tipo='E', fornecedor__isnull=False
+    ).annotate(
+        dia=TruncDate('data')
+    ).values('fornecedor_id', 'dia').annotate(
+        total=Sum('quantidade'), valor_total=valor, n=Count('pk'))
+
+    for modelo, origem, chaves, aliases in (
+        (ResumoMovimentacao, por_produto, ['produto', 'data', 'tipo'],
+         ['produto_id', 'dia', 'tipo']),
+        (ResumoFornecedor, por_fornecedor, ['fornecedor', 'data'],
+         ['fornecedor_id', 'dia']),
+    ):
+        opts = modelo._meta
+        colunas = ', '.join(
+            nome(opts.get_field(campo).column) for campo in
+            [*chaves, 'quantidade', 'valor', 'movimentacoes']
+        )
+        selecao = ', '.join(
+            f"r.{nome(alias)}"
+            for alias in [*aliases, 'total', 'valor_total', 'n']
+        )
+        sql, params = origem.query.sql_with_params()
+        modelo.objects.using(conexao.alias).delete()
+        with conexao.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {nome(opts.db_table)} ({colunas}) "
+                f"SELECT {selecao} FROM ({sql}) r", params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0012_alter_produto_categoria_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            preencher_resumos, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.db.models.functions import TruncDate
+
+
+def preencher_saldos(apps, schema_editor):
+    # Mesma consulta de services.reconstruir_saldos_diarios, escrita aqui
+    # com os modelos históricos: sem ela, estoque_na_data só teria saldos
+    # a partir do deploy. O saldo de cada dia é a quantidade atual menos
+    # a soma acumulada das variações dos dias seguintes
+    Movimentacao = apps.get_model('estoque', 'Movimentacao')
+    Produto = apps.get_model('estoque', 'Produto')
+    SaldoDiario = apps.get_model('estoque', 'SaldoDiario')
+    conexao = schema_editor.connection
+    nome = conexao.ops.quote_name
+
+    variacao = Case(
+        When(tipo='E', then=F('quantidade')),
+        default=-F('quantidade'),
+        output_field=IntegerField(),
+    )
+    por_dia = Movimentacao.objects.using(conexao.alias).order_by().annotate(
+        dia=TruncDate('data')
+    ).values('produto_id', 'dia').annotate(variacao=Sum(variacao))
+    sql_por_dia, params = por_dia.query.sql_with_params()
+
+    saldo = SaldoDiario._meta
+    produto = Produto._meta
+    SaldoDiario.objects.using(conexao.alias).delete()
+    with conexao.cursor() as cursor:
+        cursor.execute(f"""
+            INSERT INTO {nome(saldo.db_table)} (
+                {nome(saldo.get_field('produto').column)},
+                {nome(saldo.get_field('data').column)},
+                {nome(saldo.get_field('quantidade').column)}
+            )
+            SELECT d.produto_id, d.dia,
+                   p.{nome(produto.get_field('quantidade').column)}
+                   - COALESCE(SUM(d.variacao) OVER (
+                         PARTITION BY d.produto_id ORDER BY d.dia DESC
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                     ), 0)
+            FROM ({sql_por_dia}) d
+            JOIN {nome(produto.db_table)} p
+              ON p.{nome(produto.pk.column)} = d.produto_id
+        """, params)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0013_preencher_resumos'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            preencher_saldos, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,66 @@
+from decimal import Decimal
+from django.db import migrations
+from django.db.models import Case, F, IntegerField, Sum, When
+
+
+def preencher_custos(apps, schema_editor):
+    # Mesma conta de services.recalcular_custos, escrita aqui com os
+    # modelos históricos: sem ela, os produtos existentes ficariam com
+    # custo_medio zero até a próxima entrada. Parte do estoque anterior
+    # à primeira movimentação e reaplica o histórico na ordem, cada
+    # entrada ponderada com o estoque em mãos ao custo anterior
+    Movimentacao = apps.get_model('estoque', 'Movimentacao')
+    Produto = apps.get_model('estoque', 'Produto')
+    alias = schema_editor.connection.alias
+    movimentacoes = Movimentacao.objects.using(alias).order_by()
+
+    variacoes = dict(
+        movimentacoes.values('produto').annotate(total=Sum(Case(
+            When(tipo='E', then=F('quantidade')),
+            default=-F('quantidade'),
+            output_field=IntegerField(),
+        ))).values_list('produto', 'total')
+    )
+    estoques = {
+        pk: quantidade - variacoes.get(pk, 0)
+        for pk, quantidade in Produto.objects.using(alias).filter(
+            pk__in=variacoes).values_list('pk', 'quantidade').iterator()
+    }
+    produtos = {}
+    for produto_id, tipo, quantidade, preco in movimentacoes.order_by(
+        'produto', 'data', 'pk'
+    ).values_list(
+        'produto', 'tipo', 'quantidade', 'preco_unitario'
+    ).iterator(chunk_size=5000):
+        estoque = estoques[produto_id]
+        if tipo != 'E':
+            estoques[produto_id] = estoque - quantidade
+            continue
+        produto = produtos.setdefault(produto_id, Produto(
+            pk=produto_id, quantidade_comprada=0, valor_comprado=0,
+            custo_medio=Decimal(0)))
+        valor = quantidade * preco
+        base = estoque if produto.custo_medio > 0 and estoque > 0 else 0
+        produto.custo_medio = (
+            (base * produto.custo_medio + valor) / (base + quantidade)
+        ).quantize(Decimal('0.0001'))
+        produto.quantidade_comprada += quantidade
+        produto.valor_comprado += valor
+        estoques[produto_id] = estoque + quantidade
+
+    Produto.objects.using(alias).bulk_update(
+        produtos.values(),
+        ['quantidade_comprada', 'valor_comprado', 'custo_medio'],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0014_preencher_saldos_diarios'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            preencher_custos, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0015_preencher_custo_medio'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='produto',
+            name='custo_medio',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, help_text='Custo médio móvel: cada entrada é ponderada com o estoque em mãos ao custo anterior', max_digits=14, verbose_name='Custo Médio'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
-from django.db.models import Q, Index
+from django.db import models, transaction
+from django.db.models import F, Q, Index
+from django.db.models.fields.files import FieldFile
 from unidecode import unidecode
 from django.contrib.auth.models import User
 from django.core.validators import (
@@ -7,10 +8,98 @@ from django.core.validators import (
     MinLengthValidator,
     RegexValidator
 )
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
-class Produto(models.Model):
+class RastreioAlteracoesMixin:
+    """
+    Guarda os valores carregados do banco para saber, sem consultas
+    extras, quais campos mudaram desde a leitura.
+
+    Em updates, save() grava apenas as colunas alteradas (mais os campos
+    auto_now); se nada mudou, não há escrita nem sinais de post_save.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._guardar_estado()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._guardar_estado(fields)
+
+    def _guardar_estado(self, campos=None):
+        estado = getattr(self, '_estado_original', {})
+        for field in self._meta.concrete_fields:
+            if campos is not None and field.name not in campos \
+                    and field.attname not in campos:
+                continue
+            if field.attname in self.__dict__:
+                estado[field.attname] = self._valor_campo(field)
+        self._estado_original = estado
+
+    def _valor_campo(self, field):
+        valor = self.__dict__.get(field.attname)
+        if isinstance(valor, FieldFile):
+            # Upload ainda não gravado conta sempre como alteração
+            return valor.name if valor._committed else object()
+        return valor
+
+    def campos_alterados(self):
+        """Retorna {campo: (valor_original, valor_atual)} do que mudou"""
+        estado = getattr(self, '_estado_original', None)
+        alterados = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.generated or \
+                    field.attname not in self.__dict__:
+                continue
+            atual = self._valor_campo(field)
+            if estado is None:
+                alterados[field.name] = (None, atual)
+            elif field.attname not in estado:
+                alterados[field.name] = (None, atual)
+            elif estado[field.attname] != atual:
+                alterados[field.name] = (estado[field.attname], atual)
+        return alterados
+
+    def tem_alteracao(self, *campos):
+        alterados = self.campos_alterados()
+        return any(campo in alterados for campo in campos)
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+            and not self._state.adding
+            and self.pk is not None
+            and hasattr(self, '_estado_original')
+        ):
+            alterados = list(self.campos_alterados())
+            if alterados:
+                alterados += [
+                    field.name for field in self._meta.concrete_fields
+                    if getattr(field, 'auto_now', False)
+                ]
+            kwargs['update_fields'] = alterados
+        super().save(*args, **kwargs)
+        self._guardar_estado()
+
+
+class ModoImportacao(models.TextChoices):
+    CRIAR = 'C', _('Criar novos produtos')
+    ATUALIZAR = 'A', _('Atualizar existentes ou criar (pelo nome)')
+
+
+class Produto(RastreioAlteracoesMixin, models.Model):
+    campos_auditados = (
+        'nome', 'quantidade', 'quantidade_minima',
+        'valor_unitario', 'categoria', 'imagem'
+    )
+
     class CategoriaProduto(models.TextChoices):
         TECIDOS = 'TECIDOS', _('Tecidos')
         SUBLIMACAO = 'SUBLIMAÇÃO', _('Sublimação')
@@ -58,6 +147,39 @@ class Produto(models.Model):
         default=CategoriaProduto.OUTROS,
         verbose_name=_('Categoria')
     )
+    # Totais das entradas e custo médio móvel (a entrada ponderada com o
+    # estoque em mãos), atualizados a cada entrada por
+    # services.registrar_compras (recalcular_custo_medio refaz)
+    quantidade_comprada = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_('Quantidade Comprada')
+    )
+    valor_comprado = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        editable=False,
+        verbose_name=_('Valor Comprado')
+    )
+    custo_medio = models.DecimalField(
+        max_digits=14,
+        decimal_places=4,
+        default=0,
+        editable=False,
+        verbose_name=_('Custo Médio'),
+        help_text=_(
+            'Custo médio móvel: cada entrada é ponderada com o estoque '
+            'em mãos ao custo anterior')
+    )
+    # Calculado e gravado pelo banco a cada escrita, inclusive nos UPDATEs
+    # diretos do lançamento de movimentações e nas importações
+    estoque_baixo = models.GeneratedField(
+        expression=Q(quantidade__lte=F('quantidade_minima')),
+        output_field=models.BooleanField(),
+        db_persist=True,
+        verbose_name=_('Estoque Baixo')
+    )
     criado_em = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_('Data de Criação')
@@ -74,6 +196,12 @@ class Produto(models.Model):
         indexes = [
             Index(fields=['nome_normalizado']),
             Index(fields=['categoria', 'quantidade']),
+            # Só os produtos com estoque baixo, já em ordem de nome
+            Index(
+                fields=['nome'],
+                condition=Q(estoque_baixo=True),
+                name='produto_estoque_baixo_idx'
+            ),
         ]
         constraints = [
             models.CheckConstraint(
@@ -93,21 +221,26 @@ class Produto(models.Model):
         if not self.nome_normalizado or self.nome_changed():
             self.nome_normalizado = unidecode(self.nome).lower()
         super().save(*args, **kwargs)
+        self._atualizar_estoque_baixo()
+
+    def _atualizar_estoque_baixo(self):
+        """
+        Repete em memória o cálculo de estoque_baixo (o Django só relê
+        campos gerados no INSERT), sem consultar o banco.
+        """
+        if {'quantidade', 'quantidade_minima'} <= self.__dict__.keys():
+            self.estoque_baixo = self.quantidade <= self.quantidade_minima
+            self._guardar_estado(['estoque_baixo'])
 
     def nome_changed(self):
         if not self.pk:
             return True
-        original = Produto.objects.get(pk=self.pk)
-        return original.nome != self.nome
+        return self.tem_alteracao('nome')
 
     @property
     def valor_total_estoque(self):
         return self.quantidade * self.valor_unitario
 
-    @property
-    def estoque_baixo(self):
-        return self.quantidade <= self.quantidade_minima
-
     @classmethod
     def buscar(cls, termo):
         termo_normalizado = unidecode(termo).lower()
@@ -117,7 +250,12 @@ class Produto(models.Model):
         ).distinct()
 
 
-class Fornecedor(models.Model):
+class Fornecedor(RastreioAlteracoesMixin, models.Model):
+    campos_auditados = (
+        'nome_empresa', 'cnpj', 'telefone', 'endereco',
+        'categoria', 'nome_contato', 'email', 'ativo'
+    )
+
     class CategoriaFornecedor(models.TextChoices):
         SUBLIMACAO_TRANSFER = 'SUB_TRANS', _('Sublimação e Transfer')
         SUBLIMACAO = 'SUB', _('Sublimação')
@@ -186,7 +324,7 @@ class Fornecedor(models.Model):
         return f"{self.nome_empresa} ({self.get_categoria_display()})"
 
 
-class Movimentacao(models.Model):
+class Movimentacao(RastreioAlteracoesMixin, models.Model):
     class TipoMovimentacao(models.TextChoices):
         ENTRADA = 'E', _('Entrada')
         SAIDA = 'S', _('Saída')
@@ -232,6 +370,15 @@ class Movimentacao(models.Model):
         null=True,
         verbose_name=_('Responsável')
     )
+    chave_idempotencia = models.CharField(
+        max_length=64,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_('Chave de Idempotência'),
+        help_text=_('Identificador enviado pelo cliente para ignorar reenvios')
+    )
 
     class Meta:
         verbose_name = _('Movimentação')
@@ -251,11 +398,172 @@ class Movimentacao(models.Model):
         return f"{self.get_tipo_display()} \
             {self.quantidade} x {self.produto.nome}"
 
+    def save(self, *args, **kwargs):
+        # A inserção e o lançamento no estoque (post_save) confirmam ou
+        # falham juntos, mesmo fora de uma transação
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
     @property
     def valor_total(self):
         return self.quantidade * self.preco_unitario
 
 
+class SaldoDiario(models.Model):
+    """
+    Saldo de fechamento de um produto num dia em que a quantidade mudou.
+    Mantido a cada lançamento no estoque, edição ou importação;
+    reconstruído a partir do histórico com o comando
+    reconstruir_saldos_diarios.
+    """
+    produto = models.ForeignKey(
+        Produto,
+        on_delete=models.CASCADE,
+        related_name='saldos_diarios',
+        verbose_name=_('Produto')
+    )
+    data = models.DateField(verbose_name=_('Data'))
+    quantidade = models.IntegerField(verbose_name=_('Quantidade em Estoque'))
+
+    class Meta:
+        verbose_name = _('Saldo Diário')
+        verbose_name_plural = _('Saldos Diários')
+        ordering = ['-data']
+        constraints = [
+            # O índice (produto, data) atende a busca do último saldo
+            models.UniqueConstraint(
+                fields=['produto', 'data'],
+                name='saldo_diario_unico'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.produto_id} em {self.data:%d/%m/%Y}: {self.quantidade}"
+
+
+class ResumoMovimentacao(models.Model):
+    """
+    Totais de movimentação por produto, dia e tipo. Incrementado a cada
+    lançamento no estoque, para os relatórios não somarem Movimentacao
+    inteira; reconstruído com o comando reconstruir_resumos.
+    """
+    produto = models.ForeignKey(
+        Produto,
+        on_delete=models.CASCADE,
+        related_name='resumos',
+        verbose_name=_('Produto')
+    )
+    data = models.DateField(verbose_name=_('Data'))
+    tipo = models.CharField(
+        max_length=1,
+        choices=Movimentacao.TipoMovimentacao.choices,
+        verbose_name=_('Tipo de Movimentação')
+    )
+    quantidade = models.BigIntegerField(
+        default=0,
+        verbose_name=_('Quantidade'))
+    valor = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        verbose_name=_('Valor Total'))
+    movimentacoes = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Movimentações'))
+
+    class Meta:
+        verbose_name = _('Resumo de Movimentação')
+        verbose_name_plural = _('Resumos de Movimentação')
+        ordering = ['-data']
+        indexes = [
+            Index(fields=['data', 'tipo']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['produto', 'data', 'tipo'],
+                name='resumo_movimentacao_unico'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.produto_id} {self.get_tipo_display()} \
+            {self.data:%d/%m/%Y}: {self.quantidade}"
+
+
+class ResumoFornecedor(models.Model):
+    """Total comprado (entradas) de cada fornecedor por dia"""
+    fornecedor = models.ForeignKey(
+        Fornecedor,
+        on_delete=models.CASCADE,
+        related_name='resumos',
+        verbose_name=_('Fornecedor')
+    )
+    data = models.DateField(verbose_name=_('Data'))
+    quantidade = models.BigIntegerField(
+        default=0,
+        verbose_name=_('Quantidade'))
+    valor = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        verbose_name=_('Valor Total'))
+    movimentacoes = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Movimentações'))
+
+    class Meta:
+        verbose_name = _('Resumo de Fornecedor')
+        verbose_name_plural = _('Resumos de Fornecedores')
+        ordering = ['-data']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['fornecedor', 'data'],
+                name='resumo_fornecedor_unico'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.fornecedor_id} {self.data:%d/%m/%Y}: {self.valor}"
+
+
+class SugestaoReposicao(models.Model):
+    """
+    Ponto de reposição e estoque alvo calculados do histórico de saídas
+    (comando calcular_reposicao). A quantidade a pedir é o que falta do
+    estoque atual até o alvo.
+    """
+    produto = models.OneToOneField(
+        Produto,
+        on_delete=models.CASCADE,
+        related_name='sugestao',
+        verbose_name=_('Produto')
+    )
+    demanda_media_diaria = models.DecimalField(
+        max_digits=12,
+        decimal_places=3,
+        verbose_name=_('Demanda Média Diária'))
+    desvio_padrao_diario = models.DecimalField(
+        max_digits=12,
+        decimal_places=3,
+        verbose_name=_('Desvio Padrão Diário'))
+    estoque_seguranca = models.PositiveIntegerField(
+        verbose_name=_('Estoque de Segurança'))
+    ponto_reposicao = models.PositiveIntegerField(
+        verbose_name=_('Ponto de Reposição'))
+    estoque_alvo = models.PositiveIntegerField(
+        verbose_name=_('Estoque Alvo'))
+    prazo_entrega = models.PositiveIntegerField(
+        verbose_name=_('Prazo de Entrega (dias)'))
+    calculado_em = models.DateTimeField(verbose_name=_('Calculado em'))
+
+    class Meta:
+        verbose_name = _('Sugestão de Reposição')
+        verbose_name_plural = _('Sugestões de Reposição')
+
+    def __str__(self):
+        return f"{self.produto_id}: repor em {self.ponto_reposicao}"
+
+
 class LogAtividade(models.Model):
     class Acao(models.TextChoices):
         CRIACAO = 'C', _('Criação')
@@ -270,7 +578,8 @@ class LogAtividade(models.Model):
         verbose_name=_('Usuário')
     )
     data_hora = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
+        editable=False,
         verbose_name=_('Data/Hora'),
         db_index=True
     )
@@ -312,3 +621,83 @@ class LogAtividade(models.Model):
     def _gerar_descricao(self):
         return f"{self.usuario or 'Sistema'} realizou \
             {self.get_acao_display().lower()} em {self.modelo_afetado}"
+
+
+class TarefaImportacao(models.Model):
+    class Status(models.TextChoices):
+        PENDENTE = 'P', _('Pendente')
+        PROCESSANDO = 'A', _('Em andamento')
+        CONCLUIDA = 'C', _('Concluída')
+        FALHOU = 'F', _('Falhou')
+
+    arquivo = models.FileField(
+        upload_to='importacoes/',
+        verbose_name=_('Arquivo'))
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        verbose_name=_('Usuário')
+    )
+    status = models.CharField(
+        max_length=1,
+        choices=Status.choices,
+        default=Status.PENDENTE,
+        verbose_name=_('Status'),
+        db_index=True
+    )
+    modo = models.CharField(
+        max_length=1,
+        choices=ModoImportacao.choices,
+        default=ModoImportacao.CRIAR,
+        verbose_name=_('Modo de Importação')
+    )
+    total_linhas = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_('Total de Linhas'))
+    ultima_linha = models.PositiveIntegerField(
+        default=1,
+        verbose_name=_('Última Linha Confirmada'),
+        help_text=_('Linha da planilha até onde a importação foi gravada')
+    )
+    importados = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Produtos Importados'))
+    atualizados = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_('Produtos Atualizados'))
+    erros = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name=_('Erros'))
+    mensagem = models.TextField(
+        blank=True,
+        verbose_name=_('Mensagem'))
+    criado_em = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Data de Criação'))
+    atualizado_em = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_('Última Atualização'))
+
+    class Meta:
+        verbose_name = _('Tarefa de Importação')
+        verbose_name_plural = _('Tarefas de Importação')
+        ordering = ['-criado_em']
+
+    def __str__(self):
+        return f"Importação #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def finalizada(self):
+        return self.status in (self.Status.CONCLUIDA, self.Status.FALHOU)
+
+    @property
+    def percentual(self):
+        if self.status == self.Status.CONCLUIDA:
+            return 100
+        if not self.total_linhas:
+            return 0
+        return min(
+            99, round((self.ultima_linha - 1) * 100 / self.total_linhas))
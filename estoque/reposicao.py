@@ -0,0 +1,108 @@
+"""
+Sugestões de reposição (SugestaoReposicao) calculadas em lote.
+
+A demanda de cada produto é a média móvel das saídas diárias nos últimos
+REPOSICAO_DIAS_HISTORICO dias (dias sem saída contam como zero), lida dos
+resumos diários. Com ela e a variabilidade (desvio padrão diário):
+
+    estoque de segurança = fator de serviço × desvio × √prazo
+    ponto de reposição   = demanda × prazo + estoque de segurança
+    estoque alvo         = ponto de reposição + demanda × ciclo
+
+Todos os produtos são calculados de uma vez com arrays do NumPy e a
+tabela é regravada inteira numa transação.
+"""
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import (
+    Movimentacao, Produto, ResumoMovimentacao, SugestaoReposicao
+)
+
+
+def parametros(**valores):
+    """Parâmetros do cálculo: os informados ou os das settings"""
+    padroes = {
+        'dias': getattr(settings, 'REPOSICAO_DIAS_HISTORICO', 90),
+        'prazo': getattr(settings, 'REPOSICAO_PRAZO_ENTREGA', 7),
+        'fator_servico': getattr(settings, 'REPOSICAO_FATOR_SERVICO', 1.65),
+        'ciclo': getattr(settings, 'REPOSICAO_DIAS_CICLO', 30),
+    }
+    padroes.update({
+        nome: valor for nome, valor in valores.items() if valor is not None
+    })
+    return padroes
+
+
+def calcular(produtos, saidas, dias, prazo, fator_servico, ciclo):
+    """
+    produtos: array de ids; saidas: DataFrame (produto, quantidade) com
+    uma linha por produto e dia com saída. Devolve um DataFrame indexado
+    pelo id do produto com as colunas de SugestaoReposicao.
+    """
+    n = len(produtos)
+    posicoes = pd.Index(produtos).get_indexer(saidas['produto'])
+    conhecidos = posicoes >= 0
+    posicoes = posicoes[conhecidos]
+    quantidade = saidas['quantidade'].to_numpy(dtype=float)[conhecidos]
+
+    # Média e variância da série diária sem montá-la: dias sem saída
+    # entram como zero nas somas
+    soma = np.bincount(posicoes, weights=quantidade, minlength=n)
+    soma_quadrados = np.bincount(
+        posicoes, weights=quantidade ** 2, minlength=n)
+    media = soma / dias
+    desvio = np.sqrt(np.maximum(soma_quadrados / dias - media ** 2, 0))
+
+    seguranca = np.ceil(fator_servico * desvio * np.sqrt(prazo))
+    ponto = np.ceil(media * prazo + seguranca)
+    alvo = np.ceil(ponto + media * ciclo)
+
+    return pd.DataFrame({
+        'demanda_media_diaria': media.round(3),
+        'desvio_padrao_diario': desvio.round(3),
+        'estoque_seguranca': seguranca.astype('int64'),
+        'ponto_reposicao': ponto.astype('int64'),
+        'estoque_alvo': alvo.astype('int64'),
+    }, index=pd.Index(produtos, name='produto'))
+
+
+def atualizar_sugestoes(**valores):
+    """Recalcula e grava as sugestões de todos os produtos"""
+    opcoes = parametros(**valores)
+    fim = timezone.localdate()
+    inicio = fim - timedelta(days=opcoes['dias'] - 1)
+
+    produtos = np.fromiter(
+        Produto.objects.values_list('id', flat=True).order_by(), dtype='int64')
+    saidas = pd.DataFrame.from_records(
+        list(ResumoMovimentacao.objects.filter(
+            tipo=Movimentacao.TipoMovimentacao.SAIDA,
+            data__range=(inicio, fim),
+        ).values_list('produto', 'quantidade').order_by()),
+        columns=['produto', 'quantidade'],
+    )
+    tabela = calcular(produtos, saidas, **opcoes)
+
+    # Substitui a tabela inteira; executemany com valores simples evita
+    # preparar campo a campo cada um dos objetos
+    opts = SugestaoReposicao._meta
+    nome = connection.ops.quote_name
+    campos = ['produto', *tabela.columns, 'prazo_entrega', 'calculado_em']
+    colunas = ', '.join(nome(opts.get_field(c).column) for c in campos)
+    tabela['prazo_entrega'] = opcoes['prazo']
+    tabela['calculado_em'] = opts.get_field(
+        'calculado_em').get_db_prep_save(timezone.now(), connection)
+    linhas = list(tabela.reset_index().itertuples(index=False, name=None))
+    with transaction.atomic():
+        SugestaoReposicao.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {nome(opts.db_table)} ({colunas}) "
+                f"VALUES ({', '.join(['%s'] * len(campos))})",
+                linhas
+            )
+    return len(linhas)
@@ -1,73 +1,1257 @@
+import codecs
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
 import pandas as pd
-from django.db import transaction
-from .models import Produto, LogAtividade
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import (
+    Case, Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.sql import UpdateQuery
+from django.utils import timezone
+from openpyxl import load_workbook
+from unidecode import unidecode
+from .forms import MovimentacaoItemForm
+from .models import (
+    Produto, Fornecedor, Movimentacao, LogAtividade, ModoImportacao,
+    SaldoDiario, ResumoMovimentacao, ResumoFornecedor
+)
+from .validacao import validar_produtos
+from . import auditoria, cache_analytics
 import logging
 
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional: sem ele, Parquet via pandas
+    pq = None
+
 logger = logging.getLogger(__name__)
 
+CENTESIMO_MILESIMO = Decimal('0.0001')
+
 
 class ImportadorProdutos:
-    """Serviço para importação de produtos via Excel"""
+    """Serviço para importação de produtos via planilha (Excel por padrão)"""
 
     REQUIRED_COLUMNS = ['Nome', 'Quantidade', 'Valor Unitário', 'Categoria']
+    MIN_STOCK_COLUMN = 'Quantidade Mínima'
     DEFAULT_MIN_STOCK = 5
+    BATCH_SIZE = 1000
+    # Erros guardados por importação; os demais só entram na contagem
+    MAX_ERROS = 1000
+    CAMPOS_ATUALIZAVEIS = [
+        'nome', 'quantidade', 'quantidade_minima',
+        'valor_unitario', 'categoria', 'atualizado_em'
+    ]
 
-    def __init__(self, arquivo):
-        self.df = pd.read_excel(arquivo)
+    def __init__(self, arquivo, batch_size=None, modo=ModoImportacao.CRIAR,
+                 processos=None):
+        self.arquivo = arquivo
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.modo = modo
+        self.processos = processos or getattr(
+            settings, 'IMPORTACAO_PROCESSOS', min(4, os.cpu_count() or 1))
+        self.paralelo_min_linhas = getattr(
+            settings, 'IMPORTACAO_PARALELO_MIN_LINHAS', 20_000)
+        self.colunas = []
+        self.total_linhas = None
+        self.max_erros = getattr(
+            settings, 'IMPORTACAO_MAX_ERROS', self.MAX_ERROS)
         self.errors = []
+        self.total_erros = 0
         self.success_count = 0
+        self.updated_count = 0
+        self.linhas_processadas = 0
+        self.duracao = 0.0
+        self._carregar()
+
+    def _carregar(self):
+        """Lê a planilha inteira; o índice passa a ser a linha no Excel"""
+        self.df = self._carregar_dataframe()
+        self.df.index = self.df.index + 2
+        self.colunas = list(self.df.columns)
+        self.total_linhas = len(self.df)
+
+    def _carregar_dataframe(self):
+        return pd.read_excel(self.arquivo)
+
+    def _ler_lotes(self, apos_linha=1):
+        """Gera os DataFrames a validar, em blocos de batch_size linhas"""
+        df = self.df.loc[self.df.index > apos_linha]
+        for inicio in range(0, len(df), self.batch_size):
+            yield df.iloc[inicio:inicio + self.batch_size]
 
     def validar_colunas(self):
-        return all(col in self.df.columns for col in self.REQUIRED_COLUMNS)
+        return all(col in self.colunas for col in self.REQUIRED_COLUMNS)
 
     @transaction.atomic
     def executar(self, usuario):
-        """Executa a importação com registro de logs"""
-        for index, row in self.df.iterrows():
-            try:
-                self._processar_linha(row, index+2)
-            except Exception as e:
-                self._registrar_erro(row, index+2, str(e))
+        """Executa a importação em lote com um único log de resumo"""
+        return self.processar(usuario)
+
+    def processar(self, usuario, apos_linha=1, ao_confirmar_lote=None):
+        """
+        Processa a planilha lote a lote, cada um em sua própria transação.
+
+        apos_linha permite retomar uma importação interrompida a partir da
+        última linha confirmada. ao_confirmar_lote(importador, ultima_linha)
+        é chamado dentro da transação do lote, para que o progresso gravado
+        e os produtos criados sejam confirmados juntos.
+        """
+        if not self.validar_colunas():
+            faltando = [
+                col for col in self.REQUIRED_COLUMNS
+                if col not in self.colunas
+            ]
+            raise ValueError(
+                f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+
+        inicio = time.perf_counter()
+        lotes = self._validar_lotes(
+            lote for lote in self._ler_lotes(apos_linha) if not lote.empty)
+        for total, ultima_linha, validos, erros in lotes:
+            with transaction.atomic():
+                self.linhas_processadas += total
+                self._registrar_erros(erros)
+                self._gravar(validos)
+                if ao_confirmar_lote:
+                    ao_confirmar_lote(self, ultima_linha)
+        self.duracao = time.perf_counter() - inicio
+        logger.info(
+            f"Importação: {self.linhas_processadas} linhas em "
+            f"{self.duracao:.2f}s ({self.linhas_por_segundo:.0f} linhas/s)")
 
+        if self.success_count or self.updated_count:
+            cache_analytics.invalidar()
         if self.success_count > 0:
-            LogAtividade.objects.create(
+            auditoria.registrar(
                 usuario=usuario,
-                acao='I',
+                acao=LogAtividade.Acao.IMPORTACAO,
                 modelo_afetado='Produto',
-                detalhes=f"Importados {self.success_count} produtos"
+                detalhes={
+                    'importados': self.success_count,
+                    'atualizados': self.updated_count,
+                    'erros': self.total_erros,
+                }
             )
 
+        self.errors.sort(key=lambda erro: erro['linha'])
         return {
             'success_count': self.success_count,
-            'errors': self.errors
+            'updated_count': self.updated_count,
+            'errors': self.errors,
+            'total_erros': self.total_erros,
+            'linhas_processadas': self.linhas_processadas,
+            'linhas_por_segundo': round(self.linhas_por_segundo),
+        }
+
+    @property
+    def linhas_por_segundo(self):
+        if not self.duracao:
+            return 0.0
+        return self.linhas_processadas / self.duracao
+
+    def _validar_lotes(self, lotes):
+        """
+        Valida os lotes e os devolve na ordem de leitura, como
+        (total_linhas, ultima_linha, validos, erros).
+
+        Arquivos grandes são validados num ProcessPoolExecutor, com até
+        2 lotes por processo em andamento enquanto o lote anterior é
+        gravado; arquivos pequenos são validados no próprio processo.
+        """
+        argumentos = (
+            self._categorias_validas(),
+            self.MIN_STOCK_COLUMN,
+            self.DEFAULT_MIN_STOCK,
+        )
+        if not self._usar_processos():
+            for lote in lotes:
+                yield (len(lote), int(lote.index[-1]),
+                       *validar_produtos(lote, *argumentos))
+            return
+
+        em_andamento = deque()
+        with ProcessPoolExecutor(
+            max_workers=self.processos,
+            mp_context=multiprocessing.get_context('spawn')
+        ) as pool:
+            for lote in lotes:
+                em_andamento.append((
+                    len(lote), int(lote.index[-1]),
+                    pool.submit(validar_produtos, lote, *argumentos)
+                ))
+                if len(em_andamento) >= self.processos * 2:
+                    total, ultima_linha, futuro = em_andamento.popleft()
+                    yield (total, ultima_linha, *futuro.result())
+            while em_andamento:
+                total, ultima_linha, futuro = em_andamento.popleft()
+                yield (total, ultima_linha, *futuro.result())
+
+    def _usar_processos(self):
+        return (
+            self.processos > 1
+            and (self.total_linhas or 0) >= self.paralelo_min_linhas
+        )
+
+    @staticmethod
+    def _categorias_validas():
+        """Mapeia valores e rótulos (sem acento, maiúsculos) para o valor"""
+        mapa = {}
+        for valor, rotulo in Produto.CategoriaProduto.choices:
+            mapa[unidecode(valor).upper()] = valor
+            mapa[unidecode(str(rotulo)).upper()] = valor
+        return mapa
+
+    def _gravar(self, validos):
+        """Grava as linhas válidas com bulk_create em blocos"""
+        if self.modo == ModoImportacao.ATUALIZAR:
+            # Nome repetido na planilha: vale a última ocorrência
+            validos = validos.drop_duplicates(
+                'nome_normalizado', keep='last')
+
+        for inicio in range(0, len(validos), self.batch_size):
+            bloco = validos.iloc[inicio:inicio + self.batch_size]
+            produtos = [
+                Produto(
+                    nome=nome,
+                    nome_normalizado=nome_normalizado,
+                    quantidade=int(quantidade),
+                    quantidade_minima=int(quantidade_minima),
+                    valor_unitario=float(valor_unitario),
+                    categoria=categoria,
+                )
+                for nome, nome_normalizado, quantidade, quantidade_minima,
+                valor_unitario, categoria in zip(
+                    bloco['nome'], bloco['nome_normalizado'],
+                    bloco['quantidade'], bloco['quantidade_minima'],
+                    bloco['valor_unitario'], bloco['categoria']
+                )
+            ]
+            existentes = []
+            if self.modo == ModoImportacao.ATUALIZAR:
+                produtos, existentes = self._separar_existentes(produtos)
+            Produto.objects.bulk_create(produtos)
+            self.success_count += len(produtos)
+            # bulk_create não dispara post_save: o saldo do dia vai aqui
+            # (sem pk, nos bancos que não devolvem ids no bulk_create)
+            registrar_saldos({
+                produto.pk: produto.quantidade
+                for produto in [*produtos, *existentes]
+                if produto.pk is not None
+            })
+
+    def _separar_existentes(self, produtos):
+        """
+        Atualiza os produtos que já existem (mesmo nome_normalizado) e
+        devolve (a criar, atualizados).
+
+        A atualização usa INSERT ... ON CONFLICT (id) DO UPDATE via
+        bulk_create, bem mais rápido que o CASE WHEN gerado por
+        bulk_update para blocos grandes.
+        """
+        indice = dict(
+            Produto.objects.filter(
+                nome_normalizado__in=[p.nome_normalizado for p in produtos]
+            ).order_by('-pk').values_list('nome_normalizado', 'pk')
+        )
+        novos, existentes = [], []
+        for produto in produtos:
+            produto.pk = indice.get(produto.nome_normalizado)
+            if produto.pk is None:
+                novos.append(produto)
+            else:
+                existentes.append(produto)
+
+        Produto.objects.bulk_create(
+            existentes,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=self.CAMPOS_ATUALIZAVEIS
+        )
+        self.updated_count += len(existentes)
+        return novos, existentes
+
+    def _registrar_erros(self, erros):
+        """Registra erros de processamento, guardando até max_erros"""
+        for erro in erros:
+            logger.error(f"Erro na linha {erro['linha']}: {erro['erro']}")
+        self.total_erros += len(erros)
+        espaco = self.max_erros - len(self.errors)
+        if espaco > 0:
+            self.errors.extend(erros[:espaco])
+
+
+class ImportadorProdutosStreaming(ImportadorProdutos):
+    """
+    Importação de .xlsx em memória constante.
+
+    Lê a planilha com openpyxl em modo read-only e processa as linhas em
+    lotes de batch_size, sem carregar a planilha inteira num DataFrame.
+    """
+
+    def _carregar(self):
+        self._workbook = load_workbook(
+            self.arquivo, read_only=True, data_only=True)
+        self._linhas = self._workbook.active.iter_rows(values_only=True)
+        cabecalho = next(self._linhas, ())
+        max_row = self._workbook.active.max_row
+        self.total_linhas = max_row - 1 if max_row else None
+        self.colunas = [
+            str(col).strip() if col is not None else f'Unnamed: {i}'
+            for i, col in enumerate(cabecalho)
+        ]
+
+    def _ler_lotes(self, apos_linha=1):
+        try:
+            lote, indices = [], []
+            for numero, valores in enumerate(self._linhas, start=2):
+                if numero <= apos_linha:
+                    continue
+                if all(valor is None for valor in valores):
+                    continue
+                valores = tuple(valores[:len(self.colunas)])
+                lote.append(
+                    valores + (None,) * (len(self.colunas) - len(valores)))
+                indices.append(numero)
+                if len(lote) >= self.batch_size:
+                    yield self._montar_lote(lote, indices)
+                    lote, indices = [], []
+            if lote:
+                yield self._montar_lote(lote, indices)
+        finally:
+            self._workbook.close()
+
+    def _montar_lote(self, lote, indices):
+        return pd.DataFrame(lote, columns=self.colunas, index=indices)
+
+
+class ImportadorProdutosCSV(ImportadorProdutos):
+    """
+    Importação de .csv lida em blocos com pandas (chunksize).
+
+    Aceita separador ',' ou ';' (detectado pelo cabeçalho); com ';' a
+    vírgula passa a ser o separador decimal, como no Excel em pt-BR. A
+    codificação é a primeira de ENCODINGS que decodifica o arquivo
+    inteiro: UTF-8 ou, como o Excel em pt-BR salva, Windows-1252.
+    """
+
+    ENCODINGS = ('utf-8-sig', 'cp1252')
+
+    def _carregar(self):
+        # Uma passada pelo arquivo conta as linhas e testa as codificações
+        decodificadores = {
+            encoding: codecs.getincrementaldecoder(encoding)()
+            for encoding in self.ENCODINGS
+        }
+        quebras = 0
+        for bloco in iter(lambda: self.arquivo.read(1 << 20), b''):
+            quebras += bloco.count(b'\n')
+            for encoding, decodificador in list(decodificadores.items()):
+                try:
+                    decodificador.decode(bloco)
+                except UnicodeDecodeError:
+                    del decodificadores[encoding]
+        for encoding, decodificador in list(decodificadores.items()):
+            try:
+                decodificador.decode(b'', final=True)
+            except UnicodeDecodeError:
+                del decodificadores[encoding]
+        if not decodificadores:
+            raise ValueError(
+                "Codificação do arquivo não reconhecida: salve o CSV em "
+                "UTF-8 ou Windows-1252")
+        self.encoding = next(iter(decodificadores))
+        self.total_linhas = max(quebras - 1, 0)
+
+        self.arquivo.seek(0)
+        cabecalho = self.arquivo.readline().decode(self.encoding)
+        self._sep = ';' if cabecalho.count(';') > cabecalho.count(',') \
+            else ','
+        self.arquivo.seek(0)
+        self.colunas = list(pd.read_csv(
+            self.arquivo, sep=self._sep, encoding=self.encoding, nrows=0
+        ).columns.str.strip())
+        self.arquivo.seek(0)
+
+    def _ler_lotes(self, apos_linha=1):
+        leitor = pd.read_csv(
+            self.arquivo,
+            sep=self._sep,
+            decimal=',' if self._sep == ';' else '.',
+            encoding=self.encoding,
+            skipinitialspace=True,
+            skip_blank_lines=False,
+            skiprows=range(1, apos_linha),
+            chunksize=self.batch_size,
+        )
+        with leitor:
+            for lote in leitor:
+                lote.columns = self.colunas
+                lote.index = lote.index + apos_linha + 1
+                yield lote.dropna(how='all')
+
+
+class ImportadorProdutosParquet(ImportadorProdutos):
+    """
+    Importação de .parquet (colunar).
+
+    Com pyarrow instalado, lê o arquivo em record batches e converte cada
+    um para DataFrame sem cópia nas colunas numéricas; sem pyarrow, cai
+    para pd.read_parquet (fastparquet) lendo o arquivo inteiro.
+    """
+
+    def _carregar(self):
+        if pq is not None:
+            self._parquet = pq.ParquetFile(self.arquivo)
+            self.colunas = self._parquet.schema_arrow.names
+            self.total_linhas = self._parquet.metadata.num_rows
+        else:
+            super()._carregar()
+            self._parquet = None
+
+    def _ler_lotes(self, apos_linha=1):
+        if self._parquet is None:
+            yield from super()._ler_lotes(apos_linha)
+            return
+
+        inicio = 2
+        for lote in self._parquet.iter_batches(batch_size=self.batch_size):
+            df = lote.to_pandas()
+            df.index = pd.RangeIndex(inicio, inicio + len(df))
+            inicio += len(df)
+            if df.index[-1] > apos_linha:
+                yield df.loc[df.index > apos_linha]
+
+    def _carregar_dataframe(self):
+        return pd.read_parquet(self.arquivo)
+
+
+IMPORTADORES_POR_EXTENSAO = {
+    '.xlsx': ImportadorProdutosStreaming,
+    '.csv': ImportadorProdutosCSV,
+    '.parquet': ImportadorProdutosParquet,
+}
+
+
+def importador_para_arquivo(arquivo, nome=None, **kwargs):
+    """Escolhe o importador pela extensão do arquivo (mesma interface)"""
+    extensao = os.path.splitext(nome or arquivo.name)[1].lower()
+    try:
+        classe = IMPORTADORES_POR_EXTENSAO[extensao]
+    except KeyError:
+        raise ValueError(f"Formato de arquivo não suportado: {extensao}")
+    return classe(arquivo, **kwargs)
+
+
+class EstoqueInsuficiente(Exception):
+    """Saída maior que a quantidade disponível do produto"""
+
+    def __init__(self, produto_id, solicitado, disponivel):
+        self.produto_id = produto_id
+        self.solicitado = solicitado
+        self.disponivel = disponivel
+        super().__init__(
+            f"Estoque insuficiente: solicitado {solicitado}, "
+            f"disponível {disponivel}"
+        )
+
+
+def _suporta_update_returning(conexao):
+    # PostgreSQL e SQLite 3.35+ (mesma versão que habilita RETURNING no
+    # INSERT); MySQL/MariaDB não têm UPDATE ... RETURNING
+    return (
+        conexao.vendor in ('postgresql', 'sqlite')
+        and conexao.features.can_return_rows_from_bulk_insert
+    )
+
+
+def _update_retornando(queryset, valores, *campos):
+    """
+    Executa queryset.update(**valores) devolvendo os campos pedidos das
+    linhas alteradas (UPDATE ... RETURNING), numa única ida ao banco.
+    Retorna None se o banco não suportar; aí o chamador faz o update()
+    comum e consulta depois.
+    """
+    conexao = connections[queryset.db]
+    if not _suporta_update_returning(conexao):
+        return None
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(valores)
+    sql, params = query.get_compiler(queryset.db).as_sql()
+    colunas = ', '.join(
+        conexao.ops.quote_name(queryset.model._meta.get_field(campo).column)
+        for campo in campos
+    )
+    with conexao.cursor() as cursor:
+        cursor.execute(f"{sql} RETURNING {colunas}", params)
+        return cursor.fetchall()
+
+
+def registrar_saldos(saldos, using=None):
+    """
+    Grava {produto_id: quantidade} como saldo de fechamento de hoje, com
+    um upsert (INSERT ... ON CONFLICT DO UPDATE). Chamado a cada
+    lançamento no estoque e sempre que a quantidade muda por outro
+    caminho (edição, admin, importação).
+    """
+    if not saldos:
+        return
+    using = using or router.db_for_write(SaldoDiario)
+    conexao = connections[using]
+    hoje = timezone.localdate()
+    if not conexao.features.supports_update_conflicts_with_target:
+        SaldoDiario.objects.using(using).bulk_create(
+            [
+                SaldoDiario(
+                    produto_id=produto_id, data=hoje, quantidade=quantidade)
+                for produto_id, quantidade in saldos.items()
+            ],
+            update_conflicts=True,
+            update_fields=['quantidade'],
+        )
+        return
+
+    # executemany com valores simples: nas importações são milhares de
+    # linhas, e o bulk_create prepara cada objeto campo a campo
+    nome = conexao.ops.quote_name
+    opts = SaldoDiario._meta
+    produto, data, quantidade = (
+        nome(opts.get_field(campo).column)
+        for campo in ('produto', 'data', 'quantidade'))
+    data_banco = opts.get_field('data').get_db_prep_save(hoje, conexao)
+    with conexao.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {nome(opts.db_table)} "
+            f"({produto}, {data}, {quantidade}) VALUES (%s, %s, %s) "
+            f"ON CONFLICT ({produto}, {data}) DO UPDATE SET "
+            f"{quantidade} = excluded.{quantidade}",
+            [
+                (produto_id, data_banco, valor)
+                for produto_id, valor in saldos.items()
+            ]
+        )
+
+
+def registrar_resumos(movimentacoes, using=None):
+    """
+    Soma as movimentações de hoje em ResumoMovimentacao e, nas entradas
+    com fornecedor, em ResumoFornecedor: um upsert por tabela.
+    """
+    hoje = timezone.localdate()
+    por_produto, por_fornecedor = {}, {}
+    for mov in movimentacoes:
+        valor = mov.quantidade * Decimal(mov.preco_unitario)
+        chave = (mov.produto_id, hoje, mov.tipo)
+        linha = por_produto.setdefault(chave, [0, Decimal(0), 0])
+        linha[0] += mov.quantidade
+        linha[1] += valor
+        linha[2] += 1
+        if mov.tipo == Movimentacao.TipoMovimentacao.ENTRADA \
+                and mov.fornecedor_id:
+            linha = por_fornecedor.setdefault(
+                (mov.fornecedor_id, hoje), [0, Decimal(0), 0])
+            linha[0] += mov.quantidade
+            linha[1] += valor
+            linha[2] += 1
+
+    campos = ['quantidade', 'valor', 'movimentacoes']
+    _incrementar(ResumoMovimentacao, ['produto', 'data', 'tipo'], campos,
+                 por_produto, using)
+    _incrementar(ResumoFornecedor, ['fornecedor', 'data'], campos,
+                 por_fornecedor, using)
+
+
+def _incrementar(modelo, chaves, campos, linhas, using=None):
+    """
+    Soma {(chaves...): [valores dos campos]} nas linhas existentes ou as
+    cria, num único INSERT ... ON CONFLICT DO UPDATE SET c = c + excluded.c
+    (bulk_create com update_conflicts só sabe sobrescrever).
+    """
+    if not linhas:
+        return
+    using = using or router.db_for_write(modelo)
+    conexao = connections[using]
+    if not conexao.features.supports_update_conflicts_with_target:
+        # Bancos sem ON CONFLICT (coluna): incrementa ou cria um a um
+        for chave, valores in linhas.items():
+            filtro = dict(zip(chaves, chave))
+            incrementos = {
+                campo: F(campo) + valor
+                for campo, valor in zip(campos, valores)
+            }
+            if not modelo.objects.using(using).filter(
+                    **filtro).update(**incrementos):
+                modelo.objects.using(using).create(
+                    **filtro, **dict(zip(campos, valores)))
+        return
+
+    nome = conexao.ops.quote_name
+    opts = modelo._meta
+    tabela = nome(opts.db_table)
+    colunas_chave = [nome(opts.get_field(c).column) for c in chaves]
+    colunas = [nome(opts.get_field(c).column) for c in campos]
+    marcadores = f"({', '.join(['%s'] * (len(chaves) + len(campos)))})"
+    params = []
+    for chave, valores in linhas.items():
+        params += [
+            opts.get_field(campo).get_db_prep_save(valor, conexao)
+            for campo, valor in zip(
+                [*chaves, *campos], [*chave, *valores])
+        ]
+    with conexao.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {tabela} ({', '.join(colunas_chave + colunas)}) "
+            f"VALUES {', '.join([marcadores] * len(linhas))} "
+            f"ON CONFLICT ({', '.join(colunas_chave)}) DO UPDATE SET "
+            + ', '.join(f"{c} = {tabela}.{c} + excluded.{c}" for c in colunas),
+            params
+        )
+
+
+def custo_medio_movel(estoque, custo, quantidade, valor):
+    """
+    Custo médio depois de uma entrada de quantidade unidades por valor,
+    com estoque unidades em mãos ao custo anterior. Custo zero é
+    desconhecido (estoque sem entradas registradas): vale só a entrada.
+    """
+    base = estoque if custo > 0 and estoque > 0 else 0
+    return (
+        (base * Decimal(custo) + Decimal(valor)) / (base + quantidade)
+    ).quantize(CENTESIMO_MILESIMO)
+
+
+def registrar_compras(movimentacoes, using=None, custos=None):
+    """
+    Soma as entradas em quantidade_comprada e valor_comprado dos produtos
+    e atualiza custo_medio (custo médio móvel) na mesma instrução.
+
+    custos traz o custo final já calculado de cada produto (lançamento
+    em lote, que conhece o estoque antes de cada linha); sem ele, o
+    banco pondera a entrada com o estoque e o custo atuais da linha.
+    """
+    custos = custos or {}
+    compras = {}
+    for mov in movimentacoes:
+        if mov.tipo != Movimentacao.TipoMovimentacao.ENTRADA:
+            continue
+        linha = compras.setdefault(
+            mov.produto_id, [0, Decimal(0), custos.get(mov.produto_id)])
+        linha[0] += mov.quantidade
+        linha[1] += mov.quantidade * Decimal(mov.preco_unitario)
+    _somar_compras(compras, using)
+
+
+def _somar_compras(compras, using=None):
+    """
+    Soma {produto_id: (quantidade, valor, custo)} aos totais de compra e
+    grava custo_medio, em UPDATEs por blocos. Com custo None, o custo
+    vem de custo_medio_movel no próprio UPDATE: a quantidade da linha já
+    inclui a entrada, então o estoque anterior é quantidade - entrada.
+    """
+    if not compras:
+        return
+    conexao = connections[using or router.db_for_write(Produto)]
+    nome = conexao.ops.quote_name
+    opts = Produto._meta
+    tabela = nome(opts.db_table)
+    id_ = nome(opts.pk.column)
+    estoque, qtd, valor, custo = (
+        nome(opts.get_field(campo).column)
+        for campo in ('quantidade', 'quantidade_comprada', 'valor_comprado',
+                      'custo_medio'))
+    # Estoque anterior que entra na média; "* 1.0": no SQLite, valores
+    # inteiros dividiriam sem decimais
+    base = (
+        f"CASE WHEN {custo} > 0 AND {estoque} > %s "
+        f"THEN {estoque} - %s ELSE 0 END"
+    )
+    custo_movel = (
+        f"WHEN %s THEN ({base} * {custo} + %s) * 1.0 / ({base} + %s) ")
+
+    # Até 13 parâmetros por produto; lotes no limite do banco
+    por_instrucao = (conexao.features.max_query_params or 13000) // 13
+    produtos = list(compras.items())
+    with conexao.cursor() as cursor:
+        for inicio in range(0, len(produtos), por_instrucao):
+            bloco = produtos[inicio:inicio + por_instrucao]
+            quando = 'WHEN %s THEN %s ' * len(bloco)
+            novo_custo, params_custo = '', []
+            for pk, (q, v, c) in bloco:
+                if c is None:
+                    novo_custo += custo_movel
+                    params_custo += [pk, q, q, v, q, q, q]
+                else:
+                    novo_custo += 'WHEN %s THEN %s '
+                    params_custo += [pk, c]
+            # custo_medio vem primeiro porque o MySQL aplica os SETs em
+            # ordem e a conta usa os valores anteriores
+            sql = (
+                f"UPDATE {tabela} SET "
+                f"{custo} = CASE {id_} {novo_custo}END, "
+                f"{valor} = {valor} + CASE {id_} {quando}END, "
+                f"{qtd} = {qtd} + CASE {id_} {quando}END "
+                f"WHERE {id_} IN ({', '.join(['%s'] * len(bloco))})"
+            )
+            params = [
+                *params_custo,
+                *[x for pk, (q, v, c) in bloco for x in (pk, v)],
+                *[x for pk, (q, v, c) in bloco for x in (pk, q)],
+                *[pk for pk, _ in bloco],
+            ]
+            cursor.execute(sql, params)
+
+
+def _apos_lancamento(movimentacoes, saldos, using=None, custos=None):
+    """
+    O que acompanha cada lançamento no estoque, nos dois caminhos
+    (lancar_movimentacao e MovimentacoesEmLote), na mesma transação.
+    """
+    registrar_saldos(saldos, using=using)
+    registrar_resumos(movimentacoes, using=using)
+    registrar_compras(movimentacoes, using=using, custos=custos)
+    cache_analytics.invalidar()
+
+
+def lancar_movimentacao(movimentacao, using=None):
+    """
+    Aplica ao estoque uma movimentação recém-criada e retorna a nova
+    quantidade do produto.
+
+    É um único UPDATE condicional: a saída só decrementa se houver saldo
+    (quantidade >= solicitada), então a constraint quantidade_nao_negativa
+    nunca é violada e o chamador recebe EstoqueInsuficiente em vez de
+    IntegrityError. Onde o banco suporta, a nova quantidade volta no
+    próprio UPDATE (RETURNING); nos demais, num SELECT logo depois.
+    """
+    using = using or router.db_for_write(Produto)
+    produto_id = movimentacao.produto_id
+    solicitado = movimentacao.quantidade
+
+    filtro = Q(pk=produto_id)
+    if movimentacao.tipo == Movimentacao.TipoMovimentacao.SAIDA:
+        filtro &= Q(quantidade__gte=solicitado)
+        valores = {'quantidade': F('quantidade') - solicitado}
+    else:
+        valores = {'quantidade': F('quantidade') + solicitado}
+    produtos = Produto.objects.using(using).filter(filtro)
+    saldo = Produto.objects.using(using).values_list('quantidade', flat=True)
+
+    linhas = _update_retornando(produtos, valores, 'quantidade')
+    if linhas is not None:
+        nova_quantidade = linhas[0][0] if linhas else None
+    elif produtos.update(**valores):
+        nova_quantidade = saldo.get(pk=produto_id)
+    else:
+        nova_quantidade = None
+
+    if nova_quantidade is None:
+        # Nada foi alterado: produto inexistente (DoesNotExist) ou sem saldo
+        raise EstoqueInsuficiente(
+            produto_id, solicitado, saldo.get(pk=produto_id))
+    _apos_lancamento([movimentacao], {produto_id: nova_quantidade}, using)
+
+    # Mantém coerente o produto já carregado, sem refresh_from_db
+    if Movimentacao.produto.is_cached(movimentacao):
+        produto = movimentacao.produto
+        produto.quantidade = nova_quantidade
+        produto._guardar_estado(['quantidade'])
+        produto._atualizar_estoque_baixo()
+    return nova_quantidade
+
+
+class MovimentacoesEmLote:
+    """
+    Lança uma lista de movimentações numa única transação: ou entram
+    todas, ou nenhuma.
+
+    Cada item tem produto, tipo, quantidade, preco_unitario e, em
+    entradas, fornecedor (ids, como em MovimentacaoItemForm). O lote custa
+    uma consulta para os produtos, uma para os fornecedores, um
+    bulk_create e um UPDATE agrupado com a variação líquida de cada
+    produto, em vez da cascata de sinais por movimentação.
+
+    Com parcial=True as linhas inválidas são recusadas e as demais
+    lançadas. Itens com "chave" já gravada (reenvio) são marcados como
+    duplicados e não lançados de novo. Cada linha lançada recebe em
+    resultados o id e quantidade_estoque, o saldo do produto logo depois
+    dela.
+    """
+
+    LIMITE_ITENS = 5000
+
+    def __init__(self, itens, usuario=None, parcial=False, linhas=None):
+        self.itens = itens
+        self.usuario = usuario
+        self.parcial = parcial
+        self.linhas = linhas or range(1, len(itens) + 1)
+        self.limite = getattr(
+            settings, 'MOVIMENTACAO_LOTE_LIMITE', self.LIMITE_ITENS)
+        self.resultados = []
+        self.movimentacoes = []
+        self.erro = ''
+
+    @property
+    def valido(self):
+        return not self.erro and not any(
+            r['erros'] for r in self.resultados)
+
+    @property
+    def aceitas(self):
+        return len(self.movimentacoes)
+
+    @property
+    def duplicadas(self):
+        return sum(1 for r in self.resultados if r.get('duplicada'))
+
+    @property
+    def rejeitadas(self):
+        return [r for r in self.resultados if r['erros']]
+
+    def executar(self):
+        """Retorna True se o lote foi lançado; detalhes em resultados"""
+        if len(self.itens) > self.limite:
+            self.erro = f"Lote excede o limite de {self.limite} itens"
+            return False
+        try:
+            return self._executar()
+        except IntegrityError:
+            # Outro envio gravou a mesma chave ao mesmo tempo: a nova
+            # consulta das chaves marca essas linhas como duplicadas
+            self.resultados = []
+            self.movimentacoes = []
+            return self._executar()
+
+    def _executar(self):
+        dados = self._validar_itens()
+        with transaction.atomic():
+            self._marcar_duplicadas(dados)
+            produtos = Produto.objects.select_for_update().in_bulk(
+                {d['produto'] for d in dados if d})
+            fornecedores = Fornecedor.objects.in_bulk(
+                {d['fornecedor'] for d in dados if d and d['fornecedor']})
+            variacoes = self._conferir(dados, produtos, fornecedores)
+            if not self.valido and not self.parcial:
+                return False
+            saldos = self._aplicar(variacoes, produtos)
+            if saldos is None:
+                # Saldo mudou entre a leitura e o UPDATE (bancos sem lock)
+                transaction.set_rollback(True)
+                self.erro = (
+                    "Estoque alterado por outra operação; envie novamente")
+                return False
+            lancados = [
+                (resultado, item)
+                for resultado, item in zip(self.resultados, dados)
+                if item is not None and not resultado['erros']
+            ]
+            self._criar([item for _, item in lancados])
+            _apos_lancamento(self.movimentacoes, {
+                pk: saldos[pk] for pk, variacao in variacoes.items()
+                if variacao
+            }, custos=self._custos(produtos))
+
+        # Saldo logo após cada linha: parte do saldo anterior ao lote (o
+        # final menos a variação) e reaplica as linhas na ordem
+        correntes = {
+            pk: saldos[pk] - variacao for pk, variacao in variacoes.items()
         }
+        for (resultado, _), movimentacao in zip(
+                lancados, self.movimentacoes):
+            pk = movimentacao.produto_id
+            if movimentacao.tipo == Movimentacao.TipoMovimentacao.SAIDA:
+                correntes[pk] -= movimentacao.quantidade
+            else:
+                correntes[pk] += movimentacao.quantidade
+            resultado['id'] = movimentacao.pk
+            resultado['quantidade_estoque'] = correntes[pk]
+        return True
+
+    def _validar_itens(self):
+        dados = []
+        for linha, item in zip(self.linhas, self.itens):
+            if isinstance(item, dict):
+                valido, erros = MovimentacaoItemForm.validar(item)
+            else:
+                valido, erros = None, {
+                    '__all__': ['Item deve ser um objeto JSON']}
+            dados.append(valido)
+            self.resultados.append({'linha': linha, 'erros': erros})
+        return dados
+
+    def _marcar_duplicadas(self, dados):
+        """Tira do lote as chaves já gravadas ou repetidas no próprio lote"""
+        chaves = {d['chave'] for d in dados if d and d['chave']}
+        if not chaves:
+            return
+        vistas = set(Movimentacao.objects.filter(
+            chave_idempotencia__in=chaves
+        ).values_list('chave_idempotencia', flat=True))
+        for indice, item in enumerate(dados):
+            if item is None or not item['chave']:
+                continue
+            if item['chave'] in vistas:
+                dados[indice] = None
+                self.resultados[indice]['duplicada'] = True
+            vistas.add(item['chave'])
+
+    def _custos(self, produtos):
+        """
+        Custo médio final dos produtos com entradas no lote, reaplicando
+        as linhas na ordem sobre o estoque e o custo lidos antes do lote
+        """
+        estoques = {}
+        custos = {}
+        for mov in self.movimentacoes:
+            pk = mov.produto_id
+            estoque = estoques.get(pk, produtos[pk].quantidade)
+            if mov.tipo == Movimentacao.TipoMovimentacao.SAIDA:
+                estoques[pk] = estoque - mov.quantidade
+                continue
+            custos[pk] = custo_medio_movel(
+                estoque, custos.get(pk, produtos[pk].custo_medio),
+                mov.quantidade, mov.quantidade * mov.preco_unitario)
+            estoques[pk] = estoque + mov.quantidade
+        return custos
 
-    def _processar_linha(self, row, linha_num):
-        """Processa uma linha individual do Excel"""
-        # Validação de campos obrigatórios
-        if any(pd.isna(row[col]) for col in self.REQUIRED_COLUMNS):
-            raise ValueError("Campos obrigatórios ausentes")
-
-        # Validação de tipos
-        if not isinstance(row['Quantidade'], (int, float)):
-            raise ValueError("Quantidade deve ser numérica")
-
-        # Criação do produto
-        Produto.objects.create(
-            nome=str(row['Nome']),
-            quantidade=int(row['Quantidade']),
-            quantidade_minima=int(
-                row.get('Quantidade Mínima', self.DEFAULT_MIN_STOCK)),
-            valor_unitario=float(row['Valor Unitário']),
-            categoria=str(row['Categoria'])
+    def _conferir(self, dados, produtos, fornecedores):
+        """Confere referências e saldo na ordem dos itens"""
+        saldos = {pk: produto.quantidade for pk, produto in produtos.items()}
+        variacoes = {}
+        for resultado, item in zip(self.resultados, dados):
+            if item is None:
+                continue
+            erros = resultado['erros']
+            produto_id = item['produto']
+            if produto_id not in produtos:
+                erros['produto'] = ['Produto não encontrado']
+            if item['fornecedor'] and item['fornecedor'] not in fornecedores:
+                erros['fornecedor'] = ['Fornecedor não encontrado']
+            if erros:
+                continue
+
+            quantidade = item['quantidade']
+            if item['tipo'] == Movimentacao.TipoMovimentacao.SAIDA:
+                if saldos[produto_id] < quantidade:
+                    erros['quantidade'] = [
+                        f"Estoque insuficiente: solicitado {quantidade}, "
+                        f"disponível {saldos[produto_id]}"
+                    ]
+                    continue
+                quantidade = -quantidade
+            saldos[produto_id] += quantidade
+            variacoes[produto_id] = variacoes.get(produto_id, 0) + quantidade
+        return variacoes
+
+    def _aplicar(self, variacoes, produtos):
+        """
+        Um UPDATE para todos os produtos, condicionado ao saldo. Retorna
+        {produto_id: nova quantidade}, ou None se algum produto ficaria
+        negativo.
+        """
+        saldos = {pk: produto.quantidade for pk, produto in produtos.items()}
+        variacoes = {pk: v for pk, v in variacoes.items() if v}
+        if not variacoes:
+            return saldos
+
+        # CASE simples montado direto: com centenas de produtos, o
+        # Case(When(pk=...)) do ORM gasta mais compilando que o banco
+        # executando
+        conexao = connections[router.db_for_write(Produto)]
+        opts = Produto._meta
+        tabela = conexao.ops.quote_name(opts.db_table)
+        id_ = conexao.ops.quote_name(opts.pk.column)
+        qtd = conexao.ops.quote_name(opts.get_field('quantidade').column)
+        caso = f"CASE {id_} {'WHEN %s THEN %s ' * len(variacoes)}END"
+        params_caso = [x for par in variacoes.items() for x in par]
+        sql = (
+            f"UPDATE {tabela} SET {qtd} = {qtd} + {caso} "
+            f"WHERE {id_} IN ({', '.join(['%s'] * len(variacoes))}) "
+            f"AND {qtd} + {caso} >= 0"
         )
-        self.success_count += 1
-
-    def _registrar_erro(self, row, linha_num, erro):
-        """Registra erros de processamento"""
-        self.errors.append({
-            'linha': linha_num,
-            'erro': erro,
-            'dados': dict(row.dropna().astype(str))
+        params = [*params_caso, *variacoes, *params_caso]
+
+        with conexao.cursor() as cursor:
+            if _suporta_update_returning(conexao):
+                cursor.execute(f"{sql} RETURNING {id_}, {qtd}", params)
+                linhas = cursor.fetchall()
+            else:
+                cursor.execute(sql, params)
+                linhas = [
+                    (pk, saldos[pk] + variacao)
+                    for pk, variacao in variacoes.items()
+                ] if cursor.rowcount == len(variacoes) else []
+        if len(linhas) != len(variacoes):
+            return None
+        saldos.update(linhas)
+        return saldos
+
+    def _criar(self, dados):
+        self.movimentacoes = Movimentacao.objects.bulk_create([
+            Movimentacao(
+                produto_id=item['produto'],
+                fornecedor_id=item['fornecedor'],
+                tipo=item['tipo'],
+                quantidade=item['quantidade'],
+                preco_unitario=item['preco_unitario'],
+                chave_idempotencia=item['chave'] or None,
+                usuario=self.usuario,
+            )
+            for item in dados
+        ])
+
+
+def ingerir_movimentacoes(linhas, usuario=None, tamanho_lote=None):
+    """
+    Lança movimentações em NDJSON (um objeto JSON por linha) lidas
+    incrementalmente de linhas, um iterável de bytes (o próprio request).
+
+    A memória fica limitada a um lote: a cada tamanho_lote linhas o lote
+    é lançado com MovimentacoesEmLote(parcial=True), então uma linha
+    inválida recusa só ela. Retorna (confirmacoes, resumo), com uma
+    confirmação compacta por lote e a vazão em movimentações/s.
+    """
+    tamanho_lote = tamanho_lote or getattr(
+        settings, 'INGESTAO_TAMANHO_LOTE', 500)
+    confirmacoes = []
+    resumo = {'total': 0, 'aceitas': 0, 'duplicadas': 0, 'rejeitadas': 0}
+    inicio = time.perf_counter()
+
+    def lancar(itens, numeros):
+        lote = MovimentacoesEmLote(
+            itens, usuario=usuario, parcial=True, linhas=numeros)
+        lote.executar()
+        rejeitadas = [
+            {'linha': r['linha'], 'erros': r['erros']}
+            for r in lote.rejeitadas
+        ]
+        confirmacoes.append({
+            'lote': len(confirmacoes) + 1,
+            'linhas': [numeros[0], numeros[-1]],
+            'aceitas': lote.aceitas,
+            'duplicadas': lote.duplicadas,
+            'rejeitadas': rejeitadas,
+            **({'erro': lote.erro} if lote.erro else {}),
         })
-        logger.error(f"Erro na linha {linha_num}: {erro}")
+        resumo['total'] += len(itens)
+        resumo['aceitas'] += lote.aceitas
+        resumo['duplicadas'] += lote.duplicadas
+        resumo['rejeitadas'] += len(itens) - lote.aceitas - lote.duplicadas
+
+    itens, numeros = [], []
+    for numero, linha in enumerate(linhas, start=1):
+        if not linha.strip():
+            continue
+        try:
+            itens.append(json.loads(linha))
+        except ValueError:
+            itens.append(None)  # recusada como "não é um objeto JSON"
+        numeros.append(numero)
+        if len(itens) >= tamanho_lote:
+            lancar(itens, numeros)
+            itens, numeros = [], []
+    if itens:
+        lancar(itens, numeros)
+
+    resumo['duracao'] = round(time.perf_counter() - inicio, 3)
+    resumo['movimentacoes_por_segundo'] = round(
+        resumo['aceitas'] / resumo['duracao']) if resumo['duracao'] else 0
+    return confirmacoes, resumo
+
+
+# Variação que a movimentação causa no estoque: +quantidade ou -quantidade
+VARIACAO_ESTOQUE = Case(
+    When(tipo=Movimentacao.TipoMovimentacao.ENTRADA, then=F('quantidade')),
+    default=-F('quantidade'),
+    output_field=IntegerField(),
+)
+
+
+def _variacao_apos(momento):
+    """Subconsulta com a soma das variações do produto depois do momento"""
+    return Subquery(
+        Movimentacao.objects.filter(
+            produto=OuterRef('pk'), data__gt=momento
+        ).order_by().values('produto').annotate(
+            total=Sum(VARIACAO_ESTOQUE)
+        ).values('total')
+    )
+
+
+def estoque_na_data(data, produto_id=None):
+    """
+    Quantidade em estoque no fim do dia data.
+
+    Com produto_id retorna um inteiro; sem, um queryset de Produto com
+    quantidade_na_data para o catálogo inteiro. Hoje ou depois, é a
+    própria quantidade do produto. Antes, cada produto custa uma busca
+    no índice (produto, data) de SaldoDiario pelo último saldo até a
+    data; se o produto não tem saldo até lá, a quantidade atual é
+    descontada das movimentações posteriores. Produtos criados depois
+    da data ficam de fora (ou retornam None).
+    """
+    if data >= timezone.localdate():
+        produtos = Produto.objects.annotate(quantidade_na_data=F('quantidade'))
+    else:
+        fim_do_dia = timezone.make_aware(
+            datetime.combine(data, datetime.max.time()))
+        produtos = Produto.objects.filter(
+            criado_em__lte=fim_do_dia
+        ).annotate(
+            quantidade_na_data=Coalesce(
+                Subquery(
+                    SaldoDiario.objects.filter(
+                        produto=OuterRef('pk'), data__lte=data
+                    ).order_by('-data').values('quantidade')[:1]
+                ),
+                F('quantidade')
+                - Coalesce(_variacao_apos(fim_do_dia), Value(0)),
+            )
+        )
+    if produto_id is None:
+        return produtos
+    return produtos.filter(pk=produto_id).values_list(
+        'quantidade_na_data', flat=True).first()
+
+
+def reconstruir_saldos_diarios():
+    """
+    Refaz SaldoDiario a partir do histórico, num único INSERT ... SELECT.
+
+    O saldo de fechamento de cada dia com movimentação é a quantidade
+    atual menos tudo o que foi movimentado nos dias seguintes, uma soma
+    acumulada (função de janela) dos dias mais recentes para os mais
+    antigos. Retorna o número de saldos gravados.
+    """
+    conexao = connections[router.db_for_write(SaldoDiario)]
+    nome = conexao.ops.quote_name
+    # O ORM monta o agrupamento por dia (TruncDate respeita o fuso de
+    # cada banco); a janela sobre o agregado vai em SQL
+    por_dia = Movimentacao.objects.order_by().annotate(
+        dia=TruncDate('data')
+    ).values('produto_id', 'dia').annotate(variacao=Sum(VARIACAO_ESTOQUE))
+    sql_por_dia, params = por_dia.query.sql_with_params()
+
+    saldo = SaldoDiario._meta
+    produto = Produto._meta
+    with transaction.atomic(using=conexao.alias), conexao.cursor() as cursor:
+        SaldoDiario.objects.using(conexao.alias).delete()
+        cursor.execute(f"""
+            INSERT INTO {nome(saldo.db_table)} (
+                {nome(saldo.get_field('produto').column)},
+                {nome(saldo.get_field('data').column)},
+                {nome(saldo.get_field('quantidade').column)}
+            )
+            SELECT d.produto_id, d.dia,
+                   p.{nome(produto.get_field('quantidade').column)}
+                   - COALESCE(SUM(d.variacao) OVER (
+                         PARTITION BY d.produto_id ORDER BY d.dia DESC
+                         ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                     ), 0)
+            FROM ({sql_por_dia}) d
+            JOIN {nome(produto.db_table)} p
+              ON p.{nome(produto.pk.column)} = d.produto_id
+        """, params)
+        gravados = cursor.rowcount
+    cache_analytics.invalidar()
+    return gravados
+
+
+def reconstruir_resumos():
+    """
+    Refaz ResumoMovimentacao e ResumoFornecedor a partir do histórico,
+    com um INSERT ... SELECT agrupado por tabela. Retorna o número de
+    linhas de cada uma.
+    """
+    valor = Sum(F('quantidade') * F('preco_unitario'))
+    por_produto = Movimentacao.objects.order_by().annotate(
+        dia=TruncDate('data')
+    ).values('produto_id', 'dia', 'tipo').annotate(
+        total=Sum('quantidade'), valor_total=valor, n=Count('pk'))
+    por_fornecedor = Movimentacao.objects.order_by().filter(
+        tipo=Movimentacao.TipoMovimentacao.ENTRADA,
+        fornecedor__isnull=False
+    ).annotate(
+        dia=TruncDate('data')
+    ).values('fornecedor_id', 'dia').annotate(
+        total=Sum('quantidade'), valor_total=valor, n=Count('pk'))
+
+    totais = []
+    for modelo, origem, chaves, aliases in (
+        (ResumoMovimentacao, por_produto, ['produto', 'data', 'tipo'],
+         ['produto_id', 'dia', 'tipo']),
+        (ResumoFornecedor, por_fornecedor, ['fornecedor', 'data'],
+         ['fornecedor_id', 'dia']),
+    ):
+        conexao = connections[router.db_for_write(modelo)]
+        nome = conexao.ops.quote_name
+        opts = modelo._meta
+        colunas = ', '.join(
+            nome(opts.get_field(campo).column) for campo in
+            [*chaves, 'quantidade', 'valor', 'movimentacoes']
+        )
+        selecao = ', '.join(
+            f"r.{nome(alias)}"
+            for alias in [*aliases, 'total', 'valor_total', 'n']
+        )
+        sql, params = origem.query.sql_with_params()
+        with transaction.atomic(using=conexao.alias), \
+                conexao.cursor() as cursor:
+            modelo.objects.using(conexao.alias).delete()
+            cursor.execute(
+                f"INSERT INTO {nome(opts.db_table)} ({colunas}) "
+                f"SELECT {selecao} FROM ({sql}) r", params)
+            totais.append(cursor.rowcount)
+    cache_analytics.invalidar()
+    return totais
+
+
+def recalcular_custos():
+    """
+    Refaz quantidade_comprada, valor_comprado e custo_medio de todos os
+    produtos a partir das movimentações: parte do estoque anterior à
+    primeira delas (o atual menos a soma das variações) e reaplica
+    entradas e saídas na ordem, como custo_medio_movel faria a cada
+    lançamento. Retorna o número de produtos com entradas.
+    """
+    variacoes = dict(
+        Movimentacao.objects.order_by().values('produto').annotate(
+            total=Sum(VARIACAO_ESTOQUE)
+        ).values_list('produto', 'total')
+    )
+    estoques = {
+        pk: quantidade - variacoes.get(pk, 0)
+        for pk, quantidade in Produto.objects.filter(
+            pk__in=variacoes).values_list('pk', 'quantidade').iterator()
+    }
+    compras = {}
+    movimentacoes = Movimentacao.objects.order_by(
+        'produto', 'data', 'pk'
+    ).values_list('produto', 'tipo', 'quantidade', 'preco_unitario')
+    for produto, tipo, quantidade, preco in movimentacoes.iterator(
+            chunk_size=5000):
+        if tipo != Movimentacao.TipoMovimentacao.ENTRADA:
+            estoques[produto] -= quantidade
+            continue
+        total, valor, custo = compras.get(produto, (0, Decimal(0), 0))
+        compras[produto] = (
+            total + quantidade,
+            valor + quantidade * preco,
+            custo_medio_movel(
+                estoques[produto], custo, quantidade, quantidade * preco),
+        )
+        estoques[produto] += quantidade
+
+    with transaction.atomic():
+        Produto.objects.update(
+            quantidade_comprada=0, valor_comprado=0, custo_medio=0)
+        _somar_compras(compras)
+    cache_analytics.invalidar()
+    return len(compras)
@@ -1,8 +1,11 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, post_init
 from django.dispatch import receiver
-from django.db import transaction, models
 from django.contrib.auth import get_user_model
-from .models import Movimentacao, LogAtividade, Produto, Fornecedor
+from .models import Movimentacao, Produto, Fornecedor
+from .services import (
+    EstoqueInsuficiente, lancar_movimentacao, registrar_saldos
+)
+from . import auditoria, cache_analytics
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,33 +15,84 @@ User = get_user_model()
 
 
 @receiver(post_save, sender=Movimentacao)
-@transaction.atomic
-def atualizar_estoque(sender, instance, **kwargs):
-    try:
-        produto = instance.produto
-        logger.info(
-            f"Iniciando atualização para \
-                {produto.nome} - Tipo: {instance.tipo}")
-
-        # Usar valores literais para comparação
-        if instance.tipo == 'E':  # Entrada
-            Produto.objects.filter(pk=produto.pk).update(
-                quantidade=models.F('quantidade') + instance.quantidade
-            )
-        elif instance.tipo == 'S':  # Saída
-            Produto.objects.filter(pk=produto.pk).update(
-                quantidade=models.F('quantidade') - instance.quantidade
-            )
-
-        produto.refresh_from_db()
-        logger.info(f"Estoque atualizado: {produto.quantidade}")
+def atualizar_estoque(sender, instance, created=False, using=None, **kwargs):
+    lote = auditoria.operacao_ativa()
+    if lote is not None:
+        lote.contabilizar(sender, 'C' if created else 'E', instance.pk)
+        return
+
+    # Só a criação lança no estoque; editar não reaplica a quantidade
+    if not created:
+        return
 
+    try:
+        quantidade = lancar_movimentacao(instance, using=using)
     except Exception as e:
-        logger.error(f"Falha crítica: {str(e)}", exc_info=True)
+        # Estoque insuficiente é recusa esperada (a view mostra a mensagem
+        # ao usuário), não falha do sistema
+        if not isinstance(e, EstoqueInsuficiente):
+            logger.error(f"Falha crítica: {str(e)}", exc_info=True)
         raise
 
+    logger.info(
+        f"Estoque atualizado (produto {instance.produto_id}, "
+        f"tipo {instance.tipo}): {quantidade}")
+
+
+# Saldo do dia quando a quantidade muda fora de uma movimentação
+# (formulário, list_editable do admin): lancar_movimentacao altera a
+# quantidade com UPDATE e grava o saldo ele mesmo
+
+
+@receiver(post_save, sender=Produto)
+def registrar_saldo_produto(sender, instance, created, using=None, **kwargs):
+    if created or 'quantidade' in instance.campos_alterados():
+        registrar_saldos({instance.pk: instance.quantidade}, using=using)
+
+
+# Campos registrados na auditoria. Produto e Fornecedor declaram os seus
+# em campos_auditados; o User do Django é configurado aqui.
+CAMPOS_AUDITADOS_USUARIO = (
+    'username', 'email', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser', 'password'
+)
+CAMPOS_MASCARADOS = {'password'}
+
+
+def campos_auditados(sender):
+    if sender is User:
+        return CAMPOS_AUDITADOS_USUARIO
+    return getattr(sender, 'campos_auditados', ())
 
-def criar_log(sender, instance, acao):
+
+def _serializar(campo, valor):
+    if campo in CAMPOS_MASCARADOS:
+        return '***'
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    return str(valor)
+
+
+def _alteracoes(sender, instance):
+    """Diferença (antes -> depois) dos campos auditados, sem consultas"""
+    campos = campos_auditados(sender)
+    if hasattr(instance, 'campos_alterados'):
+        alterados = instance.campos_alterados()
+    else:
+        estado = getattr(instance, '_estado_auditoria', {})
+        alterados = {
+            campo: (estado.get(campo), getattr(instance, campo))
+            for campo in campos
+            if estado.get(campo) != getattr(instance, campo)
+        }
+    return {
+        campo: [_serializar(campo, antes), _serializar(campo, depois)]
+        for campo, (antes, depois) in alterados.items()
+        if campo in campos
+    }
+
+
+def criar_log(sender, instance, acao, detalhes=None):
     try:
         usuario = None
         if hasattr(instance, 'usuario'):
@@ -46,7 +100,7 @@ def criar_log(sender, instance, acao):
         elif hasattr(instance, 'user'):
             usuario = instance.user
 
-        LogAtividade.objects.create(
+        auditoria.registrar(
             usuario=usuario,
             acao=acao,
             modelo_afetado=sender.__name__,
@@ -55,23 +109,58 @@ def criar_log(sender, instance, acao):
                 'model': sender.__name__,
                 'id': instance.id,
                 'acao': acao,
-                'dados': str(instance)
+                **(detalhes or {'dados': str(instance)})
             }
         )
     except Exception as e:
         logger.error(f"Erro ao criar log: {str(e)}", exc_info=True)
 
 
+@receiver(post_init, sender=User)
+def guardar_estado_usuario(sender, instance, **kwargs):
+    instance._estado_auditoria = {
+        campo: instance.__dict__.get(campo)
+        for campo in CAMPOS_AUDITADOS_USUARIO
+    }
+
+
 @receiver(post_save, sender=Produto)
 @receiver(post_save, sender=Fornecedor)
 @receiver(post_save, sender=User)
-def log_post_save(sender, instance, created, **kwargs):
-    acao = 'C' if created else 'E'
-    criar_log(sender, instance, acao)
+def log_post_save(sender, instance, created, update_fields=None, **kwargs):
+    lote = auditoria.operacao_ativa()
+    if lote is not None:
+        lote.contabilizar(sender, 'C' if created else 'E', instance.pk)
+    elif created:
+        criar_log(sender, instance, 'C', {'dados': {
+            campo: _serializar(campo, getattr(instance, campo))
+            for campo in campos_auditados(sender)
+        }})
+    # Ex.: login do Django grava só last_login, que não é auditado
+    elif update_fields is None or \
+            set(update_fields) & set(campos_auditados(sender)):
+        alteracoes = _alteracoes(sender, instance)
+        if alteracoes:
+            criar_log(sender, instance, 'E', {'alteracoes': alteracoes})
+
+    if sender is User:
+        guardar_estado_usuario(sender, instance)
 
 
 @receiver(post_delete, sender=Produto)
 @receiver(post_delete, sender=Fornecedor)
 @receiver(post_delete, sender=User)
 def log_post_delete(sender, instance, **kwargs):
-    criar_log(sender, instance, 'D')
+    lote = auditoria.operacao_ativa()
+    if lote is not None:
+        lote.contabilizar(sender, 'D', instance.pk)
+    else:
+        criar_log(sender, instance, 'D')
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_delete, sender=Produto)
+def invalidar_relatorios(sender, instance, **kwargs):
+    # Em operações em lote, operacao_em_lote invalida uma vez ao final
+    if auditoria.operacao_ativa() is None:
+        cache_analytics.invalidar()
@@ -0,0 +1,66 @@
+// Busca sob demanda para os selects renderizados por SelectBusca:
+// um campo de texto acima do select consulta data-busca-url (JSON
+// paginado) e troca as opções, mantendo a que estiver selecionada.
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-busca-url]').forEach(function (select) {
+        var url = select.dataset.buscaUrl;
+        var busca = document.createElement('input');
+        busca.type = 'search';
+        busca.className = 'form-control mb-1';
+        busca.placeholder = 'Digite para buscar...';
+        busca.autocomplete = 'off';
+        var mais = document.createElement('button');
+        mais.type = 'button';
+        mais.className = 'btn btn-link btn-sm p-0';
+        mais.textContent = 'Mais resultados';
+        mais.hidden = true;
+        select.before(busca);
+        select.after(mais);
+
+        var pagina = 1;
+        var espera = null;
+        var pedido = 0;
+
+        function carregar(acrescentar) {
+            var numero = ++pedido;
+            var params = new URLSearchParams({q: busca.value, pagina: pagina});
+            fetch(url + '?' + params, {headers: {'Accept': 'application/json'}})
+                .then(function (resposta) { return resposta.json(); })
+                .then(function (dados) {
+                    if (numero !== pedido) {
+                        return;  // resposta de uma busca antiga
+                    }
+                    if (!acrescentar) {
+                        Array.from(select.options).forEach(function (opcao) {
+                            if (opcao.value && !opcao.selected) {
+                                opcao.remove();
+                            }
+                        });
+                    }
+                    dados.resultados.forEach(function (item) {
+                        if (!select.querySelector('option[value="' + item.id + '"]')) {
+                            select.add(new Option(item.texto, item.id));
+                        }
+                    });
+                    mais.hidden = !dados.mais;
+                });
+        }
+
+        busca.addEventListener('input', function () {
+            clearTimeout(espera);
+            espera = setTimeout(function () {
+                pagina = 1;
+                carregar(false);
+            }, 250);
+        });
+        mais.addEventListener('click', function () {
+            pagina += 1;
+            carregar(true);
+        });
+        select.addEventListener('focus', function () {
+            if (select.options.length <= 2 && pagina === 1) {
+                carregar(true);
+            }
+        }, {once: true});
+    });
+});
@@ -0,0 +1,131 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import TarefaImportacao
+from .services import importador_para_arquivo
+from . import auditoria
+
+logger = logging.getLogger(__name__)
+
+# Pool local de threads: sem broker externo, as importações rodam no
+# próprio processo do servidor, fora do ciclo da requisição.
+MAX_WORKERS = getattr(settings, 'IMPORTACAO_WORKERS', 2)
+
+# Tarefa "em andamento" sem progresso por esse tempo é considerada
+# interrompida (ex.: worker reiniciado) e pode ser retomada.
+TEMPO_INATIVIDADE = timedelta(
+    seconds=getattr(settings, 'IMPORTACAO_TEMPO_INATIVIDADE', 120))
+
+_executor = ThreadPoolExecutor(
+    max_workers=MAX_WORKERS, thread_name_prefix='importacao')
+
+
+def enfileirar(tarefa_id):
+    """Agenda a execução da tarefa no pool de workers"""
+    _executor.submit(executar_tarefa, tarefa_id)
+
+
+def aguardar_conclusao():
+    """Espera as tarefas agendadas terminarem (uso em comandos)"""
+    _executor.shutdown(wait=True)
+
+
+def interrompida(tarefa):
+    return (
+        tarefa.status == TarefaImportacao.Status.PROCESSANDO
+        and tarefa.atualizado_em < timezone.now() - TEMPO_INATIVIDADE
+    )
+
+
+def retomar_pendentes():
+    """Reagenda tarefas pendentes ou interrompidas no meio"""
+    limite = timezone.now() - TEMPO_INATIVIDADE
+    pendentes = TarefaImportacao.objects.filter(
+        Q(status=TarefaImportacao.Status.PENDENTE) |
+        Q(status=TarefaImportacao.Status.PROCESSANDO,
+          atualizado_em__lt=limite)
+    ).values_list('pk', flat=True)
+    for tarefa_id in pendentes:
+        enfileirar(tarefa_id)
+    return len(pendentes)
+
+
+def _reservar(tarefa_id):
+    """Marca a tarefa como em andamento, se nenhum outro worker a pegou"""
+    limite = timezone.now() - TEMPO_INATIVIDADE
+    return TarefaImportacao.objects.filter(
+        Q(status=TarefaImportacao.Status.PENDENTE) |
+        Q(status=TarefaImportacao.Status.PROCESSANDO,
+          atualizado_em__lt=limite),
+        pk=tarefa_id
+    ).update(
+        status=TarefaImportacao.Status.PROCESSANDO,
+        atualizado_em=timezone.now()
+    ) == 1
+
+
+def _registrar_progresso(tarefa, importador, ultima_linha):
+    campos = ['ultima_linha', 'importados', 'atualizados', 'atualizado_em']
+    tarefa.ultima_linha = ultima_linha
+    tarefa.importados = importador.success_count
+    tarefa.atualizados = importador.updated_count
+    # A lista de erros (limitada a max_erros) só é regravada se cresceu
+    if len(importador.errors) != len(tarefa.erros):
+        tarefa.erros = list(importador.errors)
+        campos.append('erros')
+    tarefa.save(update_fields=campos)
+
+
+def executar_tarefa(tarefa_id):
+    """Executa (ou retoma) uma importação, confirmando lote a lote"""
+    try:
+        if not _reservar(tarefa_id):
+            return
+
+        tarefa = TarefaImportacao.objects.select_related(
+            'usuario').get(pk=tarefa_id)
+        with auditoria.agrupar(), tarefa.arquivo.open('rb') as arquivo:
+            importador = importador_para_arquivo(
+                arquivo, nome=tarefa.arquivo.name, modo=tarefa.modo)
+            importador.success_count = tarefa.importados
+            importador.updated_count = tarefa.atualizados
+            importador.errors = list(tarefa.erros)
+            importador.total_erros = len(tarefa.erros)
+            tarefa.total_linhas = importador.total_linhas
+            tarefa.save(update_fields=['total_linhas', 'atualizado_em'])
+
+            importador.processar(
+                tarefa.usuario,
+                apos_linha=tarefa.ultima_linha,
+                ao_confirmar_lote=partial(_registrar_progresso, tarefa)
+            )
+
+        tarefa.status = TarefaImportacao.Status.CONCLUIDA
+        tarefa.erros = importador.errors
+        tarefa.mensagem = (
+            f"{importador.success_count} produtos importados, "
+            f"{importador.updated_count} atualizados "
+            f"({round(importador.linhas_por_segundo)} linhas/s)"
+        )
+        if importador.total_erros > len(importador.errors):
+            tarefa.mensagem += (
+                f"; {importador.total_erros} linhas com erro, exibidas "
+                f"as primeiras {len(importador.errors)}")
+        tarefa.save(update_fields=[
+            'status', 'erros', 'mensagem', 'atualizado_em'])
+
+    except Exception as e:
+        logger.error(
+            f"Erro na importação #{tarefa_id}: {str(e)}", exc_info=True)
+        TarefaImportacao.objects.filter(pk=tarefa_id).update(
+            status=TarefaImportacao.Status.FALHOU,
+            mensagem=str(e),
+            atualizado_em=timezone.now()
+        )
+    finally:
+        connections.close_all()
@@ -1,3 +1,929 @@
-from django.test import TestCase
+import base64
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from . import (
+    analytics, auditoria, cache_analytics, indicadores, reposicao, services
+)
+from .models import (
+    Fornecedor, LogAtividade, ModoImportacao, Movimentacao, Produto,
+    ResumoFornecedor,
+    ResumoMovimentacao, SaldoDiario, SugestaoReposicao
+)
+from .services import (
+    EstoqueInsuficiente, ImportadorProdutos, ImportadorProdutosCSV,
+    ImportadorProdutosParquet, ImportadorProdutosStreaming,
+    MovimentacoesEmLote,
+    estoque_na_data, ingerir_movimentacoes, recalcular_custos,
+    reconstruir_resumos
+)
+from .views import BuscaFornecedoresView, EstoqueBaixoView
 
-# Create your tests here.
+ENTRADA = Movimentacao.TipoMovimentacao.ENTRADA
+SAIDA = Movimentacao.TipoMovimentacao.SAIDA
+
+
+# Versão do cache dos relatórios no locmem, fora do arquivo compartilhado
+@override_settings(ANALYTICS_VERSAO_CACHE='default')
+class EstoqueTestCase(TestCase):
+    def setUp(self):
+        # TestCase não roda os on_commit: sem isto um valor em cache
+        # passaria de um teste para o outro
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fornecedor = Fornecedor.objects.create(
+            nome_empresa='Fornecedor Teste',
+            cnpj='12.345.678/0001-90',
+            telefone='11999999999',
+            endereco='Rua A, 1',
+            nome_contato='Ana',
+        )
+        cls.caneca = Produto.objects.create(
+            nome='Caneca', quantidade=10, quantidade_minima=2,
+            valor_unitario=Decimal('5.00'))
+        cls.camiseta = Produto.objects.create(
+            nome='Camiseta', quantidade=3, quantidade_minima=2,
+            valor_unitario=Decimal('20.00'))
+
+    def movimentar(self, produto, tipo, quantidade, preco='2.00'):
+        # Como a view: a movimentação e o lançamento confirmam juntos
+        with transaction.atomic():
+            return Movimentacao.objects.create(
+                produto=produto,
+                tipo=tipo,
+                quantidade=quantidade,
+                preco_unitario=Decimal(preco),
+                fornecedor=self.fornecedor if tipo == ENTRADA else None,
+            )
+
+    def quantidade(self, produto):
+        return Produto.objects.values_list(
+            'quantidade', flat=True).get(pk=produto.pk)
+
+
+class LancarMovimentacaoTests(EstoqueTestCase):
+    def test_entrada_soma_ao_estoque(self):
+        mov = self.movimentar(self.caneca, ENTRADA, 5)
+        self.assertEqual(self.quantidade(self.caneca), 15)
+        self.assertEqual(mov.produto.quantidade, 15)
+        self.assertEqual(
+            SaldoDiario.objects.get(produto=self.caneca).quantidade, 15)
+
+    def test_consultas_por_movimentacao(self):
+        # INSERT, UPDATE da quantidade, SaldoDiario e resumo; entradas
+        # somam o resumo do fornecedor e as compras. Mais 2 do savepoint
+        # de movimentar()
+        with self.assertNumQueries(6):
+            self.movimentar(self.caneca, SAIDA, 1)
+        with self.assertNumQueries(8):
+            self.movimentar(self.caneca, ENTRADA, 1)
+
+    def test_saida_subtrai_do_estoque(self):
+        self.movimentar(self.caneca, SAIDA, 4)
+        self.assertEqual(self.quantidade(self.caneca), 6)
+
+    def test_saida_de_todo_o_saldo(self):
+        mov = self.movimentar(self.camiseta, SAIDA, 3)
+        self.assertEqual(self.quantidade(self.camiseta), 0)
+        self.assertTrue(mov.produto.estoque_baixo)
+
+    def test_saida_sem_saldo_desfaz_movimentacao(self):
+        with self.assertRaises(EstoqueInsuficiente) as erro:
+            self.movimentar(self.camiseta, SAIDA, 4)
+        self.assertEqual(erro.exception.disponivel, 3)
+        self.assertEqual(self.quantidade(self.camiseta), 3)
+        self.assertFalse(Movimentacao.objects.exists())
+        self.assertFalse(ResumoMovimentacao.objects.exists())
+
+    def test_banco_sem_update_returning(self):
+        with mock.patch.object(
+                services, '_suporta_update_returning', return_value=False):
+            self.movimentar(self.caneca, ENTRADA, 5)
+            self.movimentar(self.caneca, SAIDA, 12)
+            with self.assertRaises(EstoqueInsuficiente):
+                self.movimentar(self.caneca, SAIDA, 4)
+        self.assertEqual(self.quantidade(self.caneca), 3)
+        self.assertEqual(Movimentacao.objects.count(), 2)
+
+    def test_resumos_somam_no_mesmo_dia(self):
+        self.movimentar(self.caneca, ENTRADA, 5, '2.00')
+        self.movimentar(self.caneca, ENTRADA, 3, '4.00')
+        self.movimentar(self.caneca, SAIDA, 2, '6.00')
+
+        entradas = ResumoMovimentacao.objects.get(
+            produto=self.caneca, tipo=ENTRADA)
+        self.assertEqual(entradas.data, timezone.localdate())
+        self.assertEqual(entradas.quantidade, 8)
+        self.assertEqual(entradas.valor, Decimal('22.00'))
+        self.assertEqual(entradas.movimentacoes, 2)
+        saidas = ResumoMovimentacao.objects.get(
+            produto=self.caneca, tipo=SAIDA)
+        self.assertEqual((saidas.quantidade, saidas.valor), (2, 12))
+        fornecedor = ResumoFornecedor.objects.get(fornecedor=self.fornecedor)
+        self.assertEqual((fornecedor.quantidade, fornecedor.valor), (8, 22))
+
+    def test_custo_medio_movel(self):
+        # Custo inicial desconhecido: a primeira entrada define 2.00; a
+        # segunda pondera as 15 unidades em mãos: (15*2 + 30*4) / 45
+        self.movimentar(self.caneca, ENTRADA, 10, '2.00')
+        self.movimentar(self.caneca, SAIDA, 5, '9.00')
+        self.movimentar(self.caneca, ENTRADA, 30, '4.00')
+        self.movimentar(self.camiseta, ENTRADA, 1, '7.50')
+
+        custos = dict(Produto.objects.values_list('pk', 'custo_medio'))
+        self.assertEqual(custos[self.caneca.pk], Decimal('3.3333'))
+        self.assertEqual(custos[self.camiseta.pk], Decimal('7.5'))
+        caneca = Produto.objects.get(pk=self.caneca.pk)
+        self.assertEqual(caneca.quantidade_comprada, 40)
+        self.assertEqual(caneca.valor_comprado, Decimal('140.00'))
+
+        recalcular_custos()
+        self.assertEqual(
+            dict(Produto.objects.values_list('pk', 'custo_medio')), custos)
+
+
+class MovimentacoesEmLoteTests(EstoqueTestCase):
+    def item(self, produto, tipo, quantidade, **extra):
+        return {
+            'produto': produto.pk,
+            'tipo': tipo,
+            'quantidade': quantidade,
+            'preco_unitario': '2.00',
+            'fornecedor': self.fornecedor.pk if tipo == ENTRADA else None,
+            **extra,
+        }
+
+    def test_custo_medio_no_lote_igual_ao_individual(self):
+        lote = MovimentacoesEmLote([
+            self.item(self.caneca, ENTRADA, 10),
+            self.item(self.caneca, SAIDA, 5),
+            self.item(self.caneca, ENTRADA, 30, preco_unitario='4.00'),
+        ])
+        self.assertTrue(lote.executar())
+        caneca = Produto.objects.get(pk=self.caneca.pk)
+        self.assertEqual(caneca.custo_medio, Decimal('3.3333'))
+        self.assertEqual(caneca.quantidade_comprada, 40)
+
+    def test_resumos_incrementais_iguais_a_reconstrucao(self):
+        self.movimentar(self.caneca, ENTRADA, 5, '2.00')
+        self.movimentar(self.camiseta, SAIDA, 1, '20.00')
+        MovimentacoesEmLote([
+            self.item(self.caneca, SAIDA, 4),
+            self.item(self.caneca, ENTRADA, 6, preco_unitario='3.50'),
+            self.item(self.camiseta, ENTRADA, 2),
+        ]).executar()
+
+        def resumos():
+            return (
+                sorted(ResumoMovimentacao.objects.values_list(
+                    'produto', 'data', 'tipo', 'quantidade', 'valor',
+                    'movimentacoes')),
+                sorted(ResumoFornecedor.objects.values_list(
+                    'fornecedor', 'data', 'quantidade', 'valor',
+                    'movimentacoes')),
+            )
+        incrementais = resumos()
+        self.assertEqual(reconstruir_resumos(), [4, 1])
+        self.assertEqual(resumos(), incrementais)
+
+    def test_lote_valido_lanca_tudo(self):
+        lote = MovimentacoesEmLote([
+            self.item(self.caneca, SAIDA, 4),
+            self.item(self.camiseta, ENTRADA, 7),
+        ])
+        self.assertTrue(lote.executar())
+        self.assertEqual(self.quantidade(self.caneca), 6)
+        self.assertEqual(self.quantidade(self.camiseta), 10)
+        self.assertEqual(Movimentacao.objects.count(), 2)
+        self.assertEqual(
+            [r['quantidade_estoque'] for r in lote.resultados], [6, 10])
+        self.assertTrue(all(r['id'] for r in lote.resultados))
+        self.assertEqual(
+            ResumoMovimentacao.objects.get(produto=self.camiseta).quantidade,
+            7)
+
+    def test_saldo_conferido_na_ordem_dos_itens(self):
+        # A saída só cabe depois da entrada que vem antes dela no lote
+        lote = MovimentacoesEmLote([
+            self.item(self.camiseta, ENTRADA, 5),
+            self.item(self.camiseta, SAIDA, 8),
+        ])
+        self.assertTrue(lote.executar())
+        self.assertEqual(self.quantidade(self.camiseta), 0)
+
+    def test_quantidade_estoque_e_o_saldo_apos_cada_linha(self):
+        lote = MovimentacoesEmLote([
+            self.item(self.caneca, SAIDA, 4),
+            self.item(self.camiseta, ENTRADA, 2),
+            self.item(self.caneca, ENTRADA, 1),
+            self.item(self.caneca, SAIDA, 7),
+            self.item(self.camiseta, SAIDA, 1),
+        ], parcial=True)
+        self.assertTrue(lote.executar())
+        self.assertEqual(
+            [r['quantidade_estoque'] for r in lote.resultados],
+            [6, 5, 7, 0, 4])
+
+    def test_lote_com_erro_nao_lanca_nada(self):
+        lote = MovimentacoesEmLote([
+            self.item(self.caneca, ENTRADA, 5),
+            self.item(self.camiseta, SAIDA, 4),
+            {'produto': 999999, 'tipo': SAIDA, 'quantidade': 1,
+             'preco_unitario': '1.00'},
+        ])
+        self.assertFalse(lote.executar())
+        self.assertFalse(lote.resultados[0]['erros'])
+        self.assertIn('quantidade', lote.resultados[1]['erros'])
+        self.assertIn('produto', lote.resultados[2]['erros'])
+        self.assertFalse(Movimentacao.objects.exists())
+        self.assertEqual(self.quantidade(self.caneca), 10)
+        self.assertEqual(self.quantidade(self.camiseta), 3)
+
+    def test_parcial_lanca_so_as_validas(self):
+        lote = MovimentacoesEmLote([
+            self.item(self.caneca, ENTRADA, 5),
+            self.item(self.camiseta, SAIDA, 4),
+            'não é um objeto',
+        ], parcial=True)
+        self.assertTrue(lote.executar())
+        self.assertEqual(lote.aceitas, 1)
+        self.assertEqual([r['linha'] for r in lote.rejeitadas], [2, 3])
+        self.assertEqual(self.quantidade(self.caneca), 15)
+        self.assertEqual(self.quantidade(self.camiseta), 3)
+
+    def test_lote_acima_do_limite(self):
+        with self.settings(MOVIMENTACAO_LOTE_LIMITE=1):
+            lote = MovimentacoesEmLote([
+                self.item(self.caneca, SAIDA, 1),
+                self.item(self.caneca, SAIDA, 1),
+            ])
+            self.assertFalse(lote.executar())
+        self.assertTrue(lote.erro)
+        self.assertFalse(Movimentacao.objects.exists())
+
+    def test_saldo_alterado_entre_leitura_e_update(self):
+        # Outro processo consome o saldo depois da conferência
+        original = MovimentacoesEmLote._conferir
+
+        def conferir(lote, dados, produtos, fornecedores):
+            variacoes = original(lote, dados, produtos, fornecedores)
+            Produto.objects.filter(pk=self.camiseta.pk).update(quantidade=0)
+            return variacoes
+
+        lote = MovimentacoesEmLote([self.item(self.camiseta, SAIDA, 2)])
+        with mock.patch.object(MovimentacoesEmLote, '_conferir', conferir):
+            self.assertFalse(lote.executar())
+        self.assertTrue(lote.erro)
+        self.assertFalse(Movimentacao.objects.exists())
+
+    def test_reenvio_com_a_mesma_chave_nao_lanca_de_novo(self):
+        itens = [
+            self.item(self.caneca, SAIDA, 1, chave='coletor-1:1'),
+            self.item(self.caneca, SAIDA, 2, chave='coletor-1:2'),
+        ]
+        self.assertTrue(MovimentacoesEmLote(itens).executar())
+
+        reenvio = MovimentacoesEmLote(
+            itens + [self.item(self.caneca, SAIDA, 3, chave='coletor-1:3')])
+        self.assertTrue(reenvio.executar())
+        self.assertEqual(reenvio.duplicadas, 2)
+        self.assertEqual(reenvio.aceitas, 1)
+        self.assertEqual(self.quantidade(self.caneca), 4)
+        self.assertEqual(Movimentacao.objects.count(), 3)
+
+    def test_chave_repetida_no_proprio_lote(self):
+        lote = MovimentacoesEmLote([
+            self.item(self.caneca, SAIDA, 1, chave='a'),
+            self.item(self.caneca, SAIDA, 1, chave='a'),
+        ])
+        self.assertTrue(lote.executar())
+        self.assertEqual((lote.aceitas, lote.duplicadas), (1, 1))
+        self.assertEqual(self.quantidade(self.caneca), 9)
+
+    def test_ingestao_ndjson_em_lotes(self):
+        linhas = [
+            b'{"produto": %d, "tipo": "S", "quantidade": 1, '
+            b'"preco_unitario": "1.00", "chave": "n%d"}\n'
+            % (self.caneca.pk, numero)
+            for numero in range(5)
+        ]
+        linhas[2] = b'{quebrado\n'
+        linhas.insert(3, b'\n')
+
+        # Linha em branco não conta como item, mas conta na numeração
+        confirmacoes, resumo = ingerir_movimentacoes(linhas, tamanho_lote=2)
+        self.assertEqual(
+            [c['linhas'] for c in confirmacoes], [[1, 2], [3, 5], [6, 6]])
+        self.assertEqual(confirmacoes[1]['rejeitadas'][0]['linha'], 3)
+        self.assertEqual(
+            (resumo['total'], resumo['aceitas'], resumo['rejeitadas']),
+            (5, 4, 1))
+        self.assertEqual(self.quantidade(self.caneca), 6)
+
+        # Reenvio do mesmo arquivo: tudo duplicado
+        _, resumo = ingerir_movimentacoes(linhas, tamanho_lote=2)
+        self.assertEqual((resumo['aceitas'], resumo['duplicadas']), (0, 4))
+        self.assertEqual(self.quantidade(self.caneca), 6)
+
+
+class ApiMovimentacoesTests(EstoqueTestCase):
+    url = reverse_lazy('movimentacao_lote')
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('coletor', password='senha')
+        self.corpo = json.dumps({'movimentacoes': [{
+            'produto': self.caneca.pk, 'tipo': SAIDA, 'quantidade': 1,
+            'preco_unitario': '2.00',
+        }]})
+
+    def enviar(self, cliente=None, **extra):
+        return (cliente or self.client).post(
+            self.url, self.corpo, content_type='application/json', **extra)
+
+    def basic(self, senha):
+        return 'Basic ' + base64.b64encode(
+            f'coletor:{senha}'.encode()).decode()
+
+    def test_anonimo_recebe_401_em_json(self):
+        resposta = self.enviar()
+        self.assertEqual(resposta.status_code, 401)
+        self.assertIn('erro', resposta.json())
+        self.assertEqual(
+            resposta['WWW-Authenticate'], 'Basic realm="estoque"')
+
+    def test_basic_dispensa_csrf(self):
+        cliente = Client(enforce_csrf_checks=True)
+        resposta = self.enviar(
+            cliente, HTTP_AUTHORIZATION=self.basic('senha'))
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(self.quantidade(self.caneca), 9)
+        self.assertEqual(
+            Movimentacao.objects.get().usuario, self.usuario)
+
+    def test_basic_com_senha_errada(self):
+        resposta = self.enviar(HTTP_AUTHORIZATION=self.basic('errada'))
+        self.assertEqual(resposta.status_code, 401)
+        self.assertEqual(self.quantidade(self.caneca), 10)
+
+    def test_sessao_exige_token_csrf(self):
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.force_login(self.usuario)
+        resposta = self.enviar(cliente)
+        self.assertEqual(resposta.status_code, 403)
+        self.assertIn('erro', resposta.json())
+
+        cliente.get(reverse('nova_movimentacao'))
+        token = cliente.cookies['csrftoken'].value
+        resposta = self.enviar(cliente, HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(resposta.status_code, 201)
+
+
+    def test_ingestao_com_basic(self):
+        url = reverse('ingestao_movimentacoes')
+        corpo = json.dumps({
+            'produto': self.caneca.pk, 'tipo': SAIDA, 'quantidade': 2,
+            'preco_unitario': '2.00', 'chave': 'c1',
+        }) + '\n'
+        resposta = self.client.post(
+            url, corpo, content_type='application/x-ndjson')
+        self.assertEqual(resposta.status_code, 401)
+
+        resposta = Client(enforce_csrf_checks=True).post(
+            url, corpo, content_type='application/x-ndjson',
+            HTTP_AUTHORIZATION=self.basic('senha'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['aceitas'], 1)
+        self.assertEqual(self.quantidade(self.caneca), 8)
+
+
+class CacheAnalyticsTests(EstoqueTestCase):
+    def test_leitura_em_cache_nao_consulta_nem_recalcula(self):
+        calcular = mock.Mock(return_value=[1, 2])
+        self.assertEqual(
+            cache_analytics.obter('serie', (1,), calcular), [1, 2])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                cache_analytics.obter('serie', (1,), calcular), [1, 2])
+        self.assertEqual(calcular.call_count, 1)
+        cache_analytics.obter('serie', (2,), calcular)
+        self.assertEqual(calcular.call_count, 2)
+
+    def test_movimentacao_invalida_depois_do_commit(self):
+        calcular = mock.Mock(return_value=[])
+        cache_analytics.obter('serie', (), calcular)
+        versao = cache_analytics.versao()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movimentar(self.caneca, ENTRADA, 1)
+        self.assertNotEqual(cache_analytics.versao(), versao)
+        cache_analytics.obter('serie', (), calcular)
+        self.assertEqual(calcular.call_count, 2)
+
+    def test_rollback_nao_invalida(self):
+        versao = cache_analytics.versao()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                self.movimentar(self.caneca, ENTRADA, 1)
+                transaction.set_rollback(True)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(cache_analytics.versao(), versao)
+
+    def test_estatisticas_contam_acertos_e_falhas(self):
+        antes = cache_analytics.estatisticas()
+        cache_analytics.obter('serie', (), list)
+        cache_analytics.obter('serie', (), list)
+        depois = cache_analytics.estatisticas()
+        self.assertEqual(depois['acertos'] - antes['acertos'], 1)
+        self.assertEqual(depois['falhas'] - antes['falhas'], 1)
+
+
+class AnalyticsTests(EstoqueTestCase):
+    def test_rotatividade_top_n_no_intervalo(self):
+        hoje = timezone.localdate()
+        self.movimentar(self.caneca, ENTRADA, 5)
+        self.movimentar(self.caneca, SAIDA, 1)
+        self.movimentar(self.camiseta, ENTRADA, 4, '3.00')
+        ResumoMovimentacao.objects.filter(produto=self.camiseta).update(
+            data=hoje - timedelta(days=3))
+
+        mais = analytics.rotatividade(limite=1)
+        self.assertEqual([(r['produto'], r['total_movimentos'],
+                           r['total_quantidade']) for r in mais],
+                         [(self.caneca.pk, 2, 6)])
+        recentes = analytics.rotatividade(inicio=hoje)
+        self.assertEqual([r['nome'] for r in recentes], ['Caneca'])
+
+        # Estoque parado: sem movimentação no intervalo conta como zero
+        parados = analytics.rotatividade(inicio=hoje, menos=True)
+        self.assertEqual(
+            [(r['nome'], r['total_movimentos']) for r in parados],
+            [('Camiseta', 0), ('Caneca', 2)])
+        self.assertEqual(parados[0]['total_valor'], 0)
+
+
+    def test_valor_por_categoria(self):
+        Produto.objects.filter(pk=self.camiseta.pk).update(
+            categoria=Produto.CategoriaProduto.TECIDOS)
+        self.movimentar(self.caneca, ENTRADA, 4)
+        # Caneca 14 x 5.00; camiseta 3 x 20.00; maior valor primeiro
+        self.assertEqual(analytics.valor_por_categoria(), {
+            'total': Decimal('130.00'),
+            'categorias': [
+                {'categoria': 'OUTROS', 'rotulo': 'Outros',
+                 'valor': Decimal('70.00')},
+                {'categoria': 'TECIDOS', 'rotulo': 'Tecidos',
+                 'valor': Decimal('60.00')},
+            ],
+        })
+
+
+class AnalyticsSerieTests(EstoqueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(
+            User.objects.create_user('painel', password='x'))
+
+    def test_etag_responde_304_ate_a_proxima_movimentacao(self):
+        url = reverse('analytics_serie', args=['totais'])
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json(), {'serie': 'totais', 'dados': {
+            'total_estoque': 13, 'baixo_estoque': 0}})
+        etag = resposta['ETag']
+
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movimentar(self.caneca, ENTRADA, 2)
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+        self.assertEqual(resposta.json()['dados']['total_estoque'], 15)
+
+    def test_serie_desconhecida(self):
+        resposta = self.client.get(
+            reverse('analytics_serie', args=['inexistente']))
+        self.assertEqual(resposta.status_code, 404)
+
+
+class EstoqueBaixoTests(EstoqueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(
+            User.objects.create_user('baixo', password='x'))
+
+    def test_flag_acompanha_as_movimentacoes(self):
+        self.assertFalse(Produto.objects.filter(estoque_baixo=True).exists())
+        self.movimentar(self.camiseta, SAIDA, 1)
+        self.movimentar(self.caneca, SAIDA, 9)
+        self.assertEqual(
+            self.client.get(reverse('total_estoque_baixo')).json(),
+            {'total': 2})
+        resposta = self.client.get(reverse('estoque_baixo')).json()
+        self.assertEqual(resposta['resultados'], [
+            {'id': self.camiseta.pk, 'nome': 'Camiseta', 'quantidade': 2,
+             'quantidade_minima': 2},
+            {'id': self.caneca.pk, 'nome': 'Caneca', 'quantidade': 1,
+             'quantidade_minima': 2},
+        ])
+        self.assertFalse(resposta['mais'])
+
+        self.movimentar(self.caneca, ENTRADA, 5)
+        self.assertEqual(
+            self.client.get(reverse('total_estoque_baixo')).json(),
+            {'total': 1})
+
+    def test_paginas(self):
+        Produto.objects.update(quantidade=0)
+        with mock.patch.object(EstoqueBaixoView, 'por_pagina', 1):
+            primeira = self.client.get(reverse('estoque_baixo')).json()
+            segunda = self.client.get(
+                reverse('estoque_baixo'), {'pagina': 2}).json()
+        self.assertEqual(
+            [p['nome'] for p in primeira['resultados']], ['Camiseta'])
+        self.assertTrue(primeira['mais'])
+        self.assertEqual(
+            [p['nome'] for p in segunda['resultados']], ['Caneca'])
+        self.assertFalse(segunda['mais'])
+
+
+class IndicadoresTests(EstoqueTestCase):
+    def tabela(self):
+        produtos = pd.DataFrame({
+            'id': [1, 2, 3, 4],
+            'nome': ['a', 'b', 'c', 'd'],
+            'categoria': ['OUTROS'] * 4,
+            'quantidade': [10, 20, 0, 5],
+            'valor_unitario': [1.0, 1.0, 1.0, 2.0],
+        })
+        movimentos = pd.DataFrame.from_records([
+            (1, SAIDA, 10, 85.0),
+            (2, SAIDA, 5, 12.0),
+            (2, ENTRADA, 10, 30.0),
+            (3, SAIDA, 1, 3.0),
+        ], columns=['produto', 'tipo', 'quantidade', 'valor'])
+        return indicadores.calcular(produtos, movimentos, dias=10)
+
+    def test_abc_giro_e_cobertura(self):
+        tabela = self.tabela()
+        # 85%, 97% e 100% do valor consumido; o produto 4 não consumiu
+        self.assertEqual(list(tabela['classe_abc']), ['A', 'B', 'C', 'C'])
+        self.assertEqual(
+            list(tabela['participacao_acumulada'][:3]), [0.85, 0.97, 1.0])
+        # Estoque médio: (2 * atual - entradas + saídas) / 2
+        self.assertEqual(list(tabela['giro'][:3]), [0.67, 0.29, 2.0])
+        self.assertEqual(
+            list(tabela['consumo_medio_diario'][:3]), [1.0, 0.5, 0.1])
+        self.assertEqual(
+            list(tabela['dias_cobertura'][:3]), [10.0, 40.0, 0.0])
+        self.assertTrue(tabela.loc[4, ['giro', 'dias_cobertura']].isna().all())
+        self.assertEqual(tabela.loc[4, 'valor_estoque'], 10.0)
+
+    def test_curva_abc_e_menor_cobertura(self):
+        tabela = self.tabela()
+        self.assertEqual(indicadores.curva_abc(tabela), [
+            {'classe': 'A', 'produtos': 1, 'valor': 85.0,
+             'participacao': 85.0},
+            {'classe': 'B', 'produtos': 1, 'valor': 12.0,
+             'participacao': 12.0},
+            {'classe': 'C', 'produtos': 2, 'valor': 3.0,
+             'participacao': 3.0},
+        ])
+        menores = indicadores.menor_cobertura(tabela, limite=2)
+        self.assertEqual([m['produto'] for m in menores], [3, 1])
+
+    def test_painel_calcula_a_tabela_uma_vez(self):
+        with mock.patch.object(
+                indicadores, 'indicadores',
+                wraps=indicadores.indicadores) as calcular:
+            analytics.curva_abc()
+            analytics.menor_cobertura(limite=5)
+        self.assertEqual(calcular.call_count, 1)
+
+
+class ReposicaoTests(EstoqueTestCase):
+    def test_calculo_das_sugestoes(self):
+        # Saídas de 4 e 2 em 4 dias: média 1.5, desvio √(20/4 - 1.5²)
+        saidas = pd.DataFrame(
+            {'produto': [1, 1], 'quantidade': [4, 2]})
+        tabela = reposicao.calcular(
+            [1, 2], saidas, dias=4, prazo=4, fator_servico=2, ciclo=10)
+        self.assertEqual(tabela.loc[1, 'demanda_media_diaria'], 1.5)
+        self.assertEqual(tabela.loc[1, 'desvio_padrao_diario'], 1.658)
+        self.assertEqual(tabela.loc[1, 'estoque_seguranca'], 7)
+        self.assertEqual(tabela.loc[1, 'ponto_reposicao'], 13)
+        self.assertEqual(tabela.loc[1, 'estoque_alvo'], 28)
+        self.assertEqual(tabela.loc[2].sum(), 0)
+
+    def test_recalcular_exige_staff(self):
+        usuario = User.objects.create_user('operador', password='x')
+        self.client.force_login(usuario)
+        url = reverse('sugestoes_reposicao')
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.assertFalse(SugestaoReposicao.objects.exists())
+
+        usuario.is_staff = True
+        usuario.save()
+        self.assertRedirects(self.client.post(url), url)
+        self.assertEqual(SugestaoReposicao.objects.count(), 2)
+
+
+class ImportadorProdutosTests(EstoqueTestCase):
+    importador = ImportadorProdutos
+
+    # Linha 3: quantidade inválida; linha 4: categoria inválida
+    planilha = pd.DataFrame({
+        'Nome': ['Lápis', 'Borracha', 'Régua', 'Caneta', 'Estojo'],
+        'Quantidade': [5, 'x', 2, 3, 8],
+        'Valor Unitário': [1.5, 1.0, 1.0, 2.5, 12.0],
+        'Categoria': ['Outros', 'OUTROS', 'Inexistente', 'TECIDOS', 'outros'],
+    })
+
+    def arquivo(self, planilha):
+        arquivo = io.BytesIO()
+        planilha.to_excel(arquivo, index=False)
+        arquivo.seek(0)
+        return arquivo
+
+    def importar(self, planilha=None, **kwargs):
+        kwargs.setdefault('processos', 1)
+        arquivo = self.arquivo(
+            self.planilha if planilha is None else planilha)
+        # Sem o log de cada linha com erro na saída dos testes
+        with mock.patch.object(services, 'logger'):
+            return self.importador(
+                arquivo, batch_size=2, **kwargs).executar(None)
+
+    def test_importa_validas_e_relata_erros_por_linha(self):
+        resultado = self.importar()
+        self.assertEqual(resultado['success_count'], 3)
+        self.assertEqual(resultado['linhas_processadas'], 5)
+        self.assertEqual(
+            [(e['linha'], e['erro']) for e in resultado['errors']],
+            [(3, 'Quantidade deve ser numérica'), (4, 'Categoria inválida')])
+        self.assertEqual(resultado['total_erros'], 2)
+        lapis = Produto.objects.get(nome='Lápis')
+        self.assertEqual(
+            (lapis.nome_normalizado, lapis.quantidade, lapis.categoria,
+             lapis.quantidade_minima),
+            ('lapis', 5, 'OUTROS', ImportadorProdutos.DEFAULT_MIN_STOCK))
+        self.assertEqual(
+            Produto.objects.get(nome='Caneta').valor_unitario,
+            Decimal('2.50'))
+
+    def test_atualizar_pelo_nome_normalizado(self):
+        # Nome repetido no mesmo lote: vale a última linha
+        planilha = pd.DataFrame({
+            'Nome': ['Agenda', 'Agenda', 'CANECA'],
+            'Quantidade': [1, 7, 40],
+            'Valor Unitário': [9.9, 9.9, 6.0],
+            'Categoria': ['OUTROS'] * 3,
+        })
+        resultado = self.importar(planilha, modo=ModoImportacao.ATUALIZAR)
+        self.assertEqual(resultado['success_count'], 1)
+        self.assertEqual(resultado['updated_count'], 1)
+        caneca = Produto.objects.get(pk=self.caneca.pk)
+        self.assertEqual(
+            (caneca.nome, caneca.quantidade, caneca.valor_unitario),
+            ('CANECA', 40, Decimal('6.00')))
+        self.assertEqual(Produto.objects.get(nome='Agenda').quantidade, 7)
+        self.assertEqual(Produto.objects.count(), 3)
+
+    @override_settings(IMPORTACAO_MAX_ERROS=1)
+    def test_erros_alem_do_limite_so_contam(self):
+        resultado = self.importar()
+        self.assertEqual(len(resultado['errors']), 1)
+        self.assertEqual(resultado['total_erros'], 2)
+
+    def test_colunas_obrigatorias(self):
+        with self.assertRaisesMessage(ValueError, 'Categoria'):
+            self.importar(self.planilha.drop(columns='Categoria'))
+
+
+    @override_settings(IMPORTACAO_PARALELO_MIN_LINHAS=1)
+    def test_validacao_em_processos_mantem_a_ordem(self):
+        resultado = self.importar(processos=2)
+        self.assertEqual(resultado['success_count'], 3)
+        self.assertEqual(
+            [e['linha'] for e in resultado['errors']], [3, 4])
+
+
+class ImportadorStreamingTests(ImportadorProdutosTests):
+    importador = ImportadorProdutosStreaming
+
+
+class ImportadorCSVTests(ImportadorProdutosTests):
+    importador = ImportadorProdutosCSV
+
+    def arquivo(self, planilha):
+        return io.BytesIO(planilha.to_csv(index=False).encode())
+
+    def test_ponto_e_virgula_e_windows_1252(self):
+        # Como o Excel em português salva: ";", vírgula decimal e cp1252
+        arquivo = io.BytesIO(
+            'Nome;Quantidade;Valor Unitário;Categoria\n'
+            'Régua;4;3,75;OUTROS\n'.encode('cp1252'))
+        resultado = ImportadorProdutosCSV(arquivo).executar(None)
+        self.assertEqual(resultado['success_count'], 1)
+        regua = Produto.objects.get(nome='Régua')
+        self.assertEqual(regua.valor_unitario, Decimal('3.75'))
+
+
+class ImportadorParquetTests(ImportadorProdutosTests):
+    importador = ImportadorProdutosParquet
+
+    def arquivo(self, planilha):
+        arquivo = io.BytesIO()
+        # Parquet não guarda colunas com tipos misturados
+        planilha.astype({'Quantidade': str}).to_parquet(arquivo, index=False)
+        arquivo.seek(0)
+        return arquivo
+
+
+class RastreioAlteracoesTests(EstoqueTestCase):
+    def test_salvar_produto_nao_consulta_o_nome_antigo(self):
+        caneca = Produto.objects.get(pk=self.caneca.pk)
+        caneca.valor_unitario = Decimal('7.00')
+        with self.assertNumQueries(1):
+            caneca.save()
+
+        caneca.nome = 'Caneca Ágata'
+        caneca.quantidade = 1
+        # UPDATE e o saldo do dia, que só é gravado se a quantidade mudou
+        with self.assertNumQueries(2):
+            caneca.save()
+        self.assertEqual(caneca.nome_normalizado, 'caneca agata')
+        self.assertTrue(caneca.estoque_baixo)
+        self.assertEqual(caneca.campos_alterados(), {})
+
+
+class AuditoriaTests(EstoqueTestCase):
+    def salvar(self, objeto, **campos):
+        with self.captureOnCommitCallbacks(execute=True):
+            for campo, valor in campos.items():
+                setattr(objeto, campo, valor)
+            objeto.save()
+
+    def test_grava_depois_do_commit_e_descarta_no_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                auditoria.registrar(None, 'E', 'Produto', 1)
+                transaction.set_rollback(True)
+            auditoria.registrar(None, 'E', 'Produto', 2)
+            self.assertFalse(LogAtividade.objects.exists())
+        self.assertEqual(
+            list(LogAtividade.objects.values_list('objeto_id', flat=True)),
+            ['2'])
+
+    def test_edicao_registra_so_os_campos_alterados(self):
+        caneca = Produto.objects.get(pk=self.caneca.pk)
+        self.salvar(caneca, valor_unitario=Decimal('6.00'), nome='Caneca')
+        log = LogAtividade.objects.get()
+        self.assertEqual(log.acao, LogAtividade.Acao.EDICAO)
+        self.assertEqual(
+            log.detalhes['alteracoes'], {'valor_unitario': ['5.00', '6.00']})
+
+    def test_salvar_sem_mudanca_nao_registra(self):
+        self.salvar(Produto.objects.get(pk=self.caneca.pk))
+        self.salvar(Fornecedor.objects.get(pk=self.fornecedor.pk))
+        self.assertFalse(LogAtividade.objects.exists())
+
+    def test_login_nao_registra_e_senha_fica_mascarada(self):
+        usuario = User.objects.create_user('auditado', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(
+                self.client.login(username='auditado', password='x'))
+        self.assertFalse(LogAtividade.objects.exists())
+
+        usuario = User.objects.get(pk=usuario.pk)
+        usuario.set_password('y')
+        self.salvar(usuario)
+        self.assertEqual(
+            LogAtividade.objects.get().detalhes['alteracoes'],
+            {'password': ['***', '***']})
+
+    def test_operacao_em_lote_resume_contagens_e_faixa(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with auditoria.operacao_em_lote(descricao='Reajuste'):
+                for produto in Produto.objects.order_by('pk'):
+                    produto.valor_unitario += 1
+                    produto.save()
+        log = LogAtividade.objects.get()
+        self.assertEqual(log.acao, LogAtividade.Acao.EDICAO)
+        self.assertEqual(log.modelo_afetado, 'Produto')
+        self.assertEqual(
+            log.objeto_id, f'{self.caneca.pk}-{self.camiseta.pk}')
+        self.assertEqual(log.detalhes['descricao'], 'Reajuste')
+        self.assertEqual(log.detalhes['modelos'], {'Produto': {'E': {
+            'total': 2, 'id_min': self.caneca.pk,
+            'id_max': self.camiseta.pk,
+        }}})
+
+    def test_operacao_em_lote_com_varios_modelos(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with auditoria.operacao_em_lote():
+                Produto.objects.filter(pk=self.caneca.pk).delete()
+                self.salvar(Fornecedor.objects.get(pk=self.fornecedor.pk),
+                            telefone='11888888888')
+        log = LogAtividade.objects.get()
+        self.assertEqual(log.modelo_afetado, 'Produto, Fornecedor')
+        self.assertEqual(log.objeto_id, '')
+        self.assertEqual(
+            log.detalhes['modelos']['Produto']['D']['total'], 1)
+
+    def test_agrupar_grava_num_unico_insert(self):
+        with self.assertNumQueries(1), auditoria.agrupar():
+            with self.captureOnCommitCallbacks(execute=True):
+                for pk in range(3):
+                    auditoria.registrar(None, 'C', 'Produto', pk)
+        self.assertEqual(LogAtividade.objects.count(), 3)
+
+
+class SaldoDiarioTests(EstoqueTestCase):
+    def saldo_de_hoje(self, produto):
+        return SaldoDiario.objects.get(
+            produto=produto, data=timezone.localdate()).quantidade
+
+    def test_edicao_da_quantidade_grava_o_saldo(self):
+        self.movimentar(self.caneca, SAIDA, 2)
+        produto = Produto.objects.get(pk=self.caneca.pk)
+        produto.quantidade = 100
+        produto.save()
+        self.assertEqual(self.saldo_de_hoje(self.caneca), 100)
+        self.assertEqual(
+            estoque_na_data(timezone.localdate(), self.caneca.pk), 100)
+
+    def test_edicao_sem_mudar_quantidade_nao_grava(self):
+        produto = Produto.objects.get(pk=self.caneca.pk)
+        SaldoDiario.objects.filter(produto=produto).delete()
+        produto.valor_unitario = Decimal('6.00')
+        produto.save()
+        self.assertFalse(SaldoDiario.objects.filter(produto=produto).exists())
+
+    def test_produto_novo_grava_o_saldo(self):
+        produto = Produto.objects.create(nome='Caderno', quantidade=4)
+        self.assertEqual(self.saldo_de_hoje(produto), 4)
+
+    def test_importacao_atualizando_grava_o_saldo(self):
+        arquivo = io.BytesIO(
+            'Nome,Quantidade,Valor Unitário,Categoria\n'
+            'caneca,40,5.00,OUTROS\n'
+            'Agenda,7,9.90,OUTROS\n'.encode())
+        ImportadorProdutosCSV(
+            arquivo, modo=ModoImportacao.ATUALIZAR).executar(None)
+        self.assertEqual(self.saldo_de_hoje(self.caneca), 40)
+        self.assertEqual(
+            self.saldo_de_hoje(Produto.objects.get(nome='Agenda')), 7)
+
+    def test_saldo_em_data_anterior(self):
+        ontem = timezone.localdate() - timedelta(days=1)
+        Produto.objects.filter(pk=self.caneca.pk).update(
+            criado_em=timezone.now() - timedelta(days=1))
+        SaldoDiario.objects.filter(produto=self.caneca).update(data=ontem)
+        self.movimentar(self.caneca, ENTRADA, 5)
+        self.assertEqual(estoque_na_data(ontem, self.caneca.pk), 10)
+        self.assertEqual(
+            estoque_na_data(timezone.localdate(), self.caneca.pk), 15)
+        self.assertEqual(
+            estoque_na_data(ontem - timedelta(days=1), self.caneca.pk), None)
+
+
+class BuscaOpcoesTests(EstoqueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(
+            User.objects.create_user('busca', password='x'))
+
+    def test_busca_produtos_sem_acento_nem_caixa(self):
+        Produto.objects.create(nome='Camisa Algodão')
+        resposta = self.client.get(
+            reverse('buscar_produtos'), {'q': 'ALGODAO'}).json()
+        self.assertEqual(
+            [r['texto'] for r in resposta['resultados']],
+            ['Camisa Algodão (Outros)'])
+        self.assertFalse(resposta['mais'])
+
+    def test_busca_fornecedores_paginada(self):
+        with mock.patch.object(BuscaFornecedoresView, 'por_pagina', 1):
+            Fornecedor.objects.create(
+                nome_empresa='Outro Fornecedor', cnpj='98.765.432/0001-10',
+                telefone='11988888888', endereco='Rua B, 2',
+                nome_contato='Bia')
+            resposta = self.client.get(
+                reverse('buscar_fornecedores'), {'q': 'fornecedor'}).json()
+        self.assertEqual(
+            [r['id'] for r in resposta['resultados']], [self.fornecedor.pk])
+        self.assertTrue(resposta['mais'])
@@ -9,8 +9,12 @@ from .views import (
     ProdutoUpdateView,
     ProdutoDeleteView,
     MovimentacaoCreateView,
+    MovimentacaoLoteView,
+    IngestaoMovimentacoesView,
     AnalyticsView,
     ImportarProdutosView,
+    StatusImportacaoView,
+    ProgressoImportacaoView,
     FornecedorListView,
     FornecedorCreateView,
     FornecedorUpdateView,
@@ -25,6 +29,10 @@ urlpatterns = [
     # Autocomplete
     path('buscar-autocomplete/', views.buscar_autocomplete,
          name='buscar_autocomplete'),
+    path('buscar/produtos/', views.BuscaProdutosView.as_view(),
+         name='buscar_produtos'),
+    path('buscar/fornecedores/', views.BuscaFornecedoresView.as_view(),
+         name='buscar_fornecedores'),
 
     # Home
     path('', HomeView.as_view(), name='home'),
@@ -36,19 +44,37 @@ urlpatterns = [
          name='editar_produto'),
     path('excluir/<int:pk>/', ProdutoDeleteView.as_view(),
          name='excluir_produto'),
+    path('produtos/estoque-baixo/', views.EstoqueBaixoView.as_view(),
+         name='estoque_baixo'),
+    path('produtos/estoque-baixo/total/',
+         views.TotalEstoqueBaixoView.as_view(), name='total_estoque_baixo'),
+    path('produtos/reposicao/', views.SugestoesReposicaoView.as_view(),
+         name='sugestoes_reposicao'),
     path('produtos/excluir-todos/', ExcluirTodosProdutosView.as_view(),
          name='excluir_todos_produtos'),
 
     # Movimentações
     path('movimentar/', MovimentacaoCreateView.as_view(),
          name='nova_movimentacao'),
+    path('movimentar/lote/', MovimentacaoLoteView.as_view(),
+         name='movimentacao_lote'),
+    path('movimentar/ingestao/', IngestaoMovimentacoesView.as_view(),
+         name='ingestao_movimentacoes'),
 
     # Analytics
     path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('analytics/dados/<slug:serie>/', views.AnalyticsSerieView.as_view(),
+         name='analytics_serie'),
+    path('analytics/indicadores.csv', views.IndicadoresCSVView.as_view(),
+         name='indicadores_csv'),
 
     # Importação
     path('importar/', ImportarProdutosView.as_view(),
          name='importar_produtos'),
+    path('importar/<int:pk>/', StatusImportacaoView.as_view(),
+         name='status_importacao'),
+    path('importar/<int:pk>/progresso/', ProgressoImportacaoView.as_view(),
+         name='progresso_importacao'),
 
     # Fornecedores
     path('fornecedores/', FornecedorListView.as_view(),
@@ -0,0 +1,99 @@
+"""
+Validação e normalização das linhas de importação de produtos.
+
+Este módulo não importa nada do Django de propósito: as funções rodam
+em processos separados (ProcessPoolExecutor com spawn) sem precisar
+configurar o projeto em cada worker.
+"""
+import pandas as pd
+from unidecode import unidecode
+
+
+def normalizar_nome(nomes):
+    """Mesma normalização de Produto.save, aplicada a uma coluna inteira"""
+    return nomes.map(unidecode).str.lower()
+
+
+def validar_produtos(df, categorias, coluna_minima, estoque_minimo_padrao):
+    """
+    Valida e normaliza o DataFrame coluna a coluna.
+
+    O índice de df deve ser o número da linha na planilha
+    (cabeçalho = linha 1). categorias mapeia o texto sem acento e em
+    maiúsculas para o valor de Produto.CategoriaProduto.
+
+    Retorna (validos, erros): um DataFrame só com as linhas válidas, já
+    convertidas para os tipos do modelo, e a lista de erros no formato
+    exibido em importar_produtos.html, em ordem de linha.
+    """
+    erros = pd.Series(pd.NA, index=df.index, dtype='object')
+
+    def marcar(mascara, mensagem):
+        # Mantém apenas o primeiro erro encontrado em cada linha
+        erros[mascara.fillna(False).astype(bool) & erros.isna()] = mensagem
+
+    nome = df['Nome'].astype('string').str.strip()
+    marcar(
+        df[['Nome', 'Quantidade', 'Valor Unitário', 'Categoria']]
+        .isna().any(axis=1) | nome.eq(''),
+        "Campos obrigatórios ausentes"
+    )
+    marcar(nome.str.len() > 100, "Nome excede 100 caracteres")
+
+    quantidade = pd.to_numeric(df['Quantidade'], errors='coerce')
+    marcar(quantidade.isna(), "Quantidade deve ser numérica")
+    marcar(quantidade % 1 != 0, "Quantidade deve ser um número inteiro")
+    marcar(quantidade < 0, "Quantidade não pode ser negativa")
+
+    valor = pd.to_numeric(df['Valor Unitário'], errors='coerce')
+    marcar(valor.isna(), "Valor unitário deve ser numérico")
+    marcar(valor < 0, "Valor unitário não pode ser negativo")
+
+    if coluna_minima in df.columns:
+        minima = pd.to_numeric(
+            df[coluna_minima], errors='coerce'
+        ).fillna(estoque_minimo_padrao)
+    else:
+        minima = pd.Series(estoque_minimo_padrao, index=df.index)
+    marcar(minima % 1 != 0, "Quantidade mínima deve ser um número inteiro")
+    marcar(minima < 1, "Quantidade mínima deve ser maior que zero")
+
+    categoria_bruta = df['Categoria'].astype('string').str.strip()
+    # Poucos valores distintos: normaliza cada um uma vez só
+    categoria = categoria_bruta.map({
+        texto: categorias.get(unidecode(texto).upper())
+        for texto in categoria_bruta.dropna().unique()
+    })
+    marcar(
+        categoria.isna() & categoria_bruta.notna(),
+        "Categoria inválida"
+    )
+
+    invalidas = erros.notna()
+    linhas_invalidas = df[invalidas]
+    dados = linhas_invalidas.astype(str).where(
+        linhas_invalidas.notna()).to_dict('records')
+    lista_erros = [
+        {
+            'linha': int(linha),
+            'erro': erro,
+            'dados': {
+                coluna: valor for coluna, valor in registro.items()
+                if isinstance(valor, str)
+            }
+        }
+        for linha, erro, registro in zip(
+            linhas_invalidas.index, erros[invalidas], dados)
+    ]
+
+    validas = ~invalidas
+    nome = nome[validas]
+    validos = pd.DataFrame({
+        'nome': nome,
+        'nome_normalizado': normalizar_nome(nome),
+        'quantidade': quantidade[validas].astype('int64'),
+        'quantidade_minima': minima[validas].astype('int64'),
+        'valor_unitario': valor[validas].round(2),
+        'categoria': categoria[validas],
+    })
+    return validos, lista_erros
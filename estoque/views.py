@@ -1,8 +1,12 @@
+import base64
+import binascii
+import json
 import logging
 from django.db import transaction
-from django.http import JsonResponse, HttpRequest, HttpResponse
-from django.shortcuts import render, redirect
+from django.http import JsonResponse, HttpRequest, HttpResponse, Http404
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views import View
@@ -10,19 +14,29 @@ from django.views.generic import (
     ListView, CreateView, UpdateView, DeleteView, TemplateView
 )
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.db.models import (
-    Q, F, Sum, Count, DateField
+    Q, F, Max
 )
-from django.db.models.functions import Trunc
 from unidecode import unidecode
 import pandas as pd
 
-from .models import Produto, Movimentacao, Fornecedor, LogAtividade
+from .models import (
+    Produto, Movimentacao, Fornecedor, LogAtividade, TarefaImportacao,
+    SugestaoReposicao
+)
 from .forms import (
     ProdutoForm, MovimentacaoForm, EditarPerfilForm,
-    ImportarProdutosForm, FornecedorForm
+    ImportarProdutosForm, FornecedorForm, FiltroAnalyticsForm
+)
+from . import analytics, cache_analytics, indicadores, reposicao, tarefas
+from .auditoria import operacao_em_lote
+from .services import (
+    EstoqueInsuficiente, MovimentacoesEmLote, ingerir_movimentacoes
 )
-from .services import ImportadorProdutos
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +47,47 @@ class SuperUserRequiredMixin(UserPassesTestMixin):
     def test_func(self):
         return self.request.user.is_superuser
 
+# Autenticação das APIs JSON (scripts e coletores)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AutenticacaoApiMixin:
+    """
+    Aceita HTTP Basic (usuário e senha, sem CSRF), para scripts e
+    coletores, ou a sessão do navegador, que precisa enviar o token CSRF
+    no cabeçalho X-CSRFToken. Sem credenciais válidas responde 401 em
+    JSON, em vez de redirecionar para a página de login.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        cabecalho = request.META.get('HTTP_AUTHORIZATION', '')
+        if cabecalho.startswith('Basic '):
+            usuario = self._autenticar_basic(request, cabecalho[6:])
+            if usuario is None:
+                return self._nao_autenticado()
+            request.user = usuario
+        elif not request.user.is_authenticated:
+            return self._nao_autenticado()
+        elif CsrfViewMiddleware(lambda r: None).process_view(
+                request, None, (), {}) is not None:
+            return JsonResponse(
+                {'erro': 'Token CSRF ausente ou inválido'}, status=403)
+        return super().dispatch(request, *args, **kwargs)
+
+    def _autenticar_basic(self, request, credenciais):
+        try:
+            usuario, _, senha = base64.b64decode(
+                credenciais, validate=True).decode().partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        return authenticate(request, username=usuario, password=senha)
+
+    def _nao_autenticado(self):
+        resposta = JsonResponse(
+            {'erro': 'Autenticação necessária'}, status=401)
+        resposta['WWW-Authenticate'] = 'Basic realm="estoque"'
+        return resposta
+
 # Página inicial
 
 
@@ -50,15 +105,24 @@ class ProdutoListView(LoginRequiredMixin, ListView):
     paginate_by = 20
     ordering = 'nome'
 
-    VALID_SORT_FIELDS = {'nome', 'quantidade', 'valor_unitario', 'categoria'}
+    VALID_SORT_FIELDS = {
+        'nome', 'quantidade', 'valor_unitario', 'valor_total', 'categoria'
+    }
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Sugestão gravada por calcular_reposicao (LEFT JOIN, sem recalcular)
+        queryset = super().get_queryset().annotate(
+            valor_total=analytics.VALOR_ESTOQUE,
+            ponto_reposicao=F('sugestao__ponto_reposicao'),
+            quantidade_repor=F('sugestao__estoque_alvo') - F('quantidade'),
+        )
         search_query = self.request.GET.get('q', '')
         sort_field = self.request.GET.get('sort', self.ordering)
         sort_direction = self.request.GET.get('dir', 'asc')
 
         # Filtro
+        if self.request.GET.get('baixo'):
+            queryset = queryset.filter(estoque_baixo=True)
         if search_query:
             queryset = queryset.filter(
                 Q(nome__icontains=search_query) |
@@ -78,10 +142,49 @@ class ProdutoListView(LoginRequiredMixin, ListView):
         context.update({
             'search_query': self.request.GET.get('q', ''),
             'current_sort': self.request.GET.get('sort', self.ordering),
-            'current_dir': self.request.GET.get('dir', 'asc')
+            'current_dir': self.request.GET.get('dir', 'asc'),
+            'somente_baixo': bool(self.request.GET.get('baixo')),
         })
         return context
 
+# Sugestões de reposição
+
+
+class SugestoesReposicaoView(LoginRequiredMixin, ListView):
+    """Produtos no ponto de reposição ou abaixo, com a quantidade a pedir"""
+    template_name = 'estoque/reposicao.html'
+    context_object_name = 'produtos'
+    paginate_by = 20
+
+    def get_queryset(self):
+        return Produto.objects.filter(
+            quantidade__lte=F('sugestao__ponto_reposicao'),
+            sugestao__estoque_alvo__gt=F('quantidade'),
+        ).annotate(
+            quantidade_repor=F('sugestao__estoque_alvo') - F('quantidade'),
+        ).select_related('sugestao').order_by('-quantidade_repor', 'nome')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['parametros'] = reposicao.parametros()
+        context['calculado_em'] = SugestaoReposicao.objects.aggregate(
+            ultimo=Max('calculado_em'))['ultimo']
+        return context
+
+    def post(self, request: HttpRequest) -> HttpResponse:
+        # Recalcular regrava as sugestões de todo o catálogo
+        if not request.user.is_staff:
+            return self.handle_no_permission()
+        try:
+            total = reposicao.atualizar_sugestoes()
+            messages.success(
+                request, f"Sugestões recalculadas para {total} produtos!")
+        except Exception as e:
+            logger.error(f"Erro ao calcular reposição: {str(e)}",
+                         exc_info=True)
+            messages.error(request, "Erro ao calcular as sugestões")
+        return redirect('sugestoes_reposicao')
+
 # Novo Produto
 
 
@@ -130,12 +233,71 @@ class MovimentacaoCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.usuario = self.request.user
+        try:
+            # Outra saída pode ter consumido o saldo depois da validação:
+            # o lançamento recusa e nada da movimentação fica gravado
+            with transaction.atomic():
+                response = super().form_valid(form)
+        except EstoqueInsuficiente as e:
+            form.add_error(
+                'quantidade',
+                f"Estoque insuficiente: disponível {e.disponivel}")
+            return self.form_invalid(form)
+
         messages.success(
             self.request,
             f"Movimentação de {form.cleaned_data['quantidade']} \
                 unidades registrada!"
         )
-        return super().form_valid(form)
+        return response
+
+# Lançamento de várias movimentações em JSON
+
+
+class MovimentacaoLoteView(AutenticacaoApiMixin, View):
+    """
+    Recebe {"movimentacoes": [{produto, tipo, quantidade, preco_unitario,
+    fornecedor}, ...]} e lança tudo ou nada, com o resultado por linha.
+    Autenticação como em AutenticacaoApiMixin.
+    """
+
+    def post(self, request: HttpRequest) -> JsonResponse:
+        try:
+            dados = json.loads(request.body)
+        except (ValueError, UnicodeDecodeError):
+            return JsonResponse({'erro': 'JSON inválido'}, status=400)
+
+        itens = dados.get('movimentacoes') if isinstance(dados, dict) \
+            else dados
+        if not isinstance(itens, list) or not itens:
+            return JsonResponse(
+                {'erro': 'Envie uma lista não vazia em "movimentacoes"'},
+                status=400)
+
+        lote = MovimentacoesEmLote(itens, usuario=request.user)
+        lancado = lote.executar()
+        return JsonResponse({
+            'ok': lancado,
+            'erro': lote.erro,
+            'total': len(itens),
+            'resultados': lote.resultados,
+        }, status=201 if lancado else 400)
+
+# Sincronização dos coletores (NDJSON)
+
+
+class IngestaoMovimentacoesView(AutenticacaoApiMixin, View):
+    """
+    Sincronização dos coletores: o corpo é NDJSON (uma movimentação por
+    linha, com "chave" para ignorar reenvios) e é lido em streaming,
+    lote a lote. Autenticação como em AutenticacaoApiMixin; a conferência
+    do CSRF não lê o corpo NDJSON.
+    """
+
+    def post(self, request: HttpRequest) -> JsonResponse:
+        confirmacoes, resumo = ingerir_movimentacoes(
+            request, usuario=request.user)
+        return JsonResponse({'lotes': confirmacoes, **resumo})
 
 # Importar produtos de uma planilha de excel
 
@@ -147,94 +309,180 @@ class ImportarProdutosView(LoginRequiredMixin, View):
     def get(self, request: HttpRequest) -> HttpResponse:
         return render(request, self.template_name, {'form': self.form_class()})
 
-    @transaction.atomic
     def post(self, request: HttpRequest) -> HttpResponse:
         form = self.form_class(request.POST, request.FILES)
-        context = {'form': form}
 
         if not form.is_valid():
-            return render(request, self.template_name, context)
+            return render(request, self.template_name, {'form': form})
 
-        try:
-            importador = ImportadorProdutos(request.FILES['arquivo_excel'])
-            result = importador.executar(request.user)
-
-            if result['errors']:
-                context.update({
-                    'errors': result['errors'],
-                    'success_count': result['success_count']
-                })
-                messages.warning(
-                    request,
-                    f"Importação parcial: {result['success_count']} sucessos, "
-                    f"{len(result['errors'])} erros"
-                )
-            else:
-                messages.success(
-                    request,
-                    f"✅ {result['success_count']} \
-                        produtos importados com sucesso!"
-                )
-                return redirect('lista_produtos')
+        tarefa = TarefaImportacao.objects.create(
+            arquivo=form.cleaned_data['arquivo_excel'],
+            modo=form.cleaned_data['modo'],
+            usuario=request.user
+        )
+        transaction.on_commit(lambda: tarefas.enfileirar(tarefa.pk))
+        messages.info(
+            request, "Importação iniciada! Acompanhe o progresso abaixo.")
+        return redirect('status_importacao', pk=tarefa.pk)
 
-        except Exception as e:
-            logger.error(f"Erro na importação: {str(e)}", exc_info=True)
-            messages.error(request, f"❌ Erro crítico: {str(e)}")
+# Acompanhamento das importações em segundo plano
+
+
+class TarefaImportacaoMixin(LoginRequiredMixin):
+    def get_tarefa(self, pk):
+        tarefas_visiveis = TarefaImportacao.objects.all()
+        if not self.request.user.is_staff:
+            tarefas_visiveis = tarefas_visiveis.filter(
+                usuario=self.request.user)
+        tarefa = get_object_or_404(tarefas_visiveis, pk=pk)
+
+        # Worker reiniciado no meio: retoma da última linha confirmada
+        if tarefas.interrompida(tarefa):
+            tarefas.enfileirar(tarefa.pk)
+        return tarefa
 
-        return render(request, self.template_name, context)
+# Página de status de uma importação
+
+
+class StatusImportacaoView(TarefaImportacaoMixin, View):
+    template_name = 'estoque/status_importacao.html'
+
+    def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        tarefa = self.get_tarefa(pk)
+        return render(request, self.template_name, {
+            'tarefa': tarefa,
+            'errors': tarefa.erros if tarefa.finalizada else [],
+        })
+
+# Progresso de uma importação em JSON
+
+
+class ProgressoImportacaoView(TarefaImportacaoMixin, View):
+    def get(self, request: HttpRequest, pk: int) -> JsonResponse:
+        tarefa = self.get_tarefa(pk)
+        return JsonResponse({
+            'status': tarefa.status,
+            'status_display': tarefa.get_status_display(),
+            'finalizada': tarefa.finalizada,
+            'percentual': tarefa.percentual,
+            'ultima_linha': tarefa.ultima_linha,
+            'total_linhas': tarefa.total_linhas,
+            'importados': tarefa.importados,
+            'atualizados': tarefa.atualizados,
+            'erros': len(tarefa.erros),
+            'mensagem': tarefa.mensagem,
+        })
 
 # Para relatórios
 
 
+def serie_analytics(nome, filtros):
+    """Série do painel (analytics.SERIES) via cache_analytics"""
+    calcular, parametros = analytics.SERIES[nome]
+    valores = tuple(filtros[parametro] for parametro in parametros)
+    return cache_analytics.obter(nome, valores, lambda: calcular(*valores))
+
+
+def _ultima_movimentacao(request, *args, **kwargs):
+    # Calculada uma vez por requisição (ETag e Last-Modified usam)
+    if not hasattr(request, '_ultima_movimentacao'):
+        request._ultima_movimentacao = Movimentacao.objects.aggregate(
+            ultima=Max('data'))['ultima']
+    return request._ultima_movimentacao
+
+
+def _etag_analytics(request, *args, **kwargs):
+    # A versão do cache muda também com edições de produtos e importações
+    ultima = _ultima_movimentacao(request)
+    marca = int(ultima.timestamp() * 1_000_000) if ultima else 0
+    return f'{cache_analytics.versao()}-{marca}'
+
+# Uma série dos relatórios em JSON
+
+
+@method_decorator(condition(
+    etag_func=_etag_analytics, last_modified_func=_ultima_movimentacao
+), name='get')
+class AnalyticsSerieView(LoginRequiredMixin, View):
+    """
+    Uma série do painel em JSON, com os mesmos filtros (GET) da página.
+    Responde 304 enquanto nada mudou desde o ETag/Last-Modified enviado.
+    """
+
+    def get(self, request: HttpRequest, serie: str) -> JsonResponse:
+        if serie not in analytics.SERIES:
+            raise Http404(f"Série desconhecida: {serie}")
+        filtros = FiltroAnalyticsForm(request.GET).filtros()
+        resposta = JsonResponse({
+            'serie': serie,
+            'dados': serie_analytics(serie, filtros),
+        })
+        # O navegador guarda a resposta, mas sempre revalida
+        resposta['Cache-Control'] = 'private, no-cache'
+        return resposta
+
+# Painel de relatórios
+
+
 class AnalyticsView(LoginRequiredMixin, TemplateView):
     template_name = 'estoque/analytics.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        periodo = self.request.GET.get('periodo', 'mensal')
-
-        # Dados Gerais
-        context['total_estoque'] = Produto.objects.aggregate(
-            total=Sum('quantidade'))['total'] or 0
-        context['produtos_baixo_estoque'] = Produto.objects.filter(
-            quantidade__lte=F('quantidade_minima'))
-
-        # Rotatividade corrigida
-        context['rotatividade'] = Produto.objects.annotate(
-            total_movimentos=Count('movimentacoes')
-        ).order_by('-total_movimentos')
-
-        # Definir a função de truncagem corretamente
-        trunc_kwargs = {
-            'anual': ('year', 'Ano'),
-            'mensal': ('month', 'Mês'),
-            'quinzenal': ('day', 'Dia')
-        }.get(periodo, ('month', 'Mês'))
-
-        # Histórico por Período
-        movimentacoes = Movimentacao.objects.annotate(
-            periodo=Trunc('data', trunc_kwargs[0], output_field=DateField())
-        ).values('periodo').annotate(
-            total=Sum('quantidade'),
-            valor_total=Sum(F('quantidade') * F('preco_unitario'))
-        ).order_by('periodo')
+        form = FiltroAnalyticsForm(self.request.GET)
+        filtros = form.filtros()
+        periodo = filtros['periodo']
+
+        # Cada série fica em cache até a próxima movimentação/edição
+        totais = serie_analytics('totais', filtros)
+        context['total_estoque'] = totais['total_estoque']
+        context['total_baixo_estoque'] = totais['baixo_estoque']
+        context['valor_estoque'] = serie_analytics('valor_estoque', filtros)
+
+        context['rotatividade'] = serie_analytics('rotatividade', filtros)
+        context['estoque_parado'] = serie_analytics('estoque_parado', filtros)
 
         # Preparar dados para o gráfico
-        context['chart_labels'] = [m['periodo'].strftime(
-            '%Y-%m-%d') for m in movimentacoes]
-        context['chart_data'] = [m['total'] for m in movimentacoes]
+        historico = serie_analytics('historico', filtros)
+        context['chart_labels'] = [
+            h['periodo'].strftime('%Y-%m-%d') for h in historico]
+        context['chart_data'] = [h['total'] for h in historico]
+
+        context['historico_fornecedores'] = serie_analytics(
+            'fornecedores', filtros)
 
-        # Histórico de Compras
-        context['historico_fornecedores'] = Movimentacao.objects.filter(
-            tipo=Movimentacao.TipoMovimentacao.ENTRADA
-        ).values('fornecedor__nome_empresa').annotate(
-            total_compras=Sum(F('quantidade') * F('preco_unitario'))
-        ).order_by('-total_compras')
+        context['curva_abc'] = serie_analytics('abc', filtros)
+        context['menor_cobertura'] = serie_analytics('cobertura', filtros)
+        context['periodo_indicadores'] = indicadores.periodo(
+            filtros['inicio'], filtros['fim'])
 
         context['periodo_selecionado'] = periodo
+        context['form_filtros'] = form
+        context['limite'] = filtros['n']
+        if self.request.user.is_staff:
+            context['cache_estatisticas'] = cache_analytics.estatisticas()
 
         return context
 
+# Indicadores por produto em CSV
+
+
+class IndicadoresCSVView(LoginRequiredMixin, View):
+    """Tabela completa dos indicadores por produto, em CSV"""
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        filtros = FiltroAnalyticsForm(request.GET).filtros()
+        inicio, fim = indicadores.periodo(filtros['inicio'], filtros['fim'])
+        tabela = analytics.tabela_indicadores(inicio, fim)
+
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = (
+            f'attachment; filename="indicadores_{inicio}_{fim}.csv"')
+        # BOM e ";" para o Excel em português abrir direto
+        response.write('\ufeff')
+        tabela.to_csv(response, sep=';', decimal=',')
+        return response
+
 # Exclusão de todos os produtos
 
 
@@ -243,7 +491,9 @@ class ExcluirTodosProdutosView(SuperUserRequiredMixin, View):
 
     def post(self, request: HttpRequest) -> HttpResponse:
         if request.POST.get('confirmacao') == 'SIM':
-            Produto.objects.all().delete()
+            with operacao_em_lote(usuario=request.user,
+                                  descricao='Exclusão de todos os produtos'):
+                Produto.objects.all().delete()
             messages.success(request, "Todos os produtos foram excluídos!")
             return redirect('lista_produtos')
 
@@ -314,6 +564,103 @@ def buscar_autocomplete(request: HttpRequest) -> JsonResponse:
 
     return JsonResponse(list(produtos), safe=False)
 
+# Produtos com estoque baixo em JSON
+
+
+class EstoqueBaixoView(LoginRequiredMixin, View):
+    """
+    Produtos com estoque baixo em JSON, por nome, paginados como em
+    BuscaOpcoesView. Lê só o índice parcial de estoque_baixo.
+    """
+    por_pagina = 50
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        try:
+            pagina = max(int(request.GET.get('pagina', 1)), 1)
+        except ValueError:
+            pagina = 1
+        inicio = (pagina - 1) * self.por_pagina
+        produtos = list(Produto.objects.filter(
+            estoque_baixo=True
+        ).order_by('nome').values(
+            'id', 'nome', 'quantidade', 'quantidade_minima'
+        )[inicio:inicio + self.por_pagina + 1])
+        return JsonResponse({
+            'resultados': produtos[:self.por_pagina],
+            'mais': len(produtos) > self.por_pagina,
+        })
+
+# Total de produtos com estoque baixo
+
+
+class TotalEstoqueBaixoView(LoginRequiredMixin, View):
+    def get(self, request: HttpRequest) -> JsonResponse:
+        return JsonResponse({
+            'total': Produto.objects.filter(estoque_baixo=True).count()
+        })
+
+# Opções dos selects com busca
+
+
+class BuscaOpcoesView(LoginRequiredMixin, View):
+    """
+    Opções paginadas para os selects com busca (SelectBusca): percorre o
+    índice do campo de busca já em ordem e para na página pedida, sem
+    COUNT; "mais" indica se há próxima página.
+
+    As subclasses definem model, campo_busca e os campos lidos (campos);
+    com normalizar, o campo guarda o texto sem acento e em minúsculas e o
+    termo é normalizado do mesmo jeito.
+    """
+    por_pagina = 20
+    model = None
+    campo_busca = None
+    campos = ()
+    normalizar = False
+
+    def get_queryset(self, termo):
+        if self.normalizar:
+            lookup, termo = 'contains', unidecode(termo).lower()
+        else:
+            lookup = 'icontains'
+        filtro = {f'{self.campo_busca}__{lookup}': termo}
+        return self.model.objects.filter(**filtro).order_by(
+            self.campo_busca).only(*self.campos)
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        termo = request.GET.get('q', '').strip()
+        try:
+            pagina = max(int(request.GET.get('pagina', 1)), 1)
+        except ValueError:
+            pagina = 1
+        inicio = (pagina - 1) * self.por_pagina
+        objetos = list(
+            self.get_queryset(termo)[inicio:inicio + self.por_pagina + 1])
+        return JsonResponse({
+            'resultados': [
+                {'id': obj.pk, 'texto': str(obj)}
+                for obj in objetos[:self.por_pagina]
+            ],
+            'mais': len(objetos) > self.por_pagina,
+        })
+
+# Busca de produtos
+
+
+class BuscaProdutosView(BuscaOpcoesView):
+    model = Produto
+    campo_busca = 'nome_normalizado'
+    campos = ('nome', 'categoria')
+    normalizar = True
+
+# Busca de fornecedores
+
+
+class BuscaFornecedoresView(BuscaOpcoesView):
+    model = Fornecedor
+    campo_busca = 'nome_empresa'
+    campos = ('nome_empresa', 'categoria')
+
 # Lista com as ações ocorridas, por usuários
 
 
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import dj_database_url
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'estoque.middleware.AuditoriaMiddleware',
 ]
 
 ROOT_URLCONF = 'meu_estoque.urls'
@@ -140,6 +142,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = '/analytics/'
 
+# Cache dos relatórios (estoque/cache_analytics.py): os valores ficam
+# no locmem de cada processo e só a versão é compartilhada, num cache em
+# arquivo visto pelos workers e pelos comandos da mesma máquina. Com
+# mais de uma máquina, use redis ou memcached para os dois
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics_versao': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(
+            tempfile.gettempdir(), 'estoque_analytics_versao'),
+    },
+}
+
+ANALYTICS_CACHE = 'default'
+ANALYTICS_VERSAO_CACHE = 'analytics_versao'
+
 DATABASES = {
     'default': dj_database_url.config(default=os.environ.get('DATABASE_URL'))
 }